@@ -0,0 +1,373 @@
+import math
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+
+from aiflows.flow_cache import canonical_hash
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+# models whose name starts with this prefix (or of API keys with backend_used="fake") are served by FakeLLM
+FAKE_MODEL_PREFIX = "fake/"
+# parameters of a request that don't change the response of FakeLLM
+_IGNORED_REQUEST_PARAMS = ("api_key", "api_base", "api_version", "timeout", "request_timeout", "stream")
+_WORDS = (
+    "the flow sends a message to its subflow which replies with an answer that is logged cached and returned "
+    "to the caller after the model has been queried for a response"
+).split()
+
+
+class FakeLLMError(Exception):
+    """An error of FakeLLM, mimicking the errors of the APIs (with a status code and response headers).
+
+    :param message: The error message
+    :type message: str
+    :param status_code: The HTTP status code of the error
+    :type status_code: int
+    :param headers: The response headers (e.g. retry-after)
+    :type headers: Dict[str, str], optional
+    """
+
+    def __init__(self, message: str, status_code: int, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeResponse(dict):
+    """A response of FakeLLM: a dictionary whose keys can also be read as attributes (like the responses of litellm)."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class _SimulatedCall:
+    """The random draws of a call (latencies, errors and generated text), from a generator seeded by the request."""
+
+    def __init__(self, fake_llm: "FakeLLM", params: Dict[str, Any], embeddings_call: bool):
+        self.rng = random.Random(int.from_bytes(fake_llm._get_seed(params), "big"))
+        self.error = None
+        if fake_llm._count_request() or self.rng.random() < fake_llm.rate_limit_error_rate:
+            self.error = FakeLLMError("Rate limit reached (simulated)", 429, {"retry-after": str(fake_llm.retry_after)})
+        elif self.rng.random() < fake_llm.server_error_rate:
+            self.error = FakeLLMError("The server had an error (simulated)", 500)
+
+        self.time_to_first_token = fake_llm._draw_latency(self.rng)
+        if embeddings_call:
+            return
+
+        self.num_prompt_tokens = fake_llm._count_prompt_tokens(params)
+        self.contents = [fake_llm._generate_content(self.rng, params) for _ in range(params.get("n", None) or 1)]
+        self.num_completion_tokens = sum(len(content.split()) for content in self.contents)
+
+
+class FakeLLM:
+    """A deterministic stand-in for the completion and embedding APIs, for load testing flows without calling (and
+    paying for) a real API. It simulates latencies (time to first token drawn from a distribution, then a fixed time
+    per generated token, streamed in chunks), rate limit and server errors, and reports token usage.
+
+    Responses are deterministic: the draws of a call are seeded by seed, the request, and the number of identical
+    requests made before it (so that repeated requests and retries get different draws, reproducibly).
+
+    LiteLLMBackend serves the models whose name starts with "fake/" (or the API keys with backend_used="fake") with a
+    FakeLLM configured by its fake_llm parameter. MockLLMServer serves a FakeLLM over an OpenAI-compatible HTTP API.
+
+    :param latency_distribution: The distribution of the time to first token: "constant", "normal" or "lognormal"
+    :type latency_distribution: str, optional
+    :param latency_mean: The mean time to first token in seconds
+    :type latency_mean: float, optional
+    :param latency_std: The standard deviation of the time to first token in seconds
+    :type latency_std: float, optional
+    :param time_per_token: The time to generate a token in seconds
+    :type time_per_token: float, optional
+    :param completion_tokens: The number of tokens (words) of a generated message
+    :type completion_tokens: int, optional
+    :param chunk_tokens: The number of tokens per chunk of a streamed response
+    :type chunk_tokens: int, optional
+    :param echo: Whether generated messages repeat the last message of the request (instead of random words)
+    :type echo: bool, optional
+    :param embedding_dim: The dimension of the embeddings
+    :type embedding_dim: int, optional
+    :param rate_limit_error_rate: The probability of a request failing with a rate limit error (429)
+    :type rate_limit_error_rate: float, optional
+    :param server_error_rate: The probability of a request failing with a server error (500)
+    :type server_error_rate: float, optional
+    :param requests_per_minute: The number of requests per minute above which requests fail with a rate limit error
+        (None for no limit)
+    :type requests_per_minute: float, optional
+    :param retry_after: The time to wait after a rate limit error, sent in the retry-after header, in seconds
+    :type retry_after: float, optional
+    :param seed: The seed of the simulation
+    :type seed: int, optional
+    """
+
+    def __init__(
+        self,
+        latency_distribution: str = "lognormal",
+        latency_mean: float = 0.5,
+        latency_std: float = 0.2,
+        time_per_token: float = 0.01,
+        completion_tokens: int = 32,
+        chunk_tokens: int = 4,
+        echo: bool = False,
+        embedding_dim: int = 16,
+        rate_limit_error_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        requests_per_minute: Optional[float] = None,
+        retry_after: float = 1.0,
+        seed: int = 0,
+    ):
+        assert latency_distribution in (
+            "constant",
+            "normal",
+            "lognormal",
+        ), f"Unknown latency distribution: {latency_distribution}"
+        self.latency_distribution = latency_distribution
+        self.latency_mean = latency_mean
+        self.latency_std = latency_std
+        self.time_per_token = time_per_token
+        self.completion_tokens = completion_tokens
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.echo = echo
+        self.embedding_dim = embedding_dim
+        self.rate_limit_error_rate = rate_limit_error_rate
+        self.server_error_rate = server_error_rate
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.seed = seed
+
+        self._lock = threading.Lock()
+        self._request_counts: Dict[bytes, int] = {}
+        self._request_times: Deque[float] = deque()
+        self.num_requests = 0
+        self.num_errors = 0
+
+    def _get_seed(self, params: Dict[str, Any]) -> bytes:
+        request = {k: v for k, v in params.items() if k not in _IGNORED_REQUEST_PARAMS}
+        request_hash = canonical_hash(request)
+        with self._lock:
+            count = self._request_counts.get(request_hash, 0)
+            self._request_counts[request_hash] = count + 1
+        return canonical_hash([self.seed, request_hash, count])
+
+    def _count_request(self) -> bool:
+        """Counts a request and returns whether it is over the requests per minute limit."""
+        now = time.monotonic()
+        with self._lock:
+            self.num_requests += 1
+            if self.requests_per_minute is None:
+                return False
+            while len(self._request_times) > 0 and self._request_times[0] <= now - 60:
+                self._request_times.popleft()
+            if len(self._request_times) >= self.requests_per_minute:
+                return True
+            self._request_times.append(now)
+            return False
+
+    def _draw_latency(self, rng: random.Random) -> float:
+        if self.latency_distribution == "constant" or self.latency_std <= 0 or self.latency_mean <= 0:
+            return max(0.0, self.latency_mean)
+        if self.latency_distribution == "normal":
+            return max(0.0, rng.gauss(self.latency_mean, self.latency_std))
+        # the parameters of the lognormal distribution with the given mean and standard deviation
+        sigma2 = math.log(1 + (self.latency_std / self.latency_mean) ** 2)
+        return rng.lognormvariate(math.log(self.latency_mean) - sigma2 / 2, math.sqrt(sigma2))
+
+    @staticmethod
+    def _get_text(content) -> str:
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        return content or ""
+
+    def _count_prompt_tokens(self, params: Dict[str, Any]) -> int:
+        return sum(len(self._get_text(message.get("content", None)).split()) for message in params.get("messages", []))
+
+    def _generate_content(self, rng: random.Random, params: Dict[str, Any]) -> str:
+        messages = params.get("messages", [])
+        if self.echo and len(messages) > 0:
+            return self._get_text(messages[-1].get("content", None))
+        num_tokens = self.completion_tokens
+        if params.get("max_tokens", None):
+            num_tokens = min(num_tokens, params["max_tokens"])
+        return " ".join(rng.choice(_WORDS) for _ in range(num_tokens))
+
+    def _check_error(self, call: _SimulatedCall):
+        if call.error is not None:
+            with self._lock:
+                self.num_errors += 1
+            raise call.error
+
+    @staticmethod
+    def _get_model(params: Dict[str, Any]) -> str:
+        model = params.get("model", "fake")
+        return model[len(FAKE_MODEL_PREFIX) :] if model.startswith(FAKE_MODEL_PREFIX) else model
+
+    def _make_completion(self, call: _SimulatedCall, params: Dict[str, Any]) -> FakeResponse:
+        return FakeResponse(
+            id=f"chatcmpl-fake-{call.rng.getrandbits(64):016x}",
+            object="chat.completion",
+            created=int(time.time()),
+            model=self._get_model(params),
+            choices=[
+                {"index": idx, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                for idx, content in enumerate(call.contents)
+            ],
+            usage={
+                "prompt_tokens": call.num_prompt_tokens,
+                "completion_tokens": call.num_completion_tokens,
+                "total_tokens": call.num_prompt_tokens + call.num_completion_tokens,
+            },
+        )
+
+    def _make_chunks(self, call: _SimulatedCall, params: Dict[str, Any]) -> List[FakeResponse]:
+        """Returns the chunks of the streamed response of a call (the choices are streamed in turn)."""
+        chunk_id = f"chatcmpl-fake-{call.rng.getrandbits(64):016x}"
+        chunks = []
+        for idx, content in enumerate(call.contents):
+            words = content.split(" ")
+            for start in range(0, len(words), self.chunk_tokens):
+                text = " ".join(words[start : start + self.chunk_tokens])
+                delta = {"content": text if start == 0 else " " + text}
+                if start == 0:
+                    delta["role"] = "assistant"
+                chunks.append(
+                    FakeResponse(
+                        id=chunk_id,
+                        object="chat.completion.chunk",
+                        created=int(time.time()),
+                        model=self._get_model(params),
+                        choices=[{"index": idx, "delta": delta, "finish_reason": None}],
+                    )
+                )
+        return chunks
+
+    def _get_chunk_delay(self, chunk) -> float:
+        return self.time_per_token * len(chunk["choices"][0]["delta"]["content"].split())
+
+    def _make_embeddings(self, params: Dict[str, Any]) -> FakeResponse:
+        inputs = params.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        data = []
+        for idx, text in enumerate(inputs):
+            # the embedding of a text only depends on the text (and the seed)
+            rng = random.Random(int.from_bytes(canonical_hash([self.seed, text]), "big"))
+            vector = [rng.gauss(0, 1) for _ in range(self.embedding_dim)]
+            norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+            data.append({"object": "embedding", "index": idx, "embedding": [x / norm for x in vector]})
+
+        num_tokens = sum(len(text.split()) for text in inputs)
+        return FakeResponse(
+            object="list",
+            model=self._get_model(params),
+            data=data,
+            usage={"prompt_tokens": num_tokens, "total_tokens": num_tokens},
+        )
+
+    def completion(self, **params) -> Any:
+        """Simulates a call to the completion API (blocking for the simulated latency).
+
+        :param params: The parameters of the request (messages, n, max_tokens, stream, ...)
+        :type params: Any
+        :return: The response, or an iterator over its chunks if stream is set
+        :rtype: Any
+        """
+        call = _SimulatedCall(self, params, embeddings_call=False)
+        time.sleep(call.time_to_first_token)
+        self._check_error(call)
+        if params.get("stream", False):
+            return self._stream(self._make_chunks(call, params))
+
+        time.sleep(self.time_per_token * call.num_completion_tokens)
+        return self._make_completion(call, params)
+
+    def _stream(self, chunks: List[FakeResponse]) -> Iterator[FakeResponse]:
+        for idx, chunk in enumerate(chunks):
+            if idx > 0:
+                time.sleep(self._get_chunk_delay(chunk))
+            yield chunk
+
+    async def acompletion(self, **params) -> Any:
+        """Simulates a call to the completion API without blocking the event loop (the async version of completion).
+
+        :param params: The parameters of the request (messages, n, max_tokens, stream, ...)
+        :type params: Any
+        :return: The response, or an async iterator over its chunks if stream is set
+        :rtype: Any
+        """
+        call = _SimulatedCall(self, params, embeddings_call=False)
+        await asyncio.sleep(call.time_to_first_token)
+        self._check_error(call)
+        if params.get("stream", False):
+            return self._astream(self._make_chunks(call, params))
+
+        await asyncio.sleep(self.time_per_token * call.num_completion_tokens)
+        return self._make_completion(call, params)
+
+    async def _astream(self, chunks: List[FakeResponse]) -> AsyncIterator[FakeResponse]:
+        for idx, chunk in enumerate(chunks):
+            if idx > 0:
+                await asyncio.sleep(self._get_chunk_delay(chunk))
+            yield chunk
+
+    def embedding(self, **params) -> FakeResponse:
+        """Simulates a call to the embedding API (blocking for the simulated latency).
+
+        :param params: The parameters of the request (input, ...)
+        :type params: Any
+        :return: The response
+        :rtype: FakeResponse
+        """
+        call = _SimulatedCall(self, params, embeddings_call=True)
+        time.sleep(call.time_to_first_token)
+        self._check_error(call)
+        return self._make_embeddings(params)
+
+    async def aembedding(self, **params) -> FakeResponse:
+        """Simulates a call to the embedding API without blocking the event loop (the async version of embedding).
+
+        :param params: The parameters of the request (input, ...)
+        :type params: Any
+        :return: The response
+        :rtype: FakeResponse
+        """
+        call = _SimulatedCall(self, params, embeddings_call=True)
+        await asyncio.sleep(call.time_to_first_token)
+        self._check_error(call)
+        return self._make_embeddings(params)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of requests received and the number of simulated errors.
+
+        :return: The statistics of the fake
+        :rtype: Dict[str, int]
+        """
+        with self._lock:
+            return {"requests": self.num_requests, "errors": self.num_errors}
+
+
+_fake_llms: Dict[bytes, FakeLLM] = {}
+_fake_llms_lock = threading.Lock()
+
+
+def get_fake_llm(config: Optional[Dict[str, Any]] = None) -> FakeLLM:
+    """Returns the FakeLLM with the given configuration, shared by all the callers with the same configuration (so that
+    they share its request counts and requests per minute limit).
+
+    :param config: The parameters of the FakeLLM (None for the defaults)
+    :type config: Dict[str, Any], optional
+    :return: The FakeLLM
+    :rtype: FakeLLM
+    """
+    config = dict(config or {})
+    config_key = canonical_hash(config)
+    with _fake_llms_lock:
+        if config_key not in _fake_llms:
+            _fake_llms[config_key] = FakeLLM(**config)
+        return _fake_llms[config_key]
@@ -0,0 +1,101 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+
+class HedgingPolicy:
+    """Decides when to hedge a request, i.e. send a duplicate of a request that is slow to return (on another API key if
+    possible) and keep the response arriving first.
+
+    A request is hedged once it has been running for longer than the given percentile of the latencies of the recent
+    requests, and only while the hedges sent stay under budget (a fraction of the requests sent).
+
+    :param percentile: The percentile of the recent latencies after which a request is hedged (e.g. 95)
+    :type percentile: float
+    :param budget: The maximum number of hedges as a fraction of the number of requests (e.g. 0.05 for 5% extra
+        requests)
+    :type budget: float, optional
+    :param min_samples: The number of latencies to observe before hedging
+    :type min_samples: int, optional
+    :param max_samples: The number of most recent latencies the percentile is computed on
+    :type max_samples: int, optional
+    """
+
+    def __init__(self, percentile: float, budget: float = 0.05, min_samples: int = 20, max_samples: int = 1024):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=max_samples)
+        # the percentile is only recomputed every few new latencies
+        self._hedge_delay: Optional[float] = None
+        self._num_new_latencies = 0
+
+        self.num_requests = 0
+        self.num_hedges = 0
+        self.num_hedge_wins = 0
+
+    def record_latency(self, latency: float):
+        """Records the latency of a request that returned.
+
+        :param latency: The latency in seconds
+        :type latency: float
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            self._num_new_latencies += 1
+
+    def get_hedge_delay(self) -> Optional[float]:
+        """Counts a new request and returns the time after which it should be hedged.
+
+        :return: The time in seconds (None if it should not be hedged, e.g. when too few latencies were observed)
+        :rtype: Optional[float]
+        """
+        with self._lock:
+            self.num_requests += 1
+            if len(self._latencies) < self.min_samples:
+                return None
+
+            if self._hedge_delay is None or self._num_new_latencies >= max(1, len(self._latencies) // 64):
+                latencies = sorted(self._latencies)
+                idx = min(len(latencies) - 1, int(self.percentile / 100 * len(latencies)))
+                self._hedge_delay = latencies[idx]
+                self._num_new_latencies = 0
+            return self._hedge_delay
+
+    def try_hedge(self) -> bool:
+        """Returns whether a slow request can be hedged within the budget (and counts the hedge if it can).
+
+        :return: Whether to send the hedge
+        :rtype: bool
+        """
+        with self._lock:
+            if self.num_hedges + 1 > self.budget * self.num_requests:
+                return False
+            self.num_hedges += 1
+            return True
+
+    def record_hedge_win(self):
+        """Records that a hedge returned before the request it duplicated."""
+        with self._lock:
+            self.num_hedge_wins += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the number of requests, the number of hedges sent and won and the current hedging delay.
+
+        :return: The statistics of the policy
+        :rtype: Dict[str, float]
+        """
+        with self._lock:
+            return {
+                "requests": self.num_requests,
+                "hedges": self.num_hedges,
+                "hedge_wins": self.num_hedge_wins,
+                "hedge_rate": self.num_hedges / self.num_requests if self.num_requests > 0 else 0.0,
+                "hedge_delay": self._hedge_delay if self._hedge_delay is not None else 0.0,
+            }
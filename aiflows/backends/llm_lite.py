@@ -1,8 +1,119 @@
-from litellm import completion, embedding
-from typing import Any, List, Dict, Iterable, Union, Optional, Tuple
+import litellm
+from litellm import completion, embedding, acompletion, aembedding
+from typing import Any, List, Dict, Iterable, Iterator, Union, Optional, Tuple
 import time
+import asyncio
+import threading
+import weakref
+import contextvars
+import concurrent.futures
+from contextlib import contextmanager
 from aiflows.backends.api_info import ApiInfo
-import multiprocessing
+from aiflows.backends.request_batcher import RequestBatcher, RequestBatcherRegistry
+from aiflows.backends.hedging import HedgingPolicy
+from aiflows.backends.fake_llm import FAKE_MODEL_PREFIX, get_fake_llm
+from aiflows.backends.metrics import CallMetrics, get_current_flow_name, record_call_metrics
+from aiflows.backends.rate_limiter import get_rate_limiter
+from aiflows.backends.streaming import (
+    AsyncLiteLLMStream,
+    LiteLLMStream,
+    StreamAccumulator,
+    _get_choice_deltas,
+    _PermitHoldingChunks,
+)
+from aiflows.backends.retry import (
+    CircuitBreakers,
+    get_backoff_delay,
+    get_retry_after,
+    is_rate_limit_error,
+    is_retryable_error,
+)
+from aiflows.flow_cache import FlowCache, CACHING_PARAMETERS, canonical_hash
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+# parameters of a request that don't change its response (they are not part of the response cache keys)
+_NON_SEMANTIC_REQUEST_PARAMS = ("api_key", "api_base", "timeout", "request_timeout")
+# policies of the response cache: cache only the requests with a deterministic response, or all of them
+_RESPONSE_CACHE_POLICIES = ("deterministic", "always")
+# default maximum number of concurrent requests of a backend on an event loop (see LiteLLMBackend.acall)
+DEFAULT_MAX_CONCURRENT_REQUESTS = 64
+
+
+def estimate_num_tokens(params: Dict[str, Any], embeddings_call: bool = False) -> int:
+    """Roughly estimates the number of tokens of a request (4 characters per token for the input, plus the maximum
+    number of generated tokens). It is only used to reserve the tokens per minute budget before the actual usage of the
+    request is known.
+
+    :param params: The parameters of the request
+    :type params: Dict[str, Any]
+    :param embeddings_call: Whether the request is an embedding request
+    :type embeddings_call: bool, optional
+    :return: The estimated number of tokens
+    :rtype: int
+    """
+    if embeddings_call:
+        inputs = params.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        return sum(len(text) for text in inputs) // 4
+
+    num_chars = 0
+    for message in params.get("messages", []):
+        content = message.get("content", None)
+        if isinstance(content, str):
+            num_chars += len(content)
+        elif isinstance(content, list):
+            num_chars += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return num_chars // 4 + (params.get("max_tokens", None) or 0) * (params.get("n", None) or 1)
+
+
+def _get_total_tokens(response) -> Optional[int]:
+    """Returns the number of tokens used by a request according to its response (None if it is not reported)."""
+    try:
+        return int(response["usage"]["total_tokens"])
+    except (KeyError, TypeError, ValueError):
+        usage = getattr(response, "usage", None)
+        return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def _get_usage(response) -> Optional[Tuple[int, int]]:
+    """Returns the number of prompt and completion tokens of a request according to its response (None if they are not
+    reported)."""
+    try:
+        usage = response["usage"]
+    except (KeyError, TypeError):
+        usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+
+    num_tokens = []
+    for name in ("prompt_tokens", "completion_tokens"):
+        try:
+            value = usage[name]
+        except (KeyError, TypeError):
+            value = getattr(usage, name, None)
+        num_tokens.append(int(value or 0))
+    return num_tokens[0], num_tokens[1]
+
+
+def get_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """Returns the cost of a request in USD according to the prices of the litellm library.
+
+    :param model: The model of the request
+    :type model: str
+    :param prompt_tokens: The number of prompt tokens
+    :type prompt_tokens: int
+    :param completion_tokens: The number of completion tokens
+    :type completion_tokens: int
+    :return: The cost (None if the price of the model is unknown)
+    :rtype: Optional[float]
+    """
+    prices = getattr(litellm, "model_cost", {}).get(model, None)
+    if prices is None:
+        return None
+    input_cost = prices.get("input_cost_per_token", 0) * prompt_tokens
+    return input_cost + prices.get("output_cost_per_token", 0) * completion_tokens
 
 
 def merge_delta_to_stream(merged_stream, delta):
@@ -40,40 +151,101 @@ def merge_streams(streamed_response, n_chat_completion_choices):
     :return: The merged streams
     :rtype: List[Dict[str, Any]]
     """
-    merged_streams = [{} for i in range(n_chat_completion_choices)]
+    accumulator = StreamAccumulator(n_chat_completion_choices)
     for chunk in streamed_response:
-        if "choices" not in chunk or len(chunk["choices"]) == 0:
-            continue
-        # must be added for case where n > 1 (argument in completion function)
-        for choice in chunk["choices"]:
-            # delta is initialy a class (Delta) and must be converted to a dictionary (using the content attribute)
-            if "content" not in choice["delta"]:
-                continue
-            delta = {"content": choice["delta"]["content"]}
-            merged_streams[int(choice["index"])] = merge_delta_to_stream(merged_streams[int(choice["index"])], delta)
-    return merged_streams
+        accumulator.add_chunk(chunk)
+    return accumulator.get_messages()
 
 
 class LiteLLMBackend:
     """This class is a wrapper around the litellm library. It allows to use multiple API keys and to switch between them
     automatically when one is exhausted.
+    The metrics of every call (tokens, cost, time waited for an API key, latency and time to first token) are passed to
+    the metrics collector of the process, aggregated per model, API key and flow (see aiflows.backends.metrics).
 
     :param api_infos: A list of ApiInfo objects, each containing the information about one API key
     :type api_infos: List[ApiInfo]
     :param model_name: The name of the model to use. Can be a string or a dictionary from API to model name
     :type model_name: Union[str, Dict[str, str]]
-    :param wait_time_per_key: The minimum time to wait between two calls on the same API key
+    :param wait_time_per_key: The minimum time to wait between two calls on the same API key (only used if
+        requests_per_minute is not given, 0 for no limit)
     :type wait_time_per_key: int
+    :param requests_per_minute: The maximum number of requests per minute on each API key
+    :type requests_per_minute: float, optional
+    :param tokens_per_minute: The maximum number of tokens per minute on each API key (None for no limit)
+    :type tokens_per_minute: float, optional
+    :param max_burst_requests: The maximum number of requests sent at once on each API key (defaults to
+        requests_per_minute, or to 1 if the limit is given by wait_time_per_key)
+    :type max_burst_requests: float, optional
+    :param max_burst_tokens: The maximum number of tokens sent at once on each API key (defaults to tokens_per_minute)
+    :type max_burst_tokens: float, optional
     :param embeddings_call: Whether to use the embedding API or the completion API
     :type embeddings_call: bool
+    :param response_cache: The policy of the response cache (None to disable it). With "deterministic", only the
+        completion requests with a temperature of 0 are cached, with "always" all of them are. Embeddings are cached
+        per input string with both policies. Responses are cached in the flow cache directory (see FlowCache), under a
+        key derived from the request parameters (excluding the API key and base), so they are shared between all the
+        backends and flows making the same request.
+    :type response_cache: str, optional
+    :param max_concurrent_requests: The maximum number of requests of the backend in flight at the same time on an
+        event loop (see acall)
+    :type max_concurrent_requests: int, optional
+    :param max_retries: The maximum number of times a request failing with a transient error (rate limit, timeout,
+        connection or server error) is retried, on the next API key if there are several
+    :type max_retries: int, optional
+    :param retry_base_delay: The maximum delay before the first retry in seconds (doubled at each retry, with jitter,
+        and at least the delay requested by the API in its Retry-After header)
+    :type retry_base_delay: float, optional
+    :param retry_max_delay: The maximum delay between two retries in seconds
+    :type retry_max_delay: float, optional
+    :param circuit_breaker_threshold: The number of consecutive failures after which an API key (on rate limits) or an
+        API base (on other transient errors) is taken out of rotation
+    :type circuit_breaker_threshold: int, optional
+    :param circuit_breaker_cooldown: The time an API key or API base stays out of rotation in seconds
+    :type circuit_breaker_cooldown: float, optional
+    :param embedding_batch_wait_ms: For embedding calls, the time to wait for concurrent calls (of all the backends with
+        the same model, keys and parameters) to gather their inputs into a single request, in milliseconds (None to
+        send every call separately)
+    :type embedding_batch_wait_ms: float, optional
+    :param embedding_batch_max_size: The maximum number of inputs of a batch of embedding calls
+    :type embedding_batch_max_size: int, optional
+    :param embedding_batch_max_tokens: The maximum (estimated) number of tokens of a batch of embedding calls
+    :type embedding_batch_max_tokens: int, optional
+    :param sampling_coalesce_wait_ms: For completion calls, the time to wait for concurrent calls identical up to their
+        number of samples n (of all the backends with the same model and keys) to coalesce them into a single request
+        with n set to the total number of samples, in milliseconds (None to send every call separately). Useful for
+        flows sampling the same prompt many times (e.g. best-of-k or self-consistency)
+    :type sampling_coalesce_wait_ms: float, optional
+    :param sampling_coalesce_max_n: The maximum number of samples of a coalesced request
+    :type sampling_coalesce_max_n: int, optional
+    :param hedge_percentile: If a (non-streamed) call hasn't returned after this percentile of the latencies of the
+        recent calls (of all the backends with the same model and keys), a duplicate request is sent, on another API key
+        if there are several, and the first response is kept (None to disable hedging)
+    :type hedge_percentile: float, optional
+    :param hedge_budget: The maximum number of duplicate requests as a fraction of the number of calls
+    :type hedge_budget: float, optional
+    :param hedge_min_samples: The number of latencies to observe before hedging
+    :type hedge_min_samples: int, optional
+    :param fake_llm: The parameters of the FakeLLM serving the models whose name starts with "fake/" and the API keys
+        with backend_used="fake", instead of an actual API (for load testing, see aiflows.backends.fake_llm.FakeLLM)
+    :type fake_llm: Dict[str, Any], optional
     :param kwargs: Additional parameters to pass to the litellm library
     :type kwargs: Any
     """
 
-    # last call time per key must be shared between all instances of the class (mulitple threads and objects can share the same apis keys)
-    __last_call_per_key: Dict[str, float] = {}
-    # ensure that the last call time per key is not modified or read by multiple threads of objects at the same time
-    __read_write_lock: multiprocessing.Lock = multiprocessing.Lock()
+    # circuit breakers of the API keys and bases, shared by the instances with the same circuit breaker parameters
+    __circuit_breakers: Dict[Tuple[int, float], CircuitBreakers] = {}
+    __circuit_breakers_lock = threading.Lock()
+    # batchers of the embedding inputs and of the completion samples, shared by the instances sending the same requests
+    __request_batchers = RequestBatcherRegistry()
+    # hedging policies (and the latencies they are based on), shared by the instances with the same model and keys
+    __hedging_policies: Dict[bytes, HedgingPolicy] = {}
+    __hedging_policies_lock = threading.Lock()
+    # the threads running the hedged requests (and the primary requests they duplicate), reused across calls
+    HEDGING_MAX_THREADS = 64
+    __hedging_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+    __hedging_slots = threading.BoundedSemaphore(HEDGING_MAX_THREADS)
+    __hedging_executor_lock = threading.Lock()
 
     def __init__(self, api_infos, model_name, **kwargs):
         """Constructor method"""
@@ -90,17 +262,74 @@ class LiteLLMBackend:
             else self.params.get("embeddings_call", False)
         )
 
+        self.response_cache_policy = (
+            self.params.pop("response_cache")
+            if "response_cache" in self.params
+            else self.params.get("response_cache", None)
+        )
+        assert (
+            self.response_cache_policy is None or self.response_cache_policy in _RESPONSE_CACHE_POLICIES
+        ), f"response_cache must be None or one of {_RESPONSE_CACHE_POLICIES}, got {self.response_cache_policy}"
+        self._response_cache = None
+
+        self.max_concurrent_requests = (
+            self.params.pop("max_concurrent_requests")
+            if "max_concurrent_requests" in self.params
+            else self.params.get("max_concurrent_requests", DEFAULT_MAX_CONCURRENT_REQUESTS)
+        )
+        # asyncio semaphores are bound to the event loop they are used in, so there is one per event loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+        self.max_retries = self.params.pop("max_retries", 3)
+        self.retry_base_delay = self.params.pop("retry_base_delay", 1.0)
+        self.retry_max_delay = self.params.pop("retry_max_delay", 60.0)
+        self.circuit_breakers = LiteLLMBackend._get_circuit_breakers(
+            self.params.pop("circuit_breaker_threshold", 5), self.params.pop("circuit_breaker_cooldown", 30.0)
+        )
+
+        self.embedding_batching = {
+            "max_wait_time": self.params.pop("embedding_batch_wait_ms", None),
+            "max_batch_size": self.params.pop("embedding_batch_max_size", 256),
+            "max_batch_tokens": self.params.pop("embedding_batch_max_tokens", None),
+        }
+        if self.embedding_batching["max_wait_time"] is not None:
+            self.embedding_batching["max_wait_time"] /= 1000
+
+        self.sampling_coalescing = {
+            "max_wait_time": self.params.pop("sampling_coalesce_wait_ms", None),
+            "max_batch_size": self.params.pop("sampling_coalesce_max_n", 128),
+        }
+        if self.sampling_coalescing["max_wait_time"] is not None:
+            self.sampling_coalescing["max_wait_time"] /= 1000
+
+        self.hedging = {
+            "percentile": self.params.pop("hedge_percentile", None),
+            "budget": self.params.pop("hedge_budget", 0.05),
+            "min_samples": self.params.pop("hedge_min_samples", 20),
+        }
+
+        self.fake_llm_config = self.params.pop("fake_llm", None)
+
         api_infos = api_infos if isinstance(api_infos, list) else [api_infos]
         api_infos = [info if isinstance(info, ApiInfo) else ApiInfo(**info) for info in api_infos]
         LiteLLMBackend._api_information_sanity_check(api_infos)
 
-        # the last_call_per_key of each api key of the instantiated object
-        object_last_call_per_key = {
-            LiteLLMBackend.make_unique_api_info_key(api_info): time.time() - self.__waittime_per_key
-            for api_info in api_infos
+        requests_per_minute = self.params.pop("requests_per_minute", None)
+        max_burst_requests = self.params.pop("max_burst_requests", None)
+        if requests_per_minute is None and self.__waittime_per_key:
+            # one request every wait_time_per_key seconds
+            requests_per_minute = 60 / self.__waittime_per_key
+            max_burst_requests = 1 if max_burst_requests is None else max_burst_requests
+        rate_limits = {
+            "requests_per_minute": requests_per_minute,
+            "tokens_per_minute": self.params.pop("tokens_per_minute", None),
+            "max_burst_requests": max_burst_requests,
+            "max_burst_tokens": self.params.pop("max_burst_tokens", None),
         }
-        # Update the last_call_per_key of the class with the last_call_per_key of the instantiated object (updates only the keys that are not already in the class variable)
-        LiteLLMBackend._prioritized_merge_last_call_per_key(object_last_call_per_key)
+        # Register the limits of the keys of the object. The rate limiter is shared between all instances of the class
+        # (multiple threads and objects can share the same api keys) and, through a file, between the processes of the node
+        for api_info in api_infos:
+            get_rate_limiter().register_key(LiteLLMBackend.make_unique_api_info_key(api_info), **rate_limits)
 
         # A dictorary containing the api info of the object (key is the backend_used + api_key) value is the api_info object
         # e.g {"openai-1234": ApiInfo(backend_used="openai", api_key="1234", api_base="https://api.openai.com", api_version="v1")}
@@ -118,42 +347,98 @@ class LiteLLMBackend:
         return str(api_info.backend_used + api_info.api_key)
 
     @classmethod
-    def _prioritized_merge_last_call_per_key(cls, dict2):
-        """Updates the last_call_per_key of the class with the last_call_per_key of the instantiated object (updates only the keys that are not already in the class variable)
+    def _get_circuit_breakers(cls, failure_threshold: int, cooldown: float) -> CircuitBreakers:
+        """Gets the circuit breakers with the given parameters (shared between all instances of the class)
 
-        :param dict2: The last_call_per_key of the instantiated object
-        :type dict2: Dict[str, float]
+        :param failure_threshold: The number of consecutive failures opening a circuit
+        :type failure_threshold: int
+        :param cooldown: The time a circuit stays open in seconds
+        :type cooldown: float
+        :return: The circuit breakers
+        :rtype: CircuitBreakers
         """
-        # Ensures read and write are not done at the same time
-        with cls.__read_write_lock:
-            LiteLLMBackend.__last_call_per_key = {**dict2, **LiteLLMBackend.__last_call_per_key}
+        with cls.__circuit_breakers_lock:
+            if (failure_threshold, cooldown) not in cls.__circuit_breakers:
+                cls.__circuit_breakers[(failure_threshold, cooldown)] = CircuitBreakers(failure_threshold, cooldown)
+            return cls.__circuit_breakers[(failure_threshold, cooldown)]
 
-    @classmethod
-    def _get_last_call_per_key(cls, keys: Iterable[str] = None):
-        """Gets the last_call_per_key of the class variable. If keys is None, returns the whole dictionary, otherwise returns the values of the keys in the list keys
-
-        :param keys: The keys to return the values of, defaults to None
-        :type keys: List[str], optional
-        :return: The last_call_per_key of the class variable (or the values of the keys in the list keys)
-        :rtype: Dict[str, float]
-        """
-        # Ensures read and write are not done at the same time
-        with cls.__read_write_lock:
-            if keys is None:
-                return cls.__last_call_per_key
-            else:
-                return {key: value for key, value in cls.__last_call_per_key.items() if key in keys}
+    def _get_circuits(self, api_key_idx: str) -> Tuple[str, str]:
+        """Gets the names of the circuits of an API key: the circuit of the key itself and the one of its API base
 
-    @classmethod
-    def _update_time_last_call_per_key(cls, key: str):
-        """Updates the time of last_call_per_key of the class variable for the provided key
+        :param api_key_idx: The index of the API key
+        :type api_key_idx: str
+        :return: The names of the circuits
+        :rtype: Tuple[str, str]
+        """
+        api_info = self.api_infos[api_key_idx]
+        return f"key:{api_key_idx}", f"base:{api_info.api_base or api_info.backend_used}"
+
+    def _get_candidate_api_keys(self, excluded_keys: Iterable[str] = ()) -> Tuple[List[str], float]:
+        """Gets the API keys the next request can be sent on: the keys whose circuits are closed (preferably not among
+        excluded_keys, e.g. the keys that just failed). If all circuits are open, the keys whose circuits close first.
 
-        :param key: The key to update the last_call_per_key of
-        :type key: str
+        :param excluded_keys: The keys to avoid
+        :type excluded_keys: Iterable[str], optional
+        :return: The candidate keys and the time to wait until their circuits close
+        :rtype: Tuple[List[str], float]
         """
-        # Ensures read and write are not done at the same time
-        with cls.__read_write_lock:
-            cls.__last_call_per_key.update({key: time.time()})
+        wait_times = {key: self.circuit_breakers.time_until_closed(self._get_circuits(key)) for key in self.api_infos}
+        closed_keys = [key for key, wait_time in wait_times.items() if wait_time == 0]
+        preferred_keys = [key for key in closed_keys if key not in excluded_keys]
+        if len(preferred_keys) > 0:
+            return preferred_keys, 0.0
+        if len(closed_keys) > 0:
+            return closed_keys, 0.0
+
+        min_wait_time = min(wait_times.values())
+        return [key for key, wait_time in wait_times.items() if wait_time == min_wait_time], min_wait_time
+
+    def _on_request_success(self, api_key_idx: str):
+        """Closes the circuits of an API key after a successful request
+
+        :param api_key_idx: The index of the API key
+        :type api_key_idx: str
+        """
+        self.circuit_breakers.record_success(self._get_circuits(api_key_idx))
+
+    def _on_request_failure(
+        self, api_key_idx: str, num_tokens: int, error: Exception, attempt: int, failed_keys: Iterable[str] = ()
+    ) -> Optional[float]:
+        """Handles a failed request: records the failure on the circuit of the API key (rate limit errors) or of its API
+        base (other transient errors) and decides whether to retry.
+
+        :param api_key_idx: The index of the API key
+        :type api_key_idx: str
+        :param num_tokens: The number of tokens reserved for the request (they were not used)
+        :type num_tokens: int
+        :param error: The error raised by the request
+        :type error: Exception
+        :param attempt: The number of the failed attempt (starting from 0)
+        :type attempt: int
+        :param failed_keys: The keys on which the previous attempts failed
+        :type failed_keys: Iterable[str], optional
+        :return: The time to wait before retrying, or None if the request should not be retried
+        :rtype: Optional[float]
+        """
+        get_rate_limiter().adjust_tokens(api_key_idx, -num_tokens)
+        if not is_retryable_error(error):
+            return None
+
+        key_circuit, base_circuit = self._get_circuits(api_key_idx)
+        self.circuit_breakers.record_failure([key_circuit] if is_rate_limit_error(error) else [base_circuit])
+        if attempt >= self.max_retries:
+            return None
+
+        # the delay requested by the API only matters if the retry can't go to another key
+        retry_after = None
+        if set(self.api_infos.keys()) <= {api_key_idx, *failed_keys}:
+            retry_after = get_retry_after(error)
+        delay = get_backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay, retry_after)
+        log.warning(
+            f"Request failed ({type(error).__name__}: {error}), retrying in {delay:.2f}s "
+            f"(attempt {attempt + 1}/{self.max_retries})"
+        )
+        return delay
 
     @staticmethod
     def _api_information_sanity_check(api_information: List[ApiInfo]):
@@ -164,32 +449,230 @@ class LiteLLMBackend:
         """
         assert api_information is not None, "Must provide api information!"
 
-    def _choose_next_api_key(self) -> int:
-        """Chooses the next API key to use. It chooses the one that has been used the least recently.
+    def _choose_next_api_key(self, num_tokens: int = 0, excluded_keys: Iterable[str] = ()) -> str:
+        """Chooses the next API key to use: among the keys in rotation (see _get_candidate_api_keys), the one whose rate
+        limits allow to send the request the soonest. It waits until the request can be sent (callers are served in the
+        order they call this method).
 
+        :param num_tokens: The (estimated) number of tokens of the request
+        :type num_tokens: int, optional
+        :param excluded_keys: The keys to avoid if possible
+        :type excluded_keys: Iterable[str], optional
         :return: The index of the next API key to use
-        :rtype: int
+        :rtype: str
         """
-        # Gets the last call per key of the object (but only for the apikeys that are in the class variable)
-        object_last_call_per_key = LiteLLMBackend._get_last_call_per_key(keys=self.api_infos.keys())
+        api_keys, circuit_wait_time = self._get_candidate_api_keys(excluded_keys)
+        if circuit_wait_time > 0:
+            time.sleep(circuit_wait_time)
 
-        # Retrieve key of api key that was used the least recently
-        api_key_idx = min(object_last_call_per_key, key=object_last_call_per_key.get)
-        # Check how long ago the api key was used
-        last_call_on_key = time.time() - object_last_call_per_key[api_key_idx]
+        api_key_idx, wait_time = get_rate_limiter().reserve(api_keys, num_tokens)
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return api_key_idx
 
-        # Check if we need to wait
-        good_to_go = last_call_on_key > self.__waittime_per_key
+    async def _achoose_next_api_key(self, num_tokens: int = 0, excluded_keys: Iterable[str] = ()) -> str:
+        """Chooses the next API key to use like _choose_next_api_key, but waits without blocking the event loop.
 
-        # If we need to wait, wait until we do
-        if not good_to_go:
-            time.sleep(self.__waittime_per_key - last_call_on_key)
-            return self._choose_next_api_key()
+        :param num_tokens: The (estimated) number of tokens of the request
+        :type num_tokens: int, optional
+        :param excluded_keys: The keys to avoid if possible
+        :type excluded_keys: Iterable[str], optional
+        :return: The index of the next API key to use
+        :rtype: str
+        """
+        api_keys, circuit_wait_time = self._get_candidate_api_keys(excluded_keys)
+        if circuit_wait_time > 0:
+            await asyncio.sleep(circuit_wait_time)
 
-        # Update the last call time
-        LiteLLMBackend._update_time_last_call_per_key(api_key_idx)
+        api_key_idx, wait_time = get_rate_limiter().reserve(api_keys, num_tokens)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
         return api_key_idx
 
+    def _record_usage(self, api_key_idx: str, num_reserved_tokens: int, response):
+        """Corrects the tokens reserved for a request on its key with the usage reported in its response.
+
+        :param api_key_idx: The index of the API key used for the request
+        :type api_key_idx: str
+        :param num_reserved_tokens: The number of tokens reserved for the request
+        :type num_reserved_tokens: int
+        :param response: The response of the request
+        :type response: Any
+        """
+        num_tokens = _get_total_tokens(response)
+        if num_tokens is not None:
+            get_rate_limiter().adjust_tokens(api_key_idx, num_tokens - num_reserved_tokens)
+
+    def _get_api_key_label(self, api_key_idx: str) -> str:
+        """Gets the label an API key is reported with in statistics and metrics (the keys are secrets, they are
+        reported by their backend and position)
+
+        :param api_key_idx: The index of the API key
+        :type api_key_idx: str
+        :return: The label of the API key
+        :rtype: str
+        """
+        return f"{self.api_infos[api_key_idx].backend_used}-{list(self.api_infos.keys()).index(api_key_idx)}"
+
+    def rate_limit_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns the number of requests and the time waited for the rate limits on each API key of the backend.
+
+        :return: The statistics of each API key
+        :rtype: Dict[str, Dict[str, float]]
+        """
+        stats = get_rate_limiter().stats(self.api_infos.keys())
+        return {self._get_api_key_label(key): value for key, value in stats.items()}
+
+    def _finish_call_metrics(
+        self,
+        call_metrics: CallMetrics,
+        api_key_idx: str,
+        params: Dict[str, Any],
+        response=None,
+        error: Optional[Exception] = None,
+        num_completion_chars: int = 0,
+    ):
+        """Completes the metrics of a call with its model, API key and token usage, and passes them to the metrics
+        collector.
+
+        :param call_metrics: The metrics of the call
+        :type call_metrics: CallMetrics
+        :param api_key_idx: The index of the API key of the last request of the call
+        :type api_key_idx: str
+        :param params: The parameters of the last request of the call
+        :type params: Dict[str, Any]
+        :param response: The response of the call (None for streamed responses and failed calls)
+        :type response: Any, optional
+        :param error: The error the call failed with
+        :type error: Exception, optional
+        :param num_completion_chars: The number of characters of a streamed response (to estimate its tokens)
+        :type num_completion_chars: int, optional
+        """
+        call_metrics.model = params["model"]
+        call_metrics.api_key = self._get_api_key_label(api_key_idx)
+        if error is not None:
+            call_metrics.error = type(error).__name__
+        else:
+            usage = _get_usage(response) if response is not None else None
+            if usage is None:
+                usage = (
+                    estimate_num_tokens({**self.params, **params, "max_tokens": None}, self.embeddings_call),
+                    num_completion_chars // 4,
+                )
+            call_metrics.prompt_tokens, call_metrics.completion_tokens = usage
+            call_metrics.cost = get_cost(call_metrics.model, *usage)
+        record_call_metrics(call_metrics)
+
+    def _track_call_metrics(
+        self, call_metrics: CallMetrics, api_key_idx: str, params: Dict[str, Any], response, request_start: float
+    ):
+        """Records the metrics of a successful call. Streamed responses are wrapped so that their time to first token
+        and latency are measured as they are consumed (their metrics are recorded once they are exhausted).
+
+        :param call_metrics: The metrics of the call
+        :type call_metrics: CallMetrics
+        :param api_key_idx: The index of the API key of the request
+        :type api_key_idx: str
+        :param params: The parameters of the request
+        :type params: Dict[str, Any]
+        :param response: The raw response from the litellm library
+        :type response: Any
+        :param request_start: The time the request was sent (time.monotonic)
+        :type request_start: float
+        :return: The response (wrapped if it is streamed)
+        :rtype: Any
+        """
+        if not self.embeddings_call and {**self.params, **params}.get("stream", None):
+            if hasattr(response, "__aiter__"):
+                return self._atimed_chunks(response, call_metrics, api_key_idx, params, request_start)
+            return self._timed_chunks(response, call_metrics, api_key_idx, params, request_start)
+
+        call_metrics.latency = call_metrics.time_to_first_token = time.monotonic() - request_start
+        self._finish_call_metrics(call_metrics, api_key_idx, params, response)
+        return response
+
+    def _timed_chunks(self, chunks, call_metrics: CallMetrics, api_key_idx: str, params: Dict[str, Any], start: float):
+        num_chars = 0
+        for chunk in chunks:
+            if call_metrics.time_to_first_token is None:
+                call_metrics.time_to_first_token = time.monotonic() - start
+            num_chars += sum(len(delta["content"]) for delta in _get_choice_deltas(chunk))
+            yield chunk
+        call_metrics.latency = time.monotonic() - start
+        self._finish_call_metrics(call_metrics, api_key_idx, params, num_completion_chars=num_chars)
+
+    async def _atimed_chunks(
+        self, chunks, call_metrics: CallMetrics, api_key_idx: str, params: Dict[str, Any], start: float
+    ):
+        num_chars = 0
+        async for chunk in chunks:
+            if call_metrics.time_to_first_token is None:
+                call_metrics.time_to_first_token = time.monotonic() - start
+            num_chars += sum(len(delta["content"]) for delta in _get_choice_deltas(chunk))
+            yield chunk
+        call_metrics.latency = time.monotonic() - start
+        self._finish_call_metrics(call_metrics, api_key_idx, params, num_completion_chars=num_chars)
+
+    def _request(self, **kwargs):
+        """Sends a request to the litellm library with the given parameters.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The raw response from the litellm library
+        :rtype: Any
+        """
+        merged_params = {**self.params, **kwargs}
+        if str(merged_params.get("model", "")).startswith(FAKE_MODEL_PREFIX):
+            fake_llm = get_fake_llm(self.fake_llm_config)
+            return fake_llm.embedding(**merged_params) if self.embeddings_call else fake_llm.completion(**merged_params)
+
+        if self.embeddings_call:
+            return embedding(**merged_params)
+        return completion(**merged_params)
+
+    async def _arequest(self, collect_stream: bool = True, **kwargs):
+        """Sends a request to the async API of the litellm library with the given parameters.
+
+        :param collect_stream: Whether streamed responses are collected into the list of their chunks (otherwise the
+            async iterator over the chunks is returned)
+        :type collect_stream: bool, optional
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The raw response from the litellm library
+        :rtype: Any
+        """
+        merged_params = {**self.params, **kwargs}
+        if str(merged_params.get("model", "")).startswith(FAKE_MODEL_PREFIX):
+            fake_llm = get_fake_llm(self.fake_llm_config)
+            if self.embeddings_call:
+                return await fake_llm.aembedding(**merged_params)
+            response = await fake_llm.acompletion(**merged_params)
+        elif self.embeddings_call:
+            return await aembedding(**merged_params)
+        else:
+            response = await acompletion(**merged_params)
+
+        if merged_params.get("stream", None) and collect_stream:
+            return [chunk async for chunk in response]
+        return response
+
+    def _get_messages(self, response, **kwargs) -> List[str]:
+        """Gets the messages (or embeddings) from the raw response of the litellm library.
+
+        :param response: The raw response from the litellm library
+        :type response: Any
+        :param kwargs: The parameters of the request
+        :type kwargs: Any
+        :return: The messages
+        :rtype: List[str]
+        """
+        if self.embeddings_call:
+            return response.data
+
+        if {**self.params, **kwargs}.get("stream", None):
+            return merge_streams(response, n_chat_completion_choices=kwargs.get("n", 1))
+        return [choice["message"] for choice in response["choices"]]
+
     def _call(self, **kwargs) -> List[str]:
         """
         Calls the litellm library with the given parameters.
@@ -199,18 +682,18 @@ class LiteLLMBackend:
         :return: The response from the litellm library
         :rtype: List[str]
         """
+        return self._get_messages(self._request(**kwargs), **kwargs)
 
-        merged_params = {**self.params, **kwargs}
-        if self.embeddings_call:
-            response = embedding(**merged_params)
-            messages = response.data
-        else:
-            response = completion(**merged_params)
-            if merged_params.get("stream", None):
-                messages = merge_streams(response, n_chat_completion_choices=kwargs.get("n", 1))
-            else:
-                messages = [choice["message"] for choice in response["choices"]]
-        return messages
+    async def _acall(self, **kwargs) -> List[str]:
+        """
+        Calls the async API of the litellm library with the given parameters.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The response from the litellm library
+        :rtype: List[str]
+        """
+        return self._get_messages(await self._arequest(**kwargs), **kwargs)
 
     def _get_model_and_api_dict(self, api_key_info):
         """Gets the model and api dictionary to pass to the litellm library
@@ -236,6 +719,9 @@ class LiteLLMBackend:
         else:
             model_name = self.model_name
 
+        if api_backend == "fake" and not model_name.startswith(FAKE_MODEL_PREFIX):
+            model_name = FAKE_MODEL_PREFIX + model_name
+
         litellm_api_info = {"model": model_name, "api_base": api_base, "api_version": api_version, "api_key": api_key}
 
         return litellm_api_info
@@ -250,19 +736,692 @@ class LiteLLMBackend:
 
         return self.api_infos[api_key_idx]
 
+    async def aget_key(self):
+        """Gets the next API key to use, waiting without blocking the event loop
+
+        :return: The next API key to use
+        :rtype: ApiInfo
+        """
+        api_key_idx = await self._achoose_next_api_key()
+
+        return self.api_infos[api_key_idx]
+
+    def _get_response_cache(self) -> Optional[FlowCache]:
+        """Returns the response cache of the backend (opened on first use), or None if responses are not cached.
+
+        :return: The response cache
+        :rtype: Optional[FlowCache]
+        """
+        if self.response_cache_policy is None or not CACHING_PARAMETERS.do_caching:
+            return None
+        if self._response_cache is None:
+            self._response_cache = FlowCache()
+        return self._response_cache
+
+    def _make_request_cache_key(self, prefix: str, request: Dict[str, Any]) -> str:
+        """Makes the cache key of a request from its canonical encoding (independent of the order of the parameters).
+
+        :param prefix: The prefix of the key (the kind of request)
+        :type prefix: str
+        :param request: The parameters of the request
+        :type request: Dict[str, Any]
+        :return: The cache key
+        :rtype: str
+        """
+        request = {k: v for k, v in request.items() if k not in _NON_SEMANTIC_REQUEST_PARAMS}
+        request["model"] = self.model_name
+        return f"{prefix}:{canonical_hash(request).hex()}"
+
+    def _is_response_cacheable(self, request: Dict[str, Any]) -> bool:
+        """Returns whether the response to a completion request can be cached, according to the response cache policy.
+
+        :param request: The parameters of the request
+        :type request: Dict[str, Any]
+        :return: Whether the response can be cached
+        :rtype: bool
+        """
+        if self.response_cache_policy == "always":
+            return True
+        return request.get("temperature", None) == 0
+
+    def _lookup_completion(self, cache: FlowCache, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Any]:
+        """Looks up the response to a completion request in the response cache.
+
+        :param cache: The response cache
+        :type cache: FlowCache
+        :param kwargs: The parameters of the call
+        :type kwargs: Dict[str, Any]
+        :return: The cache key of the request (None if its response can't be cached) and the cached response (if any)
+        :rtype: Tuple[Optional[str], Any]
+        """
+        request = {**self.params, **kwargs}
+        if not self._is_response_cacheable(request):
+            return None, None
+
+        cache_key = self._make_request_cache_key("litellm-completion", request)
+        messages = cache.get(cache_key)
+        if messages is not None:
+            log.debug(f"Retrieved completion from the response cache: {cache_key}")
+        return cache_key, messages
+
+    def _lookup_embeddings(self, cache: FlowCache, kwargs: Dict[str, Any]) -> Tuple[List[str], List[str], List[Any]]:
+        """Looks up the embeddings of the input strings of an embedding request in the response cache.
+
+        :param cache: The response cache
+        :type cache: FlowCache
+        :param kwargs: The parameters of the call
+        :type kwargs: Dict[str, Any]
+        :return: The input strings, their cache keys and their cached embeddings (None for the missing ones)
+        :rtype: Tuple[List[str], List[str], List[Any]]
+        """
+        request = {**self.params, **kwargs}
+        inputs = request.pop("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+
+        cache_keys = [self._make_request_cache_key("litellm-embedding", {**request, "input": text}) for text in inputs]
+        embeddings = [cache.get(cache_key) for cache_key in cache_keys]
+        return inputs, cache_keys, embeddings
+
+    @staticmethod
+    def _get_missing_embedding_inputs(inputs: List[str], embeddings: List[Any]) -> List[str]:
+        # the same string may appear more than once in the input, it is only embedded once
+        return list(dict.fromkeys(text for text, item in zip(inputs, embeddings) if item is None))
+
+    @staticmethod
+    def _store_embeddings(
+        cache: FlowCache,
+        inputs: List[str],
+        cache_keys: List[str],
+        embeddings: List[Any],
+        missing_inputs: List[str],
+        response: List[Any],
+    ) -> List[Any]:
+        """Caches the embeddings of the missing input strings and returns the embeddings of all the input strings.
+
+        :param cache: The response cache
+        :type cache: FlowCache
+        :param inputs: The input strings
+        :type inputs: List[str]
+        :param cache_keys: The cache keys of the input strings
+        :type cache_keys: List[str]
+        :param embeddings: The cached embeddings of the input strings (None for the missing ones)
+        :type embeddings: List[Any]
+        :param missing_inputs: The input strings that were sent to the API
+        :type missing_inputs: List[str]
+        :param response: The embeddings of the missing input strings returned by the API
+        :type response: List[Any]
+        :return: The embeddings of the input strings (in order)
+        :rtype: List[Any]
+        """
+        computed = dict(zip(missing_inputs, response))
+        stored_keys = set()
+        for text, cache_key, item in zip(inputs, cache_keys, embeddings):
+            if item is None and cache_key not in stored_keys:
+                cache.set(cache_key, computed[text])
+                stored_keys.add(cache_key)
+        embeddings = [computed[text] if item is None else item for text, item in zip(inputs, embeddings)]
+
+        log.debug(f"Embedded {len(inputs)} inputs ({len(inputs) - len(missing_inputs)} from the response cache)")
+        return LiteLLMBackend._reindex_embeddings(embeddings)
+
+    def _get_batching_stats_key(self, batched_param: str, batching: Dict[str, Any]) -> bytes:
+        return canonical_hash([self.model_name, sorted(self.api_infos.keys()), batched_param, batching])
+
+    @contextmanager
+    def _use_request_batcher(
+        self, kwargs: Dict[str, Any], batched_param: str, batching: Dict[str, Any]
+    ) -> Iterator[Optional[RequestBatcher]]:
+        """Uses the batcher of the calls with the given parameters (shared by all the instances of the class with the
+        same model, api keys and parameters while they send such calls), or None if calls are not batched.
+
+        :param kwargs: The parameters of the call
+        :type kwargs: Dict[str, Any]
+        :param batched_param: The parameter whose items are gathered in batches (e.g. "input" for embedding calls)
+        :type batched_param: str
+        :param batching: The parameters of the batcher
+        :type batching: Dict[str, Any]
+        :return: A context manager yielding the batcher
+        """
+        if batching["max_wait_time"] is None:
+            yield None
+            return
+
+        request = {k: v for k, v in {**self.params, **kwargs}.items() if k != batched_param}
+        batcher_key = canonical_hash(
+            [self.model_name, request, sorted(self.api_infos.keys()), batched_param, batching]
+        )
+        stats_key = self._get_batching_stats_key(batched_param, batching)
+        with LiteLLMBackend.__request_batchers.use(batcher_key, stats_key, **batching) as batcher:
+            yield batcher
+
+    def _batching_stats(self, batched_param: str, batching: Dict[str, Any]) -> Optional[Dict[str, float]]:
+        if batching["max_wait_time"] is None:
+            return None
+        return LiteLLMBackend.__request_batchers.stats(self._get_batching_stats_key(batched_param, batching))
+
+    def embedding_batch_stats(self) -> Optional[Dict[str, float]]:
+        """Returns the batch size statistics of the embedding calls of the backend (None if they are not batched).
+
+        :return: The statistics of the batches
+        :rtype: Optional[Dict[str, float]]
+        """
+        return self._batching_stats("input", self.embedding_batching)
+
+    @staticmethod
+    def _reindex_embeddings(embeddings: List[Any]) -> List[Any]:
+        # the index of each embedding is its position in the request of the caller (not in a batch or in the cache)
+        return [{**item, "index": idx} if isinstance(item, dict) else item for idx, item in enumerate(embeddings)]
+
+    def _embed(self, **kwargs):
+        """Calls the embedding API, as part of a batch if embedding calls are batched.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The embeddings of the inputs
+        :rtype: List[Any]
+        """
+        with self._use_request_batcher(kwargs, "input", self.embedding_batching) as batcher:
+            if batcher is None:
+                return self._call_with_next_key(**kwargs)
+
+            inputs = [kwargs["input"]] if isinstance(kwargs["input"], str) else list(kwargs["input"])
+            embeddings = batcher.submit(
+                inputs,
+                estimate_num_tokens({"input": inputs}, embeddings_call=True),
+                lambda batch_inputs: self._call_with_next_key(**{**kwargs, "input": batch_inputs}),
+            )
+        return self._reindex_embeddings(embeddings)
+
+    async def _aembed(self, **kwargs):
+        """Calls the embedding API like _embed, but without blocking the event loop.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The embeddings of the inputs
+        :rtype: List[Any]
+        """
+        with self._use_request_batcher(kwargs, "input", self.embedding_batching) as batcher:
+            if batcher is None:
+                return await self._acall_with_next_key(**kwargs)
+
+            inputs = [kwargs["input"]] if isinstance(kwargs["input"], str) else list(kwargs["input"])
+            embeddings = await batcher.asubmit(
+                inputs,
+                estimate_num_tokens({"input": inputs}, embeddings_call=True),
+                lambda batch_inputs: self._acall_with_next_key(**{**kwargs, "input": batch_inputs}),
+            )
+        return self._reindex_embeddings(embeddings)
+
+    def _get_hedging_policy(self, kwargs: Dict[str, Any]) -> Optional[HedgingPolicy]:
+        """Gets the hedging policy of the calls with the given parameters (shared by all the instances of the class with
+        the same model, api keys and hedging parameters), or None if they are not hedged (streamed calls never are).
+
+        :param kwargs: The parameters of the call
+        :type kwargs: Dict[str, Any]
+        :return: The hedging policy
+        :rtype: Optional[HedgingPolicy]
+        """
+        if self.hedging["percentile"] is None or {**self.params, **kwargs}.get("stream", None):
+            return None
+
+        policy_key = canonical_hash(
+            [self.model_name, sorted(self.api_infos.keys()), self.embeddings_call, self.hedging]
+        )
+        with LiteLLMBackend.__hedging_policies_lock:
+            policy = LiteLLMBackend.__hedging_policies.get(policy_key, None)
+            if policy is None:
+                policy = LiteLLMBackend.__hedging_policies[policy_key] = HedgingPolicy(**self.hedging)
+            return policy
+
+    def hedging_stats(self) -> Optional[Dict[str, float]]:
+        """Returns the number of calls, the number of duplicate requests sent and won and the current hedging delay of
+        the backend (None if calls are not hedged).
+
+        :return: The statistics of the hedging policy
+        :rtype: Optional[Dict[str, float]]
+        """
+        policy = self._get_hedging_policy({})
+        return None if policy is None else policy.stats()
+
+    def sampling_coalesce_stats(self) -> Optional[Dict[str, float]]:
+        """Returns the statistics of the coalesced completion calls of the backend (None if completion calls are not
+        coalesced): the number of requests sent, the number of samples they contained and the mean and maximum number of
+        samples per request.
+
+        :return: The statistics of the coalesced requests
+        :rtype: Optional[Dict[str, float]]
+        """
+        return self._batching_stats("n", self.sampling_coalescing)
+
+    @staticmethod
+    def _get_num_samples(request: Dict[str, Any]) -> int:
+        return request.get("n", None) or 1
+
+    def _sample(self, **kwargs):
+        """Calls the completion API, coalesced with the concurrent identical calls if completion calls are coalesced.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The messages of the n samples
+        :rtype: List[Any]
+        """
+        with self._use_request_batcher(kwargs, "n", self.sampling_coalescing) as coalescer:
+            if coalescer is None:
+                return self._call_with_next_key(**kwargs)
+
+            n = self._get_num_samples({**self.params, **kwargs})
+            messages = coalescer.submit(
+                [None] * n, 0, lambda samples: self._call_with_next_key(**{**kwargs, "n": len(samples)})
+            )
+        if len(messages) < n:
+            # the API returned fewer choices than requested (e.g. it doesn't support n), the missing ones are requested
+            messages = messages + self._call_with_next_key(**{**kwargs, "n": n - len(messages)})
+        return messages
+
+    async def _asample(self, **kwargs):
+        """Calls the completion API like _sample, but without blocking the event loop.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The messages of the n samples
+        :rtype: List[Any]
+        """
+        with self._use_request_batcher(kwargs, "n", self.sampling_coalescing) as coalescer:
+            if coalescer is None:
+                return await self._acall_with_next_key(**kwargs)
+
+            n = self._get_num_samples({**self.params, **kwargs})
+            messages = await coalescer.asubmit(
+                [None] * n, 0, lambda samples: self._acall_with_next_key(**{**kwargs, "n": len(samples)})
+            )
+        if len(messages) < n:
+            messages = messages + await self._acall_with_next_key(**{**kwargs, "n": n - len(messages)})
+        return messages
+
     def __call__(self, **kwargs):
         """Calls the litellm library with the given parameters. It chooses the next API key to use automatically.
+        If the response cache is enabled, cached responses are returned without calling the API.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The response from the litellm library
+        :rtype: List[str]
+        """
+        cache = self._get_response_cache()
+        if cache is None:
+            return self._embed(**kwargs) if self.embeddings_call else self._sample(**kwargs)
+
+        if self.embeddings_call:
+            inputs, cache_keys, embeddings = self._lookup_embeddings(cache, kwargs)
+            missing_inputs = self._get_missing_embedding_inputs(inputs, embeddings)
+            response = self._embed(**{**kwargs, "input": missing_inputs}) if missing_inputs else []
+            return self._store_embeddings(cache, inputs, cache_keys, embeddings, missing_inputs, response)
+
+        cache_key, messages = self._lookup_completion(cache, kwargs)
+        if messages is None:
+            messages = self._sample(**kwargs)
+            if cache_key is not None:
+                cache.set(cache_key, messages)
+        return messages
+
+    def _call_with_next_key(self, **kwargs):
+        """Calls the litellm library with the given parameters and the next API key to use.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The response from the litellm library
+        :rtype: List[str]
+        """
+        policy = self._get_hedging_policy(kwargs)
+        if policy is None:
+            response, merged_kwargs = self._request_with_next_key(**kwargs)
+        else:
+            response, merged_kwargs = self._request_hedged(policy, **kwargs)
+        return self._get_messages(response, **merged_kwargs)
+
+    @staticmethod
+    def _submit_to_hedging_executor(fn) -> Optional[concurrent.futures.Future]:
+        """Runs fn on the shared hedging executor (in a copy of the current context) and returns the future of its
+        result, or None if all the threads of the executor are busy (so that requests never queue behind others).
+        """
+        if not LiteLLMBackend.__hedging_slots.acquire(blocking=False):
+            return None
+        with LiteLLMBackend.__hedging_executor_lock:
+            if LiteLLMBackend.__hedging_executor is None:
+                LiteLLMBackend.__hedging_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=LiteLLMBackend.HEDGING_MAX_THREADS, thread_name_prefix="aiflows-hedging"
+                )
+            executor = LiteLLMBackend.__hedging_executor
+
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                return context.run(fn)
+            finally:
+                LiteLLMBackend.__hedging_slots.release()
+
+        try:
+            return executor.submit(run)
+        except RuntimeError:  # the executor was shut down (at interpreter exit)
+            LiteLLMBackend.__hedging_slots.release()
+            return None
+
+    def _request_hedged(self, policy: HedgingPolicy, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+        """Sends a request like _request_with_next_key, hedging it according to policy: if it hasn't returned after the
+        hedging delay, a duplicate is sent (on another API key if possible) and the first response is returned.
+        Both requests run on a shared pool of threads (the request is sent from the calling thread, unhedged, when the
+        pool is busy). The request that loses the race can't be interrupted, it finishes in the background and its
+        response is discarded. The latency recorded is always the one of the primary request (also when it loses).
+
+        :param policy: The hedging policy
+        :type policy: HedgingPolicy
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The raw response from the litellm library and the parameters of the request
+        :rtype: Tuple[Any, Dict[str, Any]]
+        """
+        hedge_delay = policy.get_hedge_delay()
+        used_keys = set()
+        start = time.monotonic()
+        primary = None
+        if hedge_delay is not None:
+            primary = self._submit_to_hedging_executor(
+                lambda: self._request_with_next_key(used_keys=used_keys, **kwargs)
+            )
+        if primary is None:
+            result = self._request_with_next_key(**kwargs)
+            policy.record_latency(time.monotonic() - start)
+            return result
+
+        def record_primary_latency(future: concurrent.futures.Future):
+            if future.exception() is None:
+                policy.record_latency(time.monotonic() - start)
+
+        primary.add_done_callback(record_primary_latency)
+        done, _ = concurrent.futures.wait([primary], timeout=hedge_delay)
+        if len(done) > 0 or not policy.try_hedge():
+            return primary.result()
+
+        hedge = self._submit_to_hedging_executor(
+            lambda: self._request_with_next_key(used_keys=used_keys, hedge=True, **kwargs)
+        )
+        if hedge is None:
+            return primary.result()
+
+        log.debug(f"Request still running after {hedge_delay:.2f}s, sending a hedge")
+        pending = {primary, hedge}
+        while True:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        policy.record_hedge_win()
+                    return future.result()
+            if len(pending) == 0:
+                # both requests failed
+                return primary.result()
+
+    def _request_with_next_key(
+        self, used_keys: Optional[set] = None, hedge: bool = False, **kwargs
+    ) -> Tuple[Any, Dict[str, Any]]:
+        """Sends a request to the litellm library with the given parameters and the next API key to use.
+        Requests failing with a transient error are retried (with backoff) on the next API key.
+
+        :param used_keys: The keys used by the duplicates of the request, to be avoided if possible (the keys used by
+            the request are added to it)
+        :type used_keys: set, optional
+        :param hedge: Whether the request is a hedge (a duplicate of a slow request)
+        :type hedge: bool, optional
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The raw response from the litellm library and the parameters of the request
+        :rtype: Tuple[Any, Dict[str, Any]]
+        """
+        num_tokens = estimate_num_tokens({**self.params, **kwargs}, self.embeddings_call)
+        call_metrics = CallMetrics(model="", api_key="", flow_name=get_current_flow_name(), hedge=hedge)
+        used_keys = set() if used_keys is None else used_keys
+        failed_keys = set()
+        attempt = 0
+        while True:
+            queue_start = time.monotonic()
+            api_key_idx = self._choose_next_api_key(num_tokens, failed_keys | used_keys)
+            used_keys.add(api_key_idx)
+            call_metrics.queue_wait += time.monotonic() - queue_start
+
+            litellm_api_info = self._get_model_and_api_dict(self.api_infos[api_key_idx])
+
+            merged_kwargs = {**kwargs, **litellm_api_info}
+
+            call_metrics.attempts += 1
+            request_start = time.monotonic()
+            try:
+                response = self._request(**merged_kwargs)
+            except Exception as e:
+                delay = self._on_request_failure(api_key_idx, num_tokens, e, attempt, failed_keys)
+                if delay is None:
+                    self._finish_call_metrics(call_metrics, api_key_idx, merged_kwargs, error=e)
+                    raise
+                failed_keys.add(api_key_idx)
+                attempt += 1
+                call_metrics.retry_wait += delay
+                time.sleep(delay)
+                continue
+
+            self._on_request_success(api_key_idx)
+            self._record_usage(api_key_idx, num_tokens, response)
+            response = self._track_call_metrics(call_metrics, api_key_idx, merged_kwargs, response, request_start)
+            return response, merged_kwargs
+
+    def stream(self, **kwargs) -> LiteLLMStream:
+        """Calls the completion API of the litellm library with the given parameters, streaming the response.
+        The request is sent (with the same key selection and retries as __call__) before this method returns, the
+        returned stream then yields the content deltas of the choices as they arrive. Streamed responses are not cached.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The streamed response
+        :rtype: LiteLLMStream
+        """
+        assert not self.embeddings_call, "Embedding calls can't be streamed"
+        kwargs = {**kwargs, "stream": True}
+        response, merged_kwargs = self._request_with_next_key(**kwargs)
+        return LiteLLMStream(response, n_chat_completion_choices={**self.params, **merged_kwargs}.get("n", None) or 1)
+
+    async def astream(self, **kwargs) -> AsyncLiteLLMStream:
+        """Calls the async completion API of the litellm library with the given parameters, streaming the response
+        (the async version of stream). The request counts towards max_concurrent_requests until the stream is exhausted
+        or closed (see AsyncLiteLLMStream.aclose).
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The streamed response (iterated with async for)
+        :rtype: AsyncLiteLLMStream
+        """
+        assert not self.embeddings_call, "Embedding calls can't be streamed"
+        kwargs = {**kwargs, "stream": True}
+        response, merged_kwargs = await self._arequest_with_next_key(collect_stream=False, **kwargs)
+        return AsyncLiteLLMStream(
+            response, n_chat_completion_choices={**self.params, **merged_kwargs}.get("n", None) or 1
+        )
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Returns the semaphore limiting the number of concurrent requests of the backend on the running event loop.
+
+        :return: The semaphore
+        :rtype: asyncio.Semaphore
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop, None)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrent_requests)
+        return semaphore
+
+    async def acall(self, **kwargs):
+        """Calls the async API of the litellm library with the given parameters (the async version of __call__).
+        It doesn't block the event loop, neither while waiting for an API key nor during the request, so that many
+        requests can be in flight on a single thread. At most max_concurrent_requests requests of the backend are in
+        flight at the same time on an event loop.
+
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The response from the litellm library
+        :rtype: List[str]
+        """
+        cache = self._get_response_cache()
+        if cache is None:
+            if self.embeddings_call:
+                return await self._aembed(**kwargs)
+            return await self._asample(**kwargs)
+
+        if self.embeddings_call:
+            inputs, cache_keys, embeddings = self._lookup_embeddings(cache, kwargs)
+            missing_inputs = self._get_missing_embedding_inputs(inputs, embeddings)
+            response = await self._aembed(**{**kwargs, "input": missing_inputs}) if missing_inputs else []
+            return self._store_embeddings(cache, inputs, cache_keys, embeddings, missing_inputs, response)
+
+        cache_key, messages = self._lookup_completion(cache, kwargs)
+        if messages is None:
+            messages = await self._asample(**kwargs)
+            if cache_key is not None:
+                cache.set(cache_key, messages)
+        return messages
+
+    __acall__ = acall
+
+    async def _acall_with_next_key(self, **kwargs):
+        """Calls the async API of the litellm library with the given parameters and the next API key to use.
 
         :param kwargs: The parameters to pass to the litellm library
         :type kwargs: Any
         :return: The response from the litellm library
         :rtype: List[str]
         """
+        policy = self._get_hedging_policy(kwargs)
+        if policy is None:
+            response, merged_kwargs = await self._arequest_with_next_key(**kwargs)
+        else:
+            response, merged_kwargs = await self._arequest_hedged(policy, **kwargs)
+        return self._get_messages(response, **merged_kwargs)
+
+    async def _arequest_hedged(self, policy: HedgingPolicy, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+        """Sends a request like _arequest_with_next_key, hedging it like _request_hedged (the request that loses the
+        race is cancelled, and a cancelled primary request is recorded with the time it ran for).
+
+        :param policy: The hedging policy
+        :type policy: HedgingPolicy
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The raw response from the litellm library and the parameters of the request
+        :rtype: Tuple[Any, Dict[str, Any]]
+        """
+        hedge_delay = policy.get_hedge_delay()
+        start = time.monotonic()
+        if hedge_delay is None:
+            result = await self._arequest_with_next_key(**kwargs)
+            policy.record_latency(time.monotonic() - start)
+            return result
+
+        used_keys = set()
+        primary = asyncio.ensure_future(self._arequest_with_next_key(used_keys=used_keys, **kwargs))
+
+        def record_primary_latency(task: asyncio.Future):
+            # a primary request cancelled because its hedge won ran for at least this long
+            if task.cancelled() or task.exception() is None:
+                policy.record_latency(time.monotonic() - start)
+
+        primary.add_done_callback(record_primary_latency)
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+            if len(done) == 0 and policy.try_hedge():
+                log.debug(f"Request still running after {hedge_delay:.2f}s, sending a hedge")
+                hedge = asyncio.ensure_future(self._arequest_with_next_key(used_keys=used_keys, hedge=True, **kwargs))
+                pending.add(hedge)
 
-        api_key_info = self.get_key()
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            policy.record_hedge_win()
+                        return task.result()
+                if len(pending) == 0:
+                    # all the requests failed
+                    return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
 
-        litellm_api_info = self._get_model_and_api_dict(api_key_info)
+    async def _arequest_with_next_key(
+        self, collect_stream: bool = True, used_keys: Optional[set] = None, hedge: bool = False, **kwargs
+    ) -> Tuple[Any, Dict[str, Any]]:
+        """Sends a request to the async API of the litellm library with the given parameters and the next API key to
+        use, retrying like _request_with_next_key.
 
-        merged_kwargs = {**kwargs, **litellm_api_info}
+        :param collect_stream: Whether streamed responses are collected into the list of their chunks
+        :type collect_stream: bool, optional
+        :param used_keys: The keys used by the duplicates of the request, to be avoided if possible (the keys used by
+            the request are added to it)
+        :type used_keys: set, optional
+        :param hedge: Whether the request is a hedge (a duplicate of a slow request)
+        :type hedge: bool, optional
+        :param kwargs: The parameters to pass to the litellm library
+        :type kwargs: Any
+        :return: The raw response from the litellm library and the parameters of the request
+        :rtype: Tuple[Any, Dict[str, Any]]
+        """
+        num_tokens = estimate_num_tokens({**self.params, **kwargs}, self.embeddings_call)
+        call_metrics = CallMetrics(model="", api_key="", flow_name=get_current_flow_name(), hedge=hedge)
+        used_keys = set() if used_keys is None else used_keys
+        failed_keys = set()
+        attempt = 0
+        while True:
+            queue_start = time.monotonic()
+            # the backoff delays are spent outside the semaphore, so that they don't hold back other requests
+            semaphore = self._get_semaphore()
+            await semaphore.acquire()
+            release_permit = True
+            try:
+                api_key_idx = await self._achoose_next_api_key(num_tokens, failed_keys | used_keys)
+                used_keys.add(api_key_idx)
+                call_metrics.queue_wait += time.monotonic() - queue_start
+
+                litellm_api_info = self._get_model_and_api_dict(self.api_infos[api_key_idx])
+
+                merged_kwargs = {**kwargs, **litellm_api_info}
+
+                call_metrics.attempts += 1
+                request_start = time.monotonic()
+                retry_delay = None
+                try:
+                    response = await self._arequest(collect_stream=False, **merged_kwargs)
+                    response = self._track_call_metrics(
+                        call_metrics, api_key_idx, merged_kwargs, response, request_start
+                    )
+                    if hasattr(response, "__aiter__"):
+                        if collect_stream:
+                            response = [chunk async for chunk in response]
+                        else:
+                            # the request is in flight until its stream is exhausted or closed
+                            response = _PermitHoldingChunks(response, semaphore)
+                            release_permit = False
+                except Exception as e:
+                    retry_delay = self._on_request_failure(api_key_idx, num_tokens, e, attempt, failed_keys)
+                    if retry_delay is None:
+                        self._finish_call_metrics(call_metrics, api_key_idx, merged_kwargs, error=e)
+                        raise
+            finally:
+                if release_permit:
+                    semaphore.release()
+
+            if retry_delay is not None:
+                failed_keys.add(api_key_idx)
+                attempt += 1
+                call_metrics.retry_wait += retry_delay
+                await asyncio.sleep(retry_delay)
+                continue
 
-        return self._call(**merged_kwargs)
+            self._on_request_success(api_key_idx)
+            self._record_usage(api_key_idx, num_tokens, response)
+            return response, merged_kwargs
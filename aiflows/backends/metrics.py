@@ -0,0 +1,322 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterator, List, Optional
+
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+# the dimensions the call metrics are aggregated on
+METRICS_GROUPS = ("model", "api_key", "flow")
+
+
+@dataclass
+class METRICS_PARAMETERS:
+    """This class contains the global parameters of the metrics of the LLM calls.
+
+    :param summary_interval: The interval between two summaries of the metrics logged by the default collector in
+        seconds (None to never log them). It can be set with the environment variable AIFLOWS_METRICS_SUMMARY_INTERVAL
+    :type summary_interval: float, optional
+    :param max_samples: The number of most recent latencies kept per model, API key and flow to compute percentiles
+    :type max_samples: int
+    """
+
+    summary_interval: Optional[float] = None
+    max_samples: int = 1024
+
+
+if os.getenv("AIFLOWS_METRICS_SUMMARY_INTERVAL", "").lower() not in ("", "none"):
+    METRICS_PARAMETERS.summary_interval = float(os.getenv("AIFLOWS_METRICS_SUMMARY_INTERVAL"))
+
+# the name of the flow running in the current thread or task, attached to the metrics of its calls
+_current_flow_name: contextvars.ContextVar = contextvars.ContextVar("aiflows_current_flow_name", default=None)
+
+
+def get_current_flow_name() -> Optional[str]:
+    """Returns the name of the flow running in the current thread or task (None if no flow is running)."""
+    return _current_flow_name.get()
+
+
+@contextmanager
+def flow_name_context(flow_name: str) -> Iterator[None]:
+    """Context manager attributing the LLM calls made inside it to a flow.
+
+    :param flow_name: The name of the flow
+    :type flow_name: str
+    """
+    token = _current_flow_name.set(flow_name)
+    try:
+        yield
+    finally:
+        _current_flow_name.reset(token)
+
+
+@dataclass
+class CallMetrics:
+    """The metrics of a call to an LLM API (including its retries).
+
+    :param model: The model called
+    :type model: str
+    :param api_key: The label of the API key of the (last) request (the key itself is a secret)
+    :type api_key: str
+    :param flow_name: The name of the flow making the call (None if it was not made by a flow)
+    :type flow_name: str, optional
+    :param prompt_tokens: The number of prompt tokens (estimated if the response doesn't report them)
+    :type prompt_tokens: int
+    :param completion_tokens: The number of completion tokens (estimated if the response doesn't report them)
+    :type completion_tokens: int
+    :param cost: The cost of the call in USD (None if the price of the model is unknown)
+    :type cost: float, optional
+    :param queue_wait: The time spent waiting for an API key (rate limits, circuit breakers and concurrency limit)
+    :type queue_wait: float
+    :param retry_wait: The time spent waiting between retries
+    :type retry_wait: float
+    :param latency: The time between sending the (last) request and receiving the whole response
+    :type latency: float
+    :param time_to_first_token: The time between sending the (last) request and receiving the first chunk of the
+        response (the latency for responses that are not streamed)
+    :type time_to_first_token: float, optional
+    :param attempts: The number of requests sent
+    :type attempts: int
+    :param hedge: Whether the call is a hedge (a duplicate of a slow call, see LiteLLMBackend)
+    :type hedge: bool
+    :param error: The name of the error the call failed with (None if it succeeded)
+    :type error: str, optional
+    :param timestamp: The time the call started (seconds since the epoch)
+    :type timestamp: float
+    """
+
+    model: str
+    api_key: str
+    flow_name: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: Optional[float] = None
+    queue_wait: float = 0.0
+    retry_wait: float = 0.0
+    latency: float = 0.0
+    time_to_first_token: Optional[float] = None
+    attempts: int = 0
+    hedge: bool = False
+    error: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+    def get_group(self, group: str) -> str:
+        """Returns the name of the call in a dimension of METRICS_GROUPS."""
+        if group == "model":
+            return self.model
+        if group == "api_key":
+            return self.api_key
+        return self.flow_name or "unknown"
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, round(percentile / 100 * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+class _Aggregate:
+    """The aggregated metrics of the calls of a model, API key or flow."""
+
+    def __init__(self, max_samples: int):
+        self.calls = 0
+        self.errors = 0
+        self.attempts = 0
+        self.hedges = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.queue_wait = 0.0
+        self.retry_wait = 0.0
+        self.latency = 0.0
+        self.latencies: Deque[float] = deque(maxlen=max_samples)
+        self.times_to_first_token: Deque[float] = deque(maxlen=max_samples)
+
+    def add(self, call: CallMetrics):
+        self.calls += 1
+        self.attempts += call.attempts
+        self.hedges += int(call.hedge)
+        self.queue_wait += call.queue_wait
+        self.retry_wait += call.retry_wait
+        if call.error is not None:
+            self.errors += 1
+            return
+
+        self.prompt_tokens += call.prompt_tokens
+        self.completion_tokens += call.completion_tokens
+        self.cost += call.cost or 0.0
+        self.latency += call.latency
+        self.latencies.append(call.latency)
+        if call.time_to_first_token is not None:
+            self.times_to_first_token.append(call.time_to_first_token)
+
+    def summary(self) -> Dict[str, float]:
+        successes = self.calls - self.errors
+        latencies = sorted(self.latencies)
+        times_to_first_token = sorted(self.times_to_first_token)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.attempts - self.calls,
+            "hedges": self.hedges,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost": self.cost,
+            "mean_queue_wait": self.queue_wait / self.calls if self.calls > 0 else 0.0,
+            "mean_retry_wait": self.retry_wait / self.calls if self.calls > 0 else 0.0,
+            "mean_latency": self.latency / successes if successes > 0 else 0.0,
+            "p50_latency": _percentile(latencies, 50),
+            "p95_latency": _percentile(latencies, 95),
+            "p99_latency": _percentile(latencies, 99),
+            "p50_time_to_first_token": _percentile(times_to_first_token, 50),
+            "p95_time_to_first_token": _percentile(times_to_first_token, 95),
+        }
+
+
+class MetricsCollector:
+    """The base class of the collectors of the metrics of the LLM calls. Subclasses can forward the metrics of each call
+    to a monitoring system by implementing record."""
+
+    def record(self, call: CallMetrics):
+        """Records the metrics of a call.
+
+        :param call: The metrics of the call
+        :type call: CallMetrics
+        """
+        raise NotImplementedError
+
+
+class AggregatingMetricsCollector(MetricsCollector):
+    """A metrics collector aggregating the metrics of the calls per model, per API key and per flow (see summary), and
+    optionally logging a summary of them periodically.
+
+    :param summary_interval: The interval between two logged summaries in seconds (None to never log them)
+    :type summary_interval: float, optional
+    :param max_samples: The number of most recent latencies kept per model, API key and flow to compute percentiles
+    :type max_samples: int, optional
+    """
+
+    def __init__(self, summary_interval: Optional[float] = None, max_samples: int = 1024):
+        self.summary_interval = summary_interval
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._aggregates: Dict[str, Dict[str, _Aggregate]] = {group: {} for group in METRICS_GROUPS}
+        self._last_summary_time = time.monotonic()
+
+    def record(self, call: CallMetrics):
+        """Adds the metrics of a call to the aggregates of its model, API key and flow.
+
+        :param call: The metrics of the call
+        :type call: CallMetrics
+        """
+        with self._lock:
+            for group, aggregates in self._aggregates.items():
+                name = call.get_group(group)
+                if name not in aggregates:
+                    aggregates[name] = _Aggregate(self.max_samples)
+                aggregates[name].add(call)
+
+            log_summary = (
+                self.summary_interval is not None
+                and time.monotonic() - self._last_summary_time >= self.summary_interval
+            )
+            if log_summary:
+                self._last_summary_time = time.monotonic()
+
+        if log_summary:
+            log.info(self.format_summary())
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Returns the aggregated metrics of the calls, e.g. {"model": {"gpt-4": {"calls": ..., ...}}, "api_key": ...,
+        "flow": ...}: the number of calls, errors, retries and hedges, the number of tokens, the cost, the mean time
+        waited for a key and between retries, and the mean and percentiles of the latency and of the time to first
+        token.
+
+        :return: The aggregated metrics per model, per API key and per flow
+        :rtype: Dict[str, Dict[str, Dict[str, float]]]
+        """
+        with self._lock:
+            return {
+                group: {name: aggregate.summary() for name, aggregate in aggregates.items()}
+                for group, aggregates in self._aggregates.items()
+            }
+
+    def format_summary(self) -> str:
+        """Returns the aggregated metrics of the calls as a human readable table.
+
+        :return: The summary
+        :rtype: str
+        """
+        lines = ["LLM call metrics:"]
+        for group, aggregates in self.summary().items():
+            for name, stats in sorted(aggregates.items(), key=lambda item: -item[1]["calls"]):
+                lines.append(
+                    f"  {group}={name}: {stats['calls']} calls ({stats['errors']} errors, {stats['retries']} retries, "
+                    f"{stats['hedges']} hedges), "
+                    f"{stats['prompt_tokens']}+{stats['completion_tokens']} tokens, ${stats['cost']:.4f}, "
+                    f"queue {stats['mean_queue_wait']:.3f}s, latency {stats['mean_latency']:.3f}s "
+                    f"(p95 {stats['p95_latency']:.3f}s), ttft p50 {stats['p50_time_to_first_token']:.3f}s"
+                )
+        return "\n".join(lines)
+
+    def reset(self):
+        """Forgets the metrics recorded so far."""
+        with self._lock:
+            self._aggregates = {group: {} for group in METRICS_GROUPS}
+
+
+_metrics_collector: Optional[MetricsCollector] = None
+_metrics_collector_set = False
+_metrics_collector_lock = threading.Lock()
+
+
+def get_metrics_collector() -> Optional[MetricsCollector]:
+    """Returns the collector of the metrics of the LLM calls of the process. Unless set_metrics_collector was called, it
+    is an AggregatingMetricsCollector (created on first use with METRICS_PARAMETERS).
+
+    :return: The metrics collector (None if metrics are not collected)
+    :rtype: Optional[MetricsCollector]
+    """
+    global _metrics_collector
+    if not _metrics_collector_set and _metrics_collector is None:
+        with _metrics_collector_lock:
+            if not _metrics_collector_set and _metrics_collector is None:
+                _metrics_collector = AggregatingMetricsCollector(
+                    METRICS_PARAMETERS.summary_interval, METRICS_PARAMETERS.max_samples
+                )
+    return _metrics_collector
+
+
+def set_metrics_collector(collector: Optional[MetricsCollector]):
+    """Sets the collector of the metrics of the LLM calls of the process.
+
+    :param collector: The metrics collector (None to stop collecting metrics)
+    :type collector: Optional[MetricsCollector]
+    """
+    global _metrics_collector, _metrics_collector_set
+    with _metrics_collector_lock:
+        _metrics_collector = collector
+        _metrics_collector_set = True
+
+
+def record_call_metrics(call: CallMetrics):
+    """Passes the metrics of a call to the metrics collector of the process (errors of the collector are logged, they
+    never fail the call).
+
+    :param call: The metrics of the call
+    :type call: CallMetrics
+    """
+    collector = get_metrics_collector()
+    if collector is None:
+        return
+    try:
+        collector.record(call)
+    except Exception as e:
+        log.warning(f"The metrics collector failed to record a call: {type(e).__name__}: {e}")
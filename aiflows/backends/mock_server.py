@@ -0,0 +1,174 @@
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+from aiflows.backends.fake_llm import FakeLLM, FakeLLMError
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+
+class _MockLLMRequestHandler(BaseHTTPRequestHandler):
+    """Serves the chat completion and embedding endpoints of the OpenAI API with the FakeLLM of the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        log.debug(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, status_code: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, error: FakeLLMError):
+        error_type = "rate_limit_error" if error.status_code == 429 else "server_error"
+        self._send_json(
+            error.status_code, {"error": {"message": str(error), "type": error_type, "code": None}}, error.headers
+        )
+
+    def _send_stream(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "aiflows"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown endpoint {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send_json(400, {"error": {"message": f"Invalid JSON body: {e}", "type": "invalid_request_error"}})
+            return
+
+        fake_llm: FakeLLM = self.server.fake_llm
+        path = self.path.split("?")[0].rstrip("/")
+        try:
+            if path.endswith("/chat/completions"):
+                response = fake_llm.completion(**params)
+                if params.get("stream", False):
+                    self._send_stream(response)
+                    return
+            elif path.endswith("/embeddings"):
+                response = fake_llm.embedding(**params)
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown endpoint {path}", "type": "invalid_request_error"}})
+                return
+        except FakeLLMError as e:
+            self._send_error(e)
+            return
+        self._send_json(200, response)
+
+
+class MockLLMServer:
+    """A local HTTP server serving a FakeLLM through the chat completion and embedding endpoints of the OpenAI API
+    (/v1/chat/completions, with server-sent events when streaming, and /v1/embeddings), with simulated latencies and
+    errors. It stands in for an OpenAI-compatible API, e.g. with
+    ApiInfo(backend_used="openai", api_base=server.url, api_key="fake") and the model "openai/<any name>".
+
+    It can be started in a background thread (start/stop, or as a context manager), or from the command line with
+    python -m aiflows.backends.mock_server --port 8000 (see --help for the simulation parameters).
+
+    :param fake_llm: The FakeLLM serving the requests (a FakeLLM with the default parameters if None)
+    :type fake_llm: FakeLLM, optional
+    :param host: The host to listen on
+    :type host: str, optional
+    :param port: The port to listen on (0 for any free port)
+    :type port: int, optional
+    """
+
+    def __init__(self, fake_llm: Optional[FakeLLM] = None, host: str = "127.0.0.1", port: int = 0):
+        self.fake_llm = fake_llm if fake_llm is not None else FakeLLM()
+        self._server = ThreadingHTTPServer((host, port), _MockLLMRequestHandler)
+        self._server.daemon_threads = True
+        self._server.fake_llm = self.fake_llm
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Returns the base URL of the API served (to be used as api_base)."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        """Starts serving requests in a background thread.
+
+        :return: The server
+        :rtype: MockLLMServer
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        log.info(f"Mock LLM server listening on {self.url}")
+        return self
+
+    def serve_forever(self):
+        """Serves requests until interrupted."""
+        log.info(f"Mock LLM server listening on {self.url}")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        """Stops serving requests."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a fake OpenAI-compatible LLM API for load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-distribution", default="lognormal", choices=["constant", "normal", "lognormal"])
+    parser.add_argument("--latency-mean", type=float, default=0.5)
+    parser.add_argument("--latency-std", type=float, default=0.2)
+    parser.add_argument("--time-per-token", type=float, default=0.01)
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--chunk-tokens", type=int, default=4)
+    parser.add_argument("--echo", action="store_true")
+    parser.add_argument("--embedding-dim", type=int, default=16)
+    parser.add_argument("--rate-limit-error-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--requests-per-minute", type=float, default=None)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = vars(parser.parse_args())
+
+    host, port = args.pop("host"), args.pop("port")
+    MockLLMServer(FakeLLM(**args), host=host, port=port).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional
+
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+
+class _Batch:
+    """The items gathered from concurrent callers, to be sent in a single request."""
+
+    def __init__(self, full_event, done_event):
+        self.inputs: List[Any] = []
+        self.num_tokens = 0
+        self.results: Optional[List[Any]] = None
+        self.error: Optional[BaseException] = None
+        # set when no more items fit in the batch, and when the batch is sent
+        self.full = full_event
+        self.done = done_event
+
+    def add(self, inputs: List[Any], num_tokens: int) -> int:
+        start = len(self.inputs)
+        self.inputs.extend(inputs)
+        self.num_tokens += num_tokens
+        return start
+
+    def get_results(self, start: int, num_inputs: int) -> List[Any]:
+        if self.error is not None:
+            raise self.error
+        return self.results[start : start + num_inputs]
+
+
+class BatchStats:
+    """The statistics of the batches sent by one or several batchers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.num_batches = 0
+        self.num_inputs = 0
+        self.max_observed_batch_size = 0
+
+    def record(self, batch_size: int):
+        """Records a batch that was sent.
+
+        :param batch_size: The number of items of the batch
+        :type batch_size: int
+        """
+        with self._lock:
+            self.num_batches += 1
+            self.num_inputs += batch_size
+            self.max_observed_batch_size = max(self.max_observed_batch_size, batch_size)
+
+    def as_dict(self) -> Dict[str, float]:
+        """Returns the number of batches sent, the number of items they contained and the mean and maximum batch sizes.
+
+        :return: The statistics
+        :rtype: Dict[str, float]
+        """
+        with self._lock:
+            return {
+                "batches": self.num_batches,
+                "inputs": self.num_inputs,
+                "mean_batch_size": self.num_inputs / self.num_batches if self.num_batches > 0 else 0.0,
+                "max_batch_size": self.max_observed_batch_size,
+            }
+
+
+class RequestBatcher:
+    """Gathers the items of concurrent requests into batches sent as a single request, e.g. the inputs of embedding
+    requests, or the samples of completion requests with the same prompt (sent as a single request with n > 1).
+
+    The first caller of a batch waits until the batch is full (max_batch_size items or max_batch_tokens tokens) or for
+    max_wait_time seconds, while the following callers add their items to it. It then sends the batch and scatters the
+    results back to the callers (an error fails all the callers of the batch).
+    Threads (submit) and coroutines (asubmit) are batched separately, coroutines per event loop.
+
+    :param max_wait_time: The maximum time the first caller of a batch waits for other callers in seconds
+    :type max_wait_time: float
+    :param max_batch_size: The maximum number of items of a batch
+    :type max_batch_size: int
+    :param max_batch_tokens: The maximum (estimated) number of tokens of a batch (None for no limit)
+    :type max_batch_tokens: int, optional
+    :param stats: The statistics the batches are recorded in (e.g. shared with other batchers), new ones if None
+    :type stats: BatchStats, optional
+    """
+
+    def __init__(
+        self,
+        max_wait_time: float,
+        max_batch_size: int = 256,
+        max_batch_tokens: Optional[int] = None,
+        stats: Optional[BatchStats] = None,
+    ):
+        self.max_wait_time = max_wait_time
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+        self._lock = threading.Lock()
+        self._open_batch: Optional[_Batch] = None
+        self._open_async_batches: Dict[asyncio.AbstractEventLoop, _Batch] = {}
+
+        self._stats = BatchStats() if stats is None else stats
+
+    def _fits(self, batch: _Batch, num_inputs: int, num_tokens: int) -> bool:
+        if len(batch.inputs) + num_inputs > self.max_batch_size:
+            return False
+        return self.max_batch_tokens is None or batch.num_tokens + num_tokens <= self.max_batch_tokens
+
+    def _is_full(self, batch: _Batch) -> bool:
+        if len(batch.inputs) >= self.max_batch_size:
+            return True
+        return self.max_batch_tokens is not None and batch.num_tokens >= self.max_batch_tokens
+
+    def _join(self, open_batch: Optional[_Batch], inputs: List[Any], num_tokens: int, make_batch: Callable[[], _Batch]):
+        """Adds items to the open batch (or to a new one if they don't fit). Must be called with the lock held.
+
+        :return: The batch, the position of the items in it, whether the caller is its first caller, and the batch
+            that is open after the call (None if it is full)
+        """
+        if open_batch is not None and not self._fits(open_batch, len(inputs), num_tokens):
+            # no room left, the first caller of the batch can send it
+            open_batch.full.set()
+            open_batch = None
+
+        is_first = open_batch is None
+        if is_first:
+            open_batch = make_batch()
+        batch = open_batch
+
+        start = batch.add(inputs, num_tokens)
+        if self._is_full(batch):
+            batch.full.set()
+            open_batch = None
+        return batch, start, is_first, open_batch
+
+    def _record_batch(self, batch: _Batch):
+        self._stats.record(len(batch.inputs))
+        log.debug(f"Sending a batch of {len(batch.inputs)} items ({batch.num_tokens} estimated tokens)")
+
+    def submit(self, inputs: List[Any], num_tokens: int, send: Callable[[List[Any]], List[Any]]) -> List[Any]:
+        """Sends items as part of a batch.
+
+        :param inputs: The items to send
+        :type inputs: List[Any]
+        :param num_tokens: The (estimated) number of tokens of the items
+        :type num_tokens: int
+        :param send: Sends a request for a batch of items and returns their results (in order)
+        :type send: Callable[[List[Any]], List[Any]]
+        :return: The results of the items (in order, possibly fewer if the request returned fewer results)
+        :rtype: List[Any]
+        """
+        with self._lock:
+            batch, start, is_first, self._open_batch = self._join(
+                self._open_batch, inputs, num_tokens, lambda: _Batch(threading.Event(), threading.Event())
+            )
+
+        if not is_first:
+            batch.done.wait()
+            return batch.get_results(start, len(inputs))
+
+        batch.full.wait(self.max_wait_time)
+        with self._lock:
+            if self._open_batch is batch:
+                self._open_batch = None
+
+        self._record_batch(batch)
+        try:
+            batch.results = send(batch.inputs)
+        except BaseException as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+        return batch.get_results(start, len(inputs))
+
+    async def asubmit(
+        self, inputs: List[Any], num_tokens: int, send: Callable[[List[Any]], Awaitable[List[Any]]]
+    ) -> List[Any]:
+        """Sends items as part of a batch, without blocking the event loop (the async version of submit).
+
+        :param inputs: The items to send
+        :type inputs: List[Any]
+        :param num_tokens: The (estimated) number of tokens of the items
+        :type num_tokens: int
+        :param send: Sends a request for a batch of items and returns their results (in order)
+        :type send: Callable[[List[Any]], Awaitable[List[Any]]]
+        :return: The results of the items (in order, possibly fewer if the request returned fewer results)
+        :rtype: List[Any]
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            batch, start, is_first, open_batch = self._join(
+                self._open_async_batches.get(loop, None),
+                inputs,
+                num_tokens,
+                lambda: _Batch(asyncio.Event(), asyncio.Event()),
+            )
+            if open_batch is None:
+                self._open_async_batches.pop(loop, None)
+            else:
+                self._open_async_batches[loop] = open_batch
+
+        if not is_first:
+            await batch.done.wait()
+            return batch.get_results(start, len(inputs))
+
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.max_wait_time)
+        except asyncio.TimeoutError:
+            pass
+        with self._lock:
+            if self._open_async_batches.get(loop, None) is batch:
+                del self._open_async_batches[loop]
+
+        self._record_batch(batch)
+        try:
+            batch.results = await send(batch.inputs)
+        except BaseException as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+        return batch.get_results(start, len(inputs))
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the number of batches sent, the number of items they contained and the mean and maximum batch sizes.
+
+        :return: The statistics of the batcher
+        :rtype: Dict[str, float]
+        """
+        return self._stats.as_dict()
+
+
+class _RegisteredBatcher:
+    def __init__(self, batcher: RequestBatcher):
+        self.batcher = batcher
+        self.num_users = 0
+
+
+class RequestBatcherRegistry:
+    """The batchers shared by the callers sending the same requests. A batcher only exists while callers use it (all its
+    batches are sent when its last caller returns), so the registry doesn't grow with the number of distinct requests
+    (e.g. one batcher per prompt when coalescing completion samples). The statistics of the batches are kept per group
+    of batchers (e.g. per backend), as long as the registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._batchers: Dict[Hashable, _RegisteredBatcher] = {}
+        self._stats: Dict[Hashable, BatchStats] = {}
+
+    def _get_stats(self, stats_key: Hashable) -> BatchStats:
+        stats = self._stats.get(stats_key, None)
+        if stats is None:
+            stats = self._stats[stats_key] = BatchStats()
+        return stats
+
+    @contextmanager
+    def use(self, batcher_key: Hashable, stats_key: Hashable, **batching) -> Iterator[RequestBatcher]:
+        """Uses the batcher of batcher_key (created if needed, and removed when its last user is done with it).
+
+        :param batcher_key: The key of the requests batched together
+        :type batcher_key: Hashable
+        :param stats_key: The key of the group of batchers the statistics are aggregated over
+        :type stats_key: Hashable
+        :param batching: The parameters of the batcher (see RequestBatcher)
+        :type batching: Any
+        :return: A context manager yielding the batcher
+        """
+        with self._lock:
+            registered = self._batchers.get(batcher_key, None)
+            if registered is None:
+                batcher = RequestBatcher(**batching, stats=self._get_stats(stats_key))
+                registered = self._batchers[batcher_key] = _RegisteredBatcher(batcher)
+            registered.num_users += 1
+
+        try:
+            yield registered.batcher
+        finally:
+            with self._lock:
+                registered.num_users -= 1
+                if registered.num_users == 0:
+                    del self._batchers[batcher_key]
+
+    def stats(self, stats_key: Hashable) -> Dict[str, float]:
+        """Returns the statistics of the batches of a group of batchers (see BatchStats.as_dict).
+
+        :param stats_key: The key of the group of batchers
+        :type stats_key: Hashable
+        :return: The statistics
+        :rtype: Dict[str, float]
+        """
+        with self._lock:
+            stats = self._get_stats(stats_key)
+        return stats.as_dict()
+
+    def __len__(self):
+        """Returns the number of batchers in use."""
+        with self._lock:
+            return len(self._batchers)
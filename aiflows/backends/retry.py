@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+# HTTP status codes of the errors worth retrying (timeouts, conflicts, rate limits and server errors)
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504, 529)
+# names of the exception classes (of litellm, openai, httpx, ...) of the errors worth retrying
+RETRYABLE_ERROR_NAMES = (
+    "RateLimitError",
+    "Timeout",
+    "APITimeoutError",
+    "APIConnectionError",
+    "ServiceUnavailableError",
+    "InternalServerError",
+    "ConnectError",
+    "ReadTimeout",
+    "ConnectTimeout",
+)
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """Returns the HTTP status code of an error raised by a request (None if it has none)."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    try:
+        return int(status_code) if status_code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Returns whether a request that raised error may succeed if retried (rate limits, timeouts, connection errors and
+    server errors), as opposed to errors that would happen again (e.g. invalid requests or authentication errors).
+
+    :param error: The error raised by the request
+    :type error: Exception
+    :return: Whether the request should be retried
+    :rtype: bool
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Returns whether error is a rate limit error (specific to the API key, not to the API)."""
+    return get_status_code(error) == 429 or any(cls.__name__ == "RateLimitError" for cls in type(error).__mro__)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Returns the time to wait before retrying according to the Retry-After headers of the response of an error
+    (None if there is no such header).
+
+    :param error: The error raised by the request
+    :type error: Exception
+    :return: The time to wait in seconds
+    :rtype: Optional[float]
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None)
+    if not headers:
+        return None
+
+    try:
+        retry_after_ms = headers.get("retry-after-ms", None)
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000
+
+        retry_after = headers.get("retry-after", None)
+        if retry_after is None:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            # HTTP date
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def get_backoff_delay(attempt: int, base_delay: float, max_delay: float, retry_after: Optional[float] = None) -> float:
+    """Returns the time to wait before the next attempt: an exponential backoff with full jitter, but at least the time
+    requested by the server (Retry-After) if any.
+
+    :param attempt: The number of the failed attempt (starting from 0)
+    :type attempt: int
+    :param base_delay: The maximum delay after the first attempt
+    :type base_delay: float
+    :param max_delay: The maximum delay
+    :type max_delay: float
+    :param retry_after: The time to wait requested by the server
+    :type retry_after: float, optional
+    :return: The time to wait in seconds
+    :rtype: float
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+
+class CircuitBreakers:
+    """Circuit breakers taking failing API keys or API bases out of rotation.
+    After failure_threshold consecutive failures, a circuit is open (its requests should go elsewhere) for cooldown
+    seconds. It is then half-open: requests are let through again, a success closes it and a failure opens it again.
+
+    :param failure_threshold: The number of consecutive failures opening a circuit
+    :type failure_threshold: int
+    :param cooldown: The time a circuit stays open in seconds
+    :type cooldown: float
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures: Dict[str, int] = {}
+        self._open_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def time_until_closed(self, names: Iterable[str]) -> float:
+        """Returns how long the circuits of names (e.g. an API key and its API base) stay open (0 if they are all closed
+        or half-open).
+
+        :param names: The names of the circuits
+        :type names: Iterable[str]
+        :return: The time in seconds
+        :rtype: float
+        """
+        now = time.monotonic()
+        with self._lock:
+            return max([0.0] + [self._open_until.get(name, 0.0) - now for name in names])
+
+    def record_success(self, names: Iterable[str]):
+        """Closes the circuits of names."""
+        with self._lock:
+            for name in names:
+                self._failures.pop(name, None)
+                self._open_until.pop(name, None)
+
+    def record_failure(self, names: Iterable[str]):
+        """Records a failure on the circuits of names, opening the ones that reach the failure threshold."""
+        now = time.monotonic()
+        with self._lock:
+            for name in names:
+                self._failures[name] = self._failures.get(name, 0) + 1
+                if self._failures[name] >= self.failure_threshold:
+                    if self._open_until.get(name, 0.0) <= now:
+                        log.warning(f"Circuit opened for {self.cooldown}s after {self._failures[name]} failures.")
+                    self._open_until[name] = now + self.cooldown
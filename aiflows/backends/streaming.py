@@ -0,0 +1,193 @@
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+
+def _get_choice_deltas(chunk) -> List[Dict[str, Any]]:
+    """Returns the content deltas of a chunk of a streamed response: a list of {"index": ..., "content": ...}."""
+    if "choices" not in chunk or len(chunk["choices"]) == 0:
+        return []
+
+    deltas = []
+    # must be added for case where n > 1 (argument in completion function)
+    for choice in chunk["choices"]:
+        # delta is initialy a class (Delta), its content is read like a dictionary
+        if "content" not in choice["delta"]:
+            continue
+        content = choice["delta"]["content"]
+        if content is None:
+            continue
+        deltas.append({"index": int(choice["index"]), "content": content})
+    return deltas
+
+
+class StreamAccumulator:
+    """Accumulates the content deltas of the choices of a streamed response.
+    The parts of each choice are kept in a list and joined once, so accumulating a response takes linear time.
+
+    :param n_chat_completion_choices: The number of chat completion choices (n parameter in the completion function)
+    :type n_chat_completion_choices: int
+    """
+
+    def __init__(self, n_chat_completion_choices: int = 1):
+        self._parts: List[List[str]] = [[] for _ in range(n_chat_completion_choices)]
+
+    def add_chunk(self, chunk) -> List[Dict[str, Any]]:
+        """Adds a chunk of the streamed response.
+
+        :param chunk: The chunk
+        :type chunk: Any
+        :return: The content deltas of the chunk ({"index": ..., "content": ...})
+        :rtype: List[Dict[str, Any]]
+        """
+        deltas = _get_choice_deltas(chunk)
+        for delta in deltas:
+            while delta["index"] >= len(self._parts):
+                self._parts.append([])
+            self._parts[delta["index"]].append(delta["content"])
+        return deltas
+
+    def get_content(self, index: int = 0) -> str:
+        """Returns the content of a choice accumulated so far.
+
+        :param index: The index of the choice
+        :type index: int, optional
+        :return: The content
+        :rtype: str
+        """
+        parts = self._parts[index]
+        if len(parts) > 1:
+            # joined parts are kept joined, so repeated calls don't redo the work
+            parts[:] = ["".join(parts)]
+        return parts[0] if len(parts) > 0 else ""
+
+    def get_messages(self) -> List[Dict[str, Any]]:
+        """Returns the messages accumulated so far (one per choice, like merge_streams).
+
+        :return: The messages
+        :rtype: List[Dict[str, Any]]
+        """
+        return [{"content": self.get_content(idx)} if len(parts) > 0 else {} for idx, parts in enumerate(self._parts)]
+
+
+class LiteLLMStream:
+    """A streamed response of LiteLLMBackend. Iterating over it yields the content deltas of the choices
+    ({"index": ..., "content": ...}) as they arrive, and the accumulated messages are available at any time.
+
+    :param chunks: The chunks of the streamed response
+    :type chunks: Iterator[Any]
+    :param n_chat_completion_choices: The number of chat completion choices
+    :type n_chat_completion_choices: int
+    :param on_done: Called with the final messages once the stream is exhausted
+    :type on_done: Callable[[List[Dict[str, Any]]], None], optional
+    """
+
+    def __init__(
+        self,
+        chunks: Iterator[Any],
+        n_chat_completion_choices: int = 1,
+        on_done: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ):
+        self._chunks = chunks if hasattr(chunks, "__aiter__") else iter(chunks)
+        self.accumulator = StreamAccumulator(n_chat_completion_choices)
+        self._on_done = on_done
+        self.done = False
+
+    def _finish(self):
+        self.done = True
+        if self._on_done is not None:
+            self._on_done(self.accumulator.get_messages())
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.done:
+            return
+        for chunk in self._chunks:
+            yield from self.accumulator.add_chunk(chunk)
+        self._finish()
+
+    def get_messages(self) -> List[Dict[str, Any]]:
+        """Consumes the rest of the stream and returns the final messages (one per choice).
+
+        :return: The messages
+        :rtype: List[Dict[str, Any]]
+        """
+        for _ in self:
+            pass
+        return self.accumulator.get_messages()
+
+
+class AsyncLiteLLMStream(LiteLLMStream):
+    """The async version of LiteLLMStream (iterated with async for).
+
+    :param chunks: The chunks of the streamed response
+    :type chunks: AsyncIterator[Any]
+    :param n_chat_completion_choices: The number of chat completion choices
+    :type n_chat_completion_choices: int
+    :param on_done: Called with the final messages once the stream is exhausted
+    :type on_done: Callable[[List[Dict[str, Any]]], None], optional
+    """
+
+    def __iter__(self):
+        raise TypeError("AsyncLiteLLMStream must be iterated with async for")
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        if self.done:
+            return
+        async for chunk in self._chunks:
+            for delta in self.accumulator.add_chunk(chunk):
+                yield delta
+        self._finish()
+
+    async def get_messages(self) -> List[Dict[str, Any]]:
+        """Consumes the rest of the stream and returns the final messages (one per choice).
+
+        :return: The messages
+        :rtype: List[Dict[str, Any]]
+        """
+        async for _ in self:
+            pass
+        return self.accumulator.get_messages()
+
+    async def aclose(self):
+        """Closes the stream without consuming the rest of it (releasing the resources held by the request)."""
+        aclose = getattr(self._chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class _PermitHoldingChunks:
+    """Iterates over the chunks of a streamed response while holding a permit of a semaphore (e.g. the one bounding the
+    concurrent requests of a backend), released once the stream is exhausted, fails, is closed or is garbage collected.
+
+    :param chunks: The chunks of the streamed response
+    :type chunks: AsyncIterator[Any]
+    :param semaphore: The semaphore whose permit is held
+    :type semaphore: asyncio.Semaphore
+    """
+
+    def __init__(self, chunks: AsyncIterator[Any], semaphore: asyncio.Semaphore):
+        self._chunks = chunks.__aiter__()
+        self._semaphore = semaphore
+
+    def _release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+            self._semaphore = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._chunks.__anext__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def aclose(self):
+        self._release()
+        aclose = getattr(self._chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    def __del__(self):
+        self._release()
@@ -4,7 +4,9 @@
 import os
 import sys
 import copy
+import threading
 from abc import ABC
+from dataclasses import dataclass
 from typing import List, Dict, Any, Union, Optional
 
 from omegaconf import OmegaConf
@@ -21,17 +23,44 @@ from aiflows.utils.general_helpers import (
     nested_keys_search,
     process_config_leafs,
     quick_load,
+    copy_config_tree,
+    freeze_config_tree,
+    apply_config_overrides,
 )
 from aiflows.utils.rich_utils import print_config_tree
-from aiflows.flow_cache import FlowCache, CachingKey, CachingValue, CACHING_PARAMETERS
+from aiflows.base_flows.flow_state import FlowState
+from aiflows.history import FlowHistory, get_message_sinks, any_message_sink_enabled
+from aiflows.flow_cache import FlowCache, CachingKey, CachingValue, CACHING_PARAMETERS, canonical_hash
 from aiflows.utils.general_helpers import try_except_decorator
-from aiflows.utils.coflows_utils import push_to_flow, FlowFuture, dispatch_response
+from aiflows.utils.coflows_utils import push_to_flow, FlowFuture, dispatch_response, dispatch_partial_response
+from aiflows.backends.metrics import flow_name_context
 import colink as CL
 import hydra
 
 log = logging.get_logger(__name__)
 
 
+@dataclass
+class CONFIG_PARAMETERS:
+    """This class contains the global parameters of the default configs of the flow classes.
+
+    :param reload_default_configs: Whether the yaml files of the default config of a flow class are checked on every
+        call to get_config, so that the config is rebuilt when one of them changes (useful while editing them, the
+        default configs are otherwise built once per process). It can be set with the environment variable
+        AIFLOWS_RELOAD_CONFIGS
+    :type reload_default_configs: bool
+    """
+
+    reload_default_configs: bool = False
+
+
+CONFIG_PARAMETERS.reload_default_configs = os.getenv("AIFLOWS_RELOAD_CONFIGS", "false").lower() == "true"
+
+# Process-wide cache of the merged default config of each flow class: cls -> (signature of the yaml files, config)
+_default_config_cache: Dict[type, Any] = {}
+_default_config_cache_lock = threading.RLock()
+
+
 class Flow(ABC):
     """
     Abstract class inherited by all Flows.
@@ -46,7 +75,6 @@ class Flow(ABC):
     SUPPORTS_CACHING = False
 
     flow_config: Dict[str, Any]
-    flow_state: Dict[str, Any]
     cl: CL.CoLink
     local_proxy_invocations: Dict[str, Any] = {}
 
@@ -70,6 +98,7 @@ class Flow(ABC):
         "keys_to_ignore_for_hash_input_data": [],
         "clear_flow_namespace_on_run_end": True,  # whether to clear the flow namespace after each run
         "enable_cache": False,  # whether to enable cache for this flow
+        "max_history_messages": 0,  # size of the in-memory buffer of the flow's recent messages (0 disables it, None for unbounded)
     }
 
     def __init__(
@@ -81,7 +110,9 @@ class Flow(ABC):
         __init__ should not be called directly be a user. Instead, use the classmethod `instantiate_from_config` or `instantiate_from_default_config`
         """
         self.flow_config = flow_config
-        self.cache = FlowCache()
+        self.cache = None
+        self._config_hash = None
+        self._cache_recording = None
 
         self.cl = cl
 
@@ -90,6 +121,7 @@ class Flow(ABC):
         self._validate_flow_config(flow_config)
 
         self.set_up_flow_state()
+        self._set_up_history()
 
         if log.getEffectiveLevel() == logging.DEBUG:
             log.debug(
@@ -144,6 +176,10 @@ class Flow(ABC):
         """
         Returns the default config for the flow, with the overrides applied.
         The default implementation construct the default config by recursively merging the configs of the base classes.
+        The merged default config is computed once per class and cached (see `_get_cached_default_config`), so only the
+        overrides are applied on each call: the dictionaries on the paths of the overrides are copies, the rest of the
+        config is shared with the cache and can't be modified in place (see `copy_config_tree` to get a modifiable
+        copy, `instantiate_from_config` copies the config it is given).
 
         :param overrides: The parameters to override in the default config
         :type overrides: Dict[str, Any], optional
@@ -157,14 +193,81 @@ class Flow(ABC):
         elif cls == object:
             return {}
 
-        # ~~~ Recursively retrieve and merge the configs of the base classes to construct the default config ~~~
-        super_cls = cls.__base__
-        parent_default_config = super_cls.get_config()
+        # ~~~~ Apply the overrides ~~~~
+        config = apply_config_overrides(cls._get_cached_default_config(), overrides)
+
+        # return cls.config_class(**overrides)
+        return config
+
+    @classmethod
+    def _get_default_config_path(cls):
+        """Returns the path to the yaml file holding the default config of the class (it might not exist).
 
+        :return: The path to the default config yaml file
+        :rtype: str
+        """
         path_to_flow_directory = os.path.dirname(sys.modules[cls.__module__].__file__)
-        class_name = cls.__name__
+        return os.path.join(path_to_flow_directory, f"{cls.__name__}.yaml")
+
+    @classmethod
+    def _get_default_config_signature(cls):
+        """Returns a signature of the yaml files the default config of the class is built from.
+        The signature contains the path, modification time and size of the yaml file of every class in the hierarchy,
+        so that it changes whenever one of these files is created, edited or deleted.
+
+        :return: The signature of the default config
+        :rtype: Tuple
+        """
+        signature = []
+        klass = cls
+        while klass not in (Flow, ABC, object) and klass is not None:
+            path_to_config = klass._get_default_config_path()
+            try:
+                stat = os.stat(path_to_config)
+                signature.append((path_to_config, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path_to_config, None, None))
+            klass = klass.__base__
+        return tuple(signature)
+
+    @classmethod
+    def _get_cached_default_config(cls):
+        """Returns the default config of the class (without overrides) from the process-wide cache.
+        If CONFIG_PARAMETERS.reload_default_configs is set, the cache entry is rebuilt when the signature of the yaml
+        files of the class hierarchy changes. The returned config is shared and frozen (see `freeze_config_tree`).
 
-        path_to_config = os.path.join(path_to_flow_directory, f"{class_name}.yaml")
+        :return: The cached default config
+        :rtype: Dict[str, Any]
+        """
+        cached = _default_config_cache.get(cls, None)
+        if cached is not None and not CONFIG_PARAMETERS.reload_default_configs:
+            return cached[1]
+
+        signature = cls._get_default_config_signature()
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with _default_config_cache_lock:
+            cached = _default_config_cache.get(cls, None)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+
+            config = freeze_config_tree(cls._build_default_config())
+            _default_config_cache[cls] = (signature, config)
+            return config
+
+    @classmethod
+    def _build_default_config(cls):
+        """Builds the default config of the class by recursively merging the configs of the base classes.
+
+        :return: The default config of the class
+        :rtype: Dict[str, Any]
+        """
+        # ~~~ Recursively retrieve and merge the configs of the base classes to construct the default config ~~~
+        super_cls = cls.__base__
+        parent_default_config = copy_config_tree(super_cls.get_config())
+
+        path_to_config = cls._get_default_config_path()
         if os.path.exists(path_to_config):
             default_config = OmegaConf.to_container(
                 OmegaConf.load(path_to_config), resolve=True
@@ -191,12 +294,15 @@ class Flow(ABC):
         else:
             config = parent_default_config
             log.debug(f"Flow config not found at {path_to_config}.")
-        # ~~~~ Apply the overrides ~~~~
-        config = recursive_dictionary_update(config, overrides)
 
-        # return cls.config_class(**overrides)
         return config
 
+    @staticmethod
+    def clear_default_config_cache():
+        """Clears the process-wide cache of default configs."""
+        with _default_config_cache_lock:
+            _default_config_cache.clear()
+
     @classmethod
     def instantiate_from_config(cls, config):
         """Instantiates the flow from the given config.
@@ -223,10 +329,31 @@ class Flow(ABC):
         config = cls.get_config(**overrides)
         return cls.instantiate_from_config(config)
 
+    @property
+    def flow_state(self) -> FlowState:
+        """The state of the flow. Assigning a dictionary replaces the whole state (all its keys count as changed).
+
+        :return: The flow state
+        :rtype: FlowState
+        """
+        return self._flow_state
+
+    @flow_state.setter
+    def flow_state(self, flow_state: Dict[str, Any]):
+        self._flow_state = FlowState.replace(getattr(self, "_flow_state", None), flow_state)
+
     def set_up_flow_state(self):
         """Sets up the flow state. This method is called when the flow is instantiated, and when the flow is reset."""
         self.flow_state = {}
 
+    def _set_up_history(self):
+        """Sets up the in-memory buffer of the flow's recent messages (if enabled by max_history_messages in the flow config)."""
+        max_history_messages = self.flow_config.get("max_history_messages", 0)
+        if max_history_messages == 0:
+            self.history = None
+        else:
+            self.history = FlowHistory(max_messages=max_history_messages)
+
     def get_flow_state(self):
         """Returns the flow state.
 
@@ -258,14 +385,15 @@ class Flow(ABC):
                 flow.reset(full_reset=full_reset, recursive=True)
 
         if full_reset:
-            message = UpdateMessage_FullReset(
-                created_by=src_flow,
-                updated_flow=self.flow_config["name"],
-                keys_deleted_from_namespace=[],
-            )
-            self._log_message(message)
+            if self._is_message_logging_enabled():
+                message = UpdateMessage_FullReset(
+                    created_by=src_flow,
+                    updated_flow=self.flow_config["name"],
+                    keys_deleted_from_namespace=[],
+                )
+                self._log_message(message)
             self.set_up_flow_state()  # resets the flow state
-        else:
+        elif self._is_message_logging_enabled():
             message = UpdateMessage_NamespaceReset(
                 created_by=src_flow,
                 updated_flow=self.flow_config["name"],
@@ -304,13 +432,14 @@ class Flow(ABC):
         updates = {}
         for key, value in update_data.items():
             if key in self.flow_state:
-                if value is None or value == self.flow_state[key]:
+                if value is None or value == self.flow_state.peek(key):
                     continue
 
+            # the state stores a copy of the value, so the caller can keep modifying its own
             updates[key] = value
-            self.flow_state[key] = copy.deepcopy(value)
+            self.flow_state[key] = value
 
-        if len(updates) != 0:
+        if len(updates) != 0 and self._is_message_logging_enabled():
             state_update_message = UpdateMessage_Generic(
                 created_by=self.flow_config["name"],
                 updated_flow=self.flow_config["name"],
@@ -319,15 +448,23 @@ class Flow(ABC):
             return self._log_message(state_update_message)
 
     def __getstate__(self):
-        """Used by the caching mechanism such that the flow can be returned to the same state using the cache"""
-        flow_config = copy.deepcopy(self.flow_config)
-        flow_state = copy.deepcopy(self.flow_state)
-
+        """Used by the caching mechanism such that the flow can be returned to the same state using the cache.
+        The returned config is a copy, and the returned state a snapshot (see FlowState.snapshot): both are independent
+        of later changes of the flow, and must not be modified.
+        """
         return {
-            "flow_config": flow_config,
-            "flow_state": flow_state,
+            "flow_config": copy_config_tree(self.flow_config),
+            "flow_state": self.flow_state.snapshot(),
         }
 
+    def checkpoint_flow_state(self):
+        """Returns the changes of the flow state since the last checkpoint, and starts tracking changes anew.
+
+        :return: The changed keys with their values, and the deleted keys
+        :rtype: Tuple[Dict[str, Any], Set[str]]
+        """
+        return self.flow_state.checkpoint()
+
     def __setstate__(self, state, safe_mode=False):
         """Used by the caching mechanism to skip computation that has already been done and stored in the cache"""
 
@@ -342,11 +479,12 @@ class Flow(ABC):
 
         else:
             self.set_up_flow_state()
-            self.flow_state = {**self.flow_state, **state["flow_state"]}
+            self.flow_state = {**self.flow_state.snapshot(), **state["flow_state"]}
 
     def __setflowconfig__(self, state):
         """Used by the caching mechanism to skip computation that has already been done and stored in the cache"""
         self.flow_config = state["flow_config"]
+        self._config_hash = None
 
         # hacky for the moment, but possibly overwrite enamble cache para
         if (
@@ -367,7 +505,7 @@ class Flow(ABC):
         }
         state_hashing_params = {
             k: v
-            for k, v in self.flow_state.items()
+            for k, v in self.flow_state.snapshot().items()
             if k not in self.flow_config["keys_to_ignore_for_hash_flow_state"]
         }
         hash_dict = {
@@ -383,15 +521,36 @@ class Flow(ABC):
             "output": self.flow_config.get("output_interface", None),
         }
 
+    def _is_message_logging_enabled(self):
+        """Returns whether logged messages are kept or emitted anywhere (history or an enabled message sink).
+        Used to skip creating messages that would only be logged.
+
+        :return: True if messages logged by the flow are used
+        :rtype: bool
+        """
+        return (
+            self.history is not None
+            or self._cache_recording is not None
+            or any_message_sink_enabled()
+        )
+
     def _log_message(self, message: Message):
-        """Logs the given message to the history of the flow.
+        """Logs the given message to the history of the flow and to the enabled message sinks.
+        Sinks are checked before the message is formatted, so disabled sinks cost close to nothing.
 
         :param message: The message to log
         :type message: Message
         """
-        log.debug(message.to_string())
-        # TODO: Think about how we want to log messages
-        pass
+        if self.history is not None:
+            self.history.add_message(message)
+
+        if self._cache_recording is not None and not getattr(message, "is_reply", False):
+            # replies are recorded separately (and replayed through send_message)
+            self._cache_recording["history_messages"].append(message)
+
+        for sink in get_message_sinks():
+            if sink.is_enabled():
+                sink.emit(self.flow_config["name"], message)
 
     def _fetch_state_attributes_by_keys(self, keys: Union[List[str], None]):
         """Returns the values of the given keys in the flow state.
@@ -503,13 +662,41 @@ class Flow(ABC):
         """
         raise NotImplementedError
 
-    def __get_from_cache(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Gets the response from the cache if it exists. If it does not exist, runs the flow and caches the response.
+    def _get_cache(self) -> FlowCache:
+        """Returns the cache of the flow (opened on first use).
 
-        :param input_data: The input data to run the flow on
-        :type input_data: Dict[str, Any]
-        :return: The response of the flow
-        :rtype: Dict[str, Any]
+        :return: The cache of the flow
+        :rtype: FlowCache
+        """
+        if self.cache is None:
+            self.cache = FlowCache()
+        return self.cache
+
+    def get_config_hash(self) -> bytes:
+        """Returns the digest of the flow config used for the cache keys (ignoring keys_to_ignore_for_hash_flow_config).
+        It is computed once per flow instance (and recomputed when the config is replaced with __setflowconfig__).
+
+        :return: The digest of the flow config
+        :rtype: bytes
+        """
+        if self._config_hash is None:
+            keys_to_ignore_for_hash = self.flow_config["keys_to_ignore_for_hash_flow_config"]
+            config_hashing_params = {
+                k: v for k, v in self.flow_config.items() if k not in keys_to_ignore_for_hash
+            }
+            self._config_hash = canonical_hash(config_hashing_params)
+        return self._config_hash
+
+    def __get_from_cache(self, input_message: FlowMessage):
+        """Replays the replies of the flow from the cache if they exist. If they do not exist, runs the flow and caches
+        the replies it sends, its final state and the messages it logged. Runs that send other messages than replies
+        (send_message to another flow, get_reply, get_reply_future) are not cached: their effects on other flows can't
+        be replayed.
+        A cache hit restores the state of the flow but not its config: the config holds the identity of the instance
+        (e.g. its flow_id), and the rest of it is part of the cache key, so it is the same as in the cached run.
+
+        :param input_message: The input message to run the flow on
+        :type input_message: FlowMessage
         """
         assert self.flow_config["enable_cache"] and CACHING_PARAMETERS.do_caching
 
@@ -521,70 +708,92 @@ class Flow(ABC):
         # ~~~ get the hash string ~~~
         keys_to_ignore_for_hash = self.flow_config["keys_to_ignore_for_hash_input_data"]
         input_data_to_hash = {
-            k: v for k, v in input_data.items() if k not in keys_to_ignore_for_hash
+            k: v for k, v in input_message.data.items() if k not in keys_to_ignore_for_hash
         }
         cache_key_hash = CachingKey(
             self, input_data_to_hash, keys_to_ignore_for_hash
         ).hash_string()
         # ~~~ get from cache ~~~
-        response = None
-        cached_value: CachingValue = self.cache.get(cache_key_hash)
-        if cached_value is not None:
-            # Retrieve output from cache
-            response = cached_value.output_results
-
-            # Restore the flow to the state it was in when the output was created
-            self.__setstate__(cached_value.full_state)
-
-            # Restore the history messages
-            for message in cached_value.history_messages_created:
-                message._reset_message_id()
-                self._log_message(message)
+        cache = self._get_cache()
+        cached_value: CachingValue = cache.get(cache_key_hash)
+        if cached_value is None:
+            # Only one caller computes a given key at a time, the others wait for it and replay its result
+            with cache.single_flight(cache_key_hash):
+                cached_value = cache.get(cache_key_hash)
+                if cached_value is None:
+                    self.__run_and_cache(input_message, cache, cache_key_hash)
+                    return
+
+        # Restore the flow to the state it was in when the replies were created
+        self.__setflowstate__(cached_value.full_state)
+
+        # Restore the history messages
+        for message in cached_value.history_messages_created:
+            message._reset_message_id()
+            self._log_message(message)
 
-            log.debug(
-                f"Retrieved from cache: {self.__class__.__name__} "
-                f"-- (input_data.keys()={list(input_data_to_hash.keys())}, "
-                f"keys_to_ignore_for_hash={keys_to_ignore_for_hash})"
-            )
-            log.debug(f"Retrieved from cache: {str(cached_value)}")
+        log.debug(
+            f"Retrieved from cache: {self.__class__.__name__} "
+            f"-- (input_data.keys()={list(input_data_to_hash.keys())}, "
+            f"keys_to_ignore_for_hash={keys_to_ignore_for_hash})"
+        )
 
-        else:
-            # Call the original function
-            history_len_pre_execution = len(self.history)
+        # Replay the replies
+        for reply_data in cached_value.output_results:
+            self.send_message(self.package_output_message(input_message, reply_data))
 
-            # Execute the call
-            response = self.run(input_data)
+    def __run_and_cache(self, input_message: FlowMessage, cache: FlowCache, cache_key_hash: str):
+        """Runs the flow, recording the messages it logs and the replies it sends, and caches them with its final state
+        (unless the flow sent other messages than replies).
 
-            # Retrieve the messages created during the execution
-            num_created_messages = len(self.history) - history_len_pre_execution
-            new_history_messages = self.history.get_last_n_messages(
-                num_created_messages
+        :param input_message: The input message to run the flow on
+        :type input_message: FlowMessage
+        :param cache: The cache of the flow
+        :type cache: FlowCache
+        :param cache_key_hash: The cache key of the call
+        :type cache_key_hash: str
+        """
+        self._cache_recording = {"history_messages": [], "replies": [], "num_requests_sent": 0}
+        try:
+            self.run(input_message)
+            recording = self._cache_recording
+        finally:
+            self._cache_recording = None
+
+        if recording["num_requests_sent"] > 0:
+            log.debug(
+                f"Not caching the run of {self.flow_config['name']}: it sent {recording['num_requests_sent']} messages "
+                "to other flows"
             )
+            return
 
-            value_to_cache = CachingValue(
-                output_results=response,
-                full_state=self.__getstate__(),
-                history_messages_created=new_history_messages,
-            )
+        value_to_cache = CachingValue(
+            output_results=recording["replies"],
+            # only the state is restored from the cache (see __get_from_cache)
+            full_state={"flow_state": self.flow_state.snapshot()},
+            history_messages_created=recording["history_messages"],
+        )
 
-            self.cache.set(cache_key_hash, value_to_cache)
-            log.debug(f"Cached key: f{cache_key_hash}")
+        cache.set(cache_key_hash, value_to_cache)
+        log.debug(f"Cached key: {cache_key_hash}")
 
-        return response
+    def _record_request_sent(self):
+        """Records that the flow sent a message to another flow (other than a reply) while its run is being cached."""
+        if self._cache_recording is not None:
+            self._cache_recording["num_requests_sent"] += 1
 
-    def _run_method(self, input_message: Dict[str, Any]) -> Dict[str, Any]:
-        """Runs the flow in local mode.
+    def _run_method(self, input_message: FlowMessage):
+        """Runs the flow in local mode (through the cache if caching is enabled).
 
         :param input_message: The input message to run the flow on
         :type input_meassage: FlowMessage
         """
-        # TODO: REMAKE THIS WORK AGAIN (LATER)
-        # if self.flow_config["enable_cache"] and CACHING_PARAMETERS.do_caching:
-        #     log.debug("call from cache")
-        #     response = self.__get_from_cache(input_message.data)
+        if self.flow_config["enable_cache"] and CACHING_PARAMETERS.do_caching:
+            log.debug("call from cache")
+            self.__get_from_cache(input_message)
 
-        # else:
-        self.run(input_message)
+        else:
+            self.run(input_message)
 
     @try_except_decorator
     def __call__(self, input_message: FlowMessage):
@@ -598,8 +807,9 @@ class Flow(ABC):
         self._log_message(input_message)
 
         # ~~~ Execute the logic of the flow ~~~
-
-        self._run_method(input_message)
+        # the LLM calls made by the flow are attributed to it in the call metrics
+        with flow_name_context(self.name):
+            self._run_method(input_message)
 
         self._post_call_hook()
 
@@ -627,16 +837,35 @@ class Flow(ABC):
 
         self._log_message(message)
 
+        if message.is_reply and self._cache_recording is not None:
+            self._cache_recording["replies"].append(message.data)
+
         if message.is_reply:
             dispatch_response(self.cl, message, message.reply_data)
 
         else:
+            self._record_request_sent()
             push_to_flow(
                 self.cl, self.flow_config["user_id"], self.get_instance_id(), message
             )
 
         self._post_call_hook()
 
+    def send_partial_message(self, input_message: FlowMessage, partial_data: Dict[str, Any]):
+        """Sends a partial reply to input_message, e.g. the output generated so far by a flow streaming from its backend.
+        Partial replies are not logged nor cached, and they are only delivered to callers waiting on a future (see
+        FlowFuture.iter_partial_data). The flow must still send its (full) reply with send_message.
+
+        :param input_message: The input message being replied to
+        :type input_message: FlowMessage
+        :param partial_data: The output so far (each partial reply replaces the previous one)
+        :type partial_data: Dict[str, Any]
+        """
+        if self.cl is None:
+            return
+        partial_message = self.package_output_message(input_message, partial_data)
+        dispatch_partial_response(self.cl, partial_message, partial_message.reply_data)
+
     @try_except_decorator
     def get_reply(self, message):
         """Sends the given message to a flow (specified in message.reply_data)
@@ -647,6 +876,7 @@ class Flow(ABC):
         """
 
         self._log_message(message)
+        self._record_request_sent()
 
         reply_data = {
             "mode": "push",
@@ -682,6 +912,7 @@ class Flow(ABC):
         :rtype: FlowFuture
         """
         self._log_message(input_message)
+        self._record_request_sent()
 
         reply_data = {
             "mode": "storage",
@@ -0,0 +1,219 @@
+import copy
+from typing import Any, Dict, Optional, Set, Tuple
+
+# values of these types cannot be modified in place, so handing them out can't change the state
+_IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+
+def _is_immutable(value: Any) -> bool:
+    t = type(value)
+    if t in _IMMUTABLE_TYPES:
+        return True
+    if t is tuple or t is frozenset:
+        return all(_is_immutable(v) for v in value)
+    return False
+
+
+def _copy_value(value: Any) -> Any:
+    return value if _is_immutable(value) else copy.deepcopy(value)
+
+
+class FlowState(dict):
+    """The state of a flow. It is a regular dictionary that records which keys changed since the last checkpoint.
+
+    The state owns its values: mutable values are copied when they are written, so the caller's objects are never
+    aliased. Snapshots and checkpoints share the values with the state (their cost depends on the number of keys, not on
+    the size of the values), and a value shared with a snapshot is copied before it is handed out through a mutable
+    path (copy-on-write), so snapshots never change afterwards. Snapshots must not be modified.
+    A key counts as changed when it is set or deleted, and also when a mutable value is read from the state (as the
+    reader could modify it in place; the value is "lent" to the reader). At a checkpoint, the lent values are replaced
+    by copies, so modifying them through references kept from before the checkpoint doesn't change the state (read them
+    again instead). Read-only copies (e.g. to hash or serialize the state) should be made with snapshot, which doesn't
+    mark any key.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._changed_keys: Set[str] = set()
+        self._deleted_keys: Set[str] = set()
+        # the keys whose value was handed out through a mutable path since the last checkpoint
+        self._lent_keys: Set[str] = set()
+        # the keys whose value is also referenced by a snapshot or a checkpoint (copied before it is lent)
+        self._shared_keys: Set[str] = set()
+        for key, value in dict(*args, **kwargs).items():
+            dict.__setitem__(self, key, _copy_value(value))
+
+    @classmethod
+    def replace(cls, previous: Optional["FlowState"], data: Dict[str, Any]) -> "FlowState":
+        """Returns the state replacing the previous one with the content of data.
+        All the keys of the new state count as changed and the keys missing from it count as deleted.
+
+        :param previous: The state being replaced (if any)
+        :type previous: Optional[FlowState]
+        :param data: The content of the new state
+        :type data: Dict[str, Any]
+        :return: The new state
+        :rtype: FlowState
+        """
+        state = cls(dict.items(data) if isinstance(data, dict) else data)
+        state._changed_keys = set(dict.keys(state))
+        if previous is not None:
+            state._deleted_keys = (previous._deleted_keys | set(dict.keys(previous))) - state._changed_keys
+        return state
+
+    def _lend(self, key, value):
+        if key in self._lent_keys or _is_immutable(value):
+            return value
+        if key in self._shared_keys:
+            # copy-on-write: the snapshots sharing the value keep the original
+            value = copy.deepcopy(value)
+            super().__setitem__(key, value)
+            self._shared_keys.discard(key)
+        self._lent_keys.add(key)
+        self._changed_keys.add(key)
+        return value
+
+    # ~~~ Reads (mutable values handed out count as changed) ~~~
+    def __getitem__(self, key):
+        return self._lend(key, super().__getitem__(key))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def peek(self, key, default=None):
+        """Returns the value of key without marking it as changed. The value must not be modified.
+
+        :param key: The key to read
+        :type key: str
+        :param default: The value returned if the key is not in the state
+        :type default: Any
+        :return: The value of key
+        :rtype: Any
+        """
+        return super().get(key, default)
+
+    def __iter__(self):
+        # overriding __iter__ makes dict(state) and {**state} go through __getitem__, so that copies are tracked too
+        return super().__iter__()
+
+    def values(self):
+        return [self[key] for key in dict.keys(self)]
+
+    def items(self):
+        return [(key, self[key]) for key in dict.keys(self)]
+
+    # ~~~ Writes ~~~
+    def _forget(self, key):
+        self._lent_keys.discard(key)
+        self._shared_keys.discard(key)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, _copy_value(value))
+        self._forget(key)
+        self._changed_keys.add(key)
+        self._deleted_keys.discard(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._forget(key)
+        self._changed_keys.discard(key)
+        self._deleted_keys.add(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        if key in self:
+            value = super().pop(key)
+            self._forget(key)
+            self._changed_keys.discard(key)
+            self._deleted_keys.add(key)
+            return value
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._forget(key)
+        self._changed_keys.discard(key)
+        self._deleted_keys.add(key)
+        return key, value
+
+    def clear(self):
+        self._deleted_keys.update(dict.keys(self))
+        self._changed_keys.clear()
+        self._lent_keys.clear()
+        self._shared_keys.clear()
+        super().clear()
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    # ~~~ Change tracking ~~~
+    def changed_keys(self) -> Set[str]:
+        """Returns the keys that were set (or possibly modified) since the last checkpoint."""
+        return set(self._changed_keys)
+
+    def deleted_keys(self) -> Set[str]:
+        """Returns the keys that were deleted since the last checkpoint."""
+        return set(self._deleted_keys)
+
+    def has_changes(self) -> bool:
+        """Returns whether the state changed since the last checkpoint."""
+        return len(self._changed_keys) > 0 or len(self._deleted_keys) > 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns a copy of the state as a plain dictionary, without affecting the change tracking. The snapshot shares
+        the values of the state that weren't lent (they are copied by the state before being handed out) and copies the
+        lent ones, so it is independent of later modifications of the state. It must not be modified.
+
+        :return: The snapshot of the state
+        :rtype: Dict[str, Any]
+        """
+        snapshot = {}
+        for key, value in dict.items(self):
+            if key in self._lent_keys:
+                value = copy.deepcopy(value)
+            elif not _is_immutable(value):
+                self._shared_keys.add(key)
+            snapshot[key] = value
+        return snapshot
+
+    def checkpoint(self) -> Tuple[Dict[str, Any], Set[str]]:
+        """Returns the changes since the last checkpoint and starts tracking changes anew. The lent values are replaced
+        by copies (shared with the returned changes), so references to them kept by readers no longer alias the state.
+
+        :return: The changed keys with their values, and the deleted keys
+        :rtype: Tuple[Dict[str, Any], Set[str]]
+        """
+        for key in self._lent_keys:
+            super().__setitem__(key, copy.deepcopy(dict.__getitem__(self, key)))
+        self._lent_keys = set()
+
+        changes = {}
+        for key in self._changed_keys:
+            if dict.__contains__(self, key):
+                value = changes[key] = dict.__getitem__(self, key)
+                if not _is_immutable(value):
+                    self._shared_keys.add(key)
+        deleted_keys = self._deleted_keys
+        self._changed_keys = set()
+        self._deleted_keys = set()
+        return changes, deleted_keys
+
+    def mark_clean(self):
+        """Marks the state as having no changes (e.g. after it was loaded from storage)."""
+        self._changed_keys = set()
+        self._deleted_keys = set()
+
+    def __reduce_ex__(self, protocol):
+        # (de)serialized and copied as a plain dictionary: the change tracking is local to a live flow
+        return (FlowState, (self.snapshot(),))
@@ -1 +1,9 @@
-from .flow_cache import FlowCache, CachingKey, CachingValue, CACHING_PARAMETERS, clear_cache
+from .flow_cache import (
+    FlowCache,
+    CachingKey,
+    CachingValue,
+    CACHING_PARAMETERS,
+    clear_cache,
+    canonical_hash,
+    canonical_hash_update,
+)
@@ -1,9 +1,17 @@
 import os
+import time
+import atexit
+import pickle
 import hashlib
+import collections.abc
 import threading
+from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Any
-from diskcache import Index
+from diskcache import Cache
+from diskcache.core import EVICTION_POLICY
+from aiflows.flow_cache.tiers import MemoryCacheTier, WriteBehindQueue
+from aiflows.flow_cache.single_flight import SingleFlight
 from aiflows.utils import logging
 
 log = logging.get_logger(__name__)
@@ -13,8 +21,29 @@ log = logging.get_logger(__name__)
 class CACHING_PARAMETERS:
     """This class contains the global caching parameters.
 
-    :param max_cached_entries: The maximum number of cached entries
+    :param max_cached_entries: The maximum number of cached entries (None for no limit)
     :type max_cached_entries: int, optional
+    :param max_cached_bytes: The maximum total size of the cache directory in bytes
+    :type max_cached_bytes: int, optional
+    :param eviction_policy: The policy used to evict entries when max_cached_entries or max_cached_bytes is exceeded
+        ("least-recently-used", "least-frequently-used" or "least-recently-stored")
+    :type eviction_policy: str, optional
+    :param ttl: The default time to live of the cached entries in seconds (None for no expiration)
+    :type ttl: float, optional
+    :param memory_max_entries: The maximum number of entries of the in-process memory tier
+    :type memory_max_entries: int, optional
+    :param memory_max_bytes: The maximum total size of the in-process memory tier in bytes
+    :type memory_max_bytes: int, optional
+    :param memory_num_shards: The number of shards (each with its own lock) of the in-process memory tier
+    :type memory_num_shards: int, optional
+    :param write_behind: Whether writes to the disk tier are done in a background thread
+    :type write_behind: bool, optional
+    :param single_flight: Whether concurrent misses of the same key (in this process or in other processes using the
+        same cache directory) wait for the first caller to compute the value instead of computing it again
+    :type single_flight: bool, optional
+    :param single_flight_timeout: The maximum time to wait for another caller computing the same key in seconds
+        (None to wait forever), after which the value is computed anyway
+    :type single_flight_timeout: float, optional
     :param do_caching: Whether to do caching
     :type do_caching: bool, optional
     :param cache_dir: The cache directory
@@ -23,6 +52,15 @@ class CACHING_PARAMETERS:
 
     # Global parameters that can be set before starting the outer-flow
     max_cached_entries: int = 10000
+    max_cached_bytes: int = 2**30
+    eviction_policy: str = "least-recently-used"
+    ttl: Optional[float] = None
+    memory_max_entries: int = 1024
+    memory_max_bytes: int = 2**26
+    memory_num_shards: int = 16
+    write_behind: bool = True
+    single_flight: bool = True
+    single_flight_timeout: Optional[float] = 600
     do_caching: bool = True
     cache_dir: str = None
 
@@ -64,7 +102,25 @@ class CachingKey:
     keys_to_ignore_for_hash: List[str]
 
     def hash_string(self) -> str:
-        return _custom_hash(self.flow, self.input_data, self.keys_to_ignore_for_hash)
+        """Returns the hash of the flow config, the flow state and the input data.
+        The config digest is precomputed once per flow instance, the state and the input data are hashed incrementally
+        with a canonical (dictionary order independent) encoding.
+
+        :return: The hash
+        :rtype: str
+        """
+        keys_to_ignore_for_hash_flow_state = self.flow.flow_config["keys_to_ignore_for_hash_flow_state"]
+        state_hashing_params = {
+            k: v
+            for k, v in self.flow.flow_state.snapshot().items()
+            if k not in keys_to_ignore_for_hash_flow_state
+        }
+
+        hasher = hashlib.sha256()
+        hasher.update(self.flow.get_config_hash())
+        canonical_hash_update(hasher, state_hashing_params)
+        canonical_hash_update(hasher, self.input_data)
+        return hasher.hexdigest()
 
 
 def get_cache_dir() -> str:
@@ -81,32 +137,196 @@ def get_cache_dir() -> str:
     return os.path.abspath(os.path.join(current_dir, ".flow_cache"))
 
 
-def _custom_hash(*all_args):
-    """Returns a custom hash for the given arguments.
+class _BytesAccumulator:
+    """Collects the chunks fed to it (with the update method of a hashlib object)."""
 
-    :param \*all_args: The arguments
-    :type \*all_args: Any
-    :return: The custom hash
-    :rtype: str
+    def __init__(self):
+        self.chunks = []
+
+    def update(self, chunk: bytes):
+        self.chunks.append(chunk)
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+def _canonical_bytes(obj: Any) -> bytes:
+    accumulator = _BytesAccumulator()
+    canonical_hash_update(accumulator, obj)
+    return accumulator.getvalue()
+
+
+def canonical_hash_update(hasher, obj: Any):
+    """Feeds a canonical encoding of obj to hasher. The encoding is type-tagged and length-prefixed, and it does not
+    depend on the insertion order of dictionaries (their items are sorted by the encoding of their keys) or sets.
+    Objects with a to_dict method (e.g. messages) are encoded through it, other objects through their repr.
+
+    :param hasher: The hashlib object to update
+    :type hasher: Any
+    :param obj: The object to encode
+    :type obj: Any
+    """
+    if obj is None:
+        hasher.update(b"N")
+    elif obj is True:
+        hasher.update(b"T")
+    elif obj is False:
+        hasher.update(b"F")
+    elif isinstance(obj, str):
+        encoded = obj.encode("utf-8")
+        hasher.update(b"s%d:" % len(encoded))
+        hasher.update(encoded)
+    elif isinstance(obj, (int, float)):
+        hasher.update(b"n%s;" % repr(obj).encode("utf-8"))
+    elif isinstance(obj, (bytes, bytearray)):
+        hasher.update(b"b%d:" % len(obj))
+        hasher.update(obj)
+    elif isinstance(obj, collections.abc.Mapping):
+        hasher.update(b"{%d:" % len(obj))
+        items = sorted(((_canonical_bytes(k), v) for k, v in obj.items()), key=lambda item: item[0])
+        for encoded_key, value in items:
+            hasher.update(encoded_key)
+            canonical_hash_update(hasher, value)
+        hasher.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(b"[%d:" % len(obj))
+        for item in obj:
+            canonical_hash_update(hasher, item)
+        hasher.update(b"]")
+    elif isinstance(obj, (set, frozenset)):
+        hasher.update(b"<%d:" % len(obj))
+        for encoded_item in sorted(_canonical_bytes(item) for item in obj):
+            hasher.update(encoded_item)
+        hasher.update(b">")
+    elif hasattr(obj, "to_dict"):
+        hasher.update(b"o")
+        canonical_hash_update(hasher, obj.to_dict())
+    else:
+        hasher.update(b"r")
+        canonical_hash_update(hasher, repr(obj))
+
+
+def canonical_hash(obj: Any) -> bytes:
+    """Returns the sha256 digest of the canonical encoding of obj (see canonical_hash_update).
+
+    :param obj: The object to hash
+    :type obj: Any
+    :return: The digest
+    :rtype: bytes
     """
-    _repr_args = []
-    for arg in all_args:
-        _repr_args.append(repr(arg))
-    return hashlib.sha256(repr(_repr_args).encode("utf-8")).hexdigest()
+    hasher = hashlib.sha256()
+    canonical_hash_update(hasher, obj)
+    return hasher.digest()
+
+
+def _enforce_max_entries(cache: Cache) -> int:
+    """Evicts entries of the disk cache (expired ones first, then the ones selected by the eviction policy of the cache)
+    until the number of entries is within CACHING_PARAMETERS.max_cached_entries.
+
+    :param cache: The disk cache
+    :type cache: Cache
+    :return: The number of evicted entries
+    :rtype: int
+    """
+    max_cached_entries = CACHING_PARAMETERS.max_cached_entries
+    if max_cached_entries is None or len(cache) <= max_cached_entries:
+        return 0
+
+    num_evicted = cache.expire()
+    # diskcache only applies its eviction policy to the size limit, its queries select the entries to evict by
+    # access time, access count or store time (the latter when the policy is "none")
+    select_policy = EVICTION_POLICY[cache.eviction_policy]["cull"] or EVICTION_POLICY["least-recently-stored"]["cull"]
+    select_keys = select_policy.format(fields="key, raw", now=time.time())
+    while len(cache) > max_cached_entries:
+        rows = cache._sql(select_keys, (len(cache) - max_cached_entries,)).fetchall()
+        if not rows:  # emptied by another process
+            break
+        for db_key, raw in rows:
+            if cache.delete(cache._disk.get(db_key, raw)):
+                num_evicted += 1
+    return num_evicted
+
+
+class _CacheTiers:
+    """The tiers of the cache of one cache directory, shared by all the FlowCache objects of the process."""
+
+    def __init__(self, cache_dir: str):
+        self.disk = Cache(
+            cache_dir,
+            eviction_policy=CACHING_PARAMETERS.eviction_policy,
+            size_limit=CACHING_PARAMETERS.max_cached_bytes,
+        )
+        self.memory = MemoryCacheTier(
+            max_entries=CACHING_PARAMETERS.memory_max_entries,
+            max_bytes=CACHING_PARAMETERS.memory_max_bytes,
+            num_shards=CACHING_PARAMETERS.memory_num_shards,
+        )
+        self.disk_evictions = 0
+        self.single_flight = SingleFlight(os.path.join(cache_dir, "locks"))
+        # serializes the writes (and the evictions following them) when they are not done by the write-behind thread
+        self.write_lock = threading.Lock()
+        self.write_behind = None
+        if CACHING_PARAMETERS.write_behind:
+            self.write_behind = WriteBehindQueue(self.write)
+            # the writer is a daemon thread, pending writes are flushed when the interpreter exits
+            atexit.register(self.flush)
+
+    def write(self, key: str, payload: bytes, ttl: Optional[float]):
+        with self.write_lock:
+            self.disk.set(key, payload, expire=ttl)
+            self.disk_evictions += _enforce_max_entries(self.disk)
+
+    def flush(self):
+        if self.write_behind is not None:
+            self.write_behind.flush()
+
+
+_cache_tiers: Dict[str, _CacheTiers] = {}
+_cache_tiers_lock = threading.Lock()
+
+
+def _reset_cache_tiers_after_fork():
+    # the writer threads (and the locks held by other threads) of the parent don't exist in a forked child
+    global _cache_tiers_lock
+    _cache_tiers.clear()
+    _cache_tiers_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_cache_tiers_after_fork)
+
+
+def _get_cache_tiers(cache_dir: str) -> _CacheTiers:
+    with _cache_tiers_lock:
+        if cache_dir not in _cache_tiers:
+            _cache_tiers[cache_dir] = _CacheTiers(cache_dir)
+        return _cache_tiers[cache_dir]
 
 
 class FlowCache:
-    """This class is the flow cache.
+    """This class is the flow cache. It has two tiers, shared by all the FlowCache objects of the process:
+
+    - an in-process LRU memory tier, sharded by key hash (each shard has its own lock) and bounded by
+      CACHING_PARAMETERS.memory_max_entries entries and CACHING_PARAMETERS.memory_max_bytes bytes;
+    - a disk tier (in the directory returned by get_cache_dir) bounded by CACHING_PARAMETERS.max_cached_entries entries
+      and CACHING_PARAMETERS.max_cached_bytes bytes. When a limit is exceeded, expired entries are evicted first, then
+      entries are evicted according to CACHING_PARAMETERS.eviction_policy (hits served by the memory tier don't count
+      as disk accesses). Writes to the disk are done in a background thread (write-behind) unless
+      CACHING_PARAMETERS.write_behind is False.
 
-    :param index: The index
-    :type index: Index
-    :param \__lock: The lock
-    :type \__lock: threading.Lock
+    Values are stored pickled, so the cached values never share objects with the caller.
     """
 
     def __init__(self):
-        self._index = Index(get_cache_dir())
-        self.__lock = threading.Lock()
+        self._tiers = _get_cache_tiers(get_cache_dir())
+        self._stats_lock = threading.Lock()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
 
     def get(self, key: str) -> Optional[CachingValue]:
         """Returns the cached value for the given key.
@@ -116,19 +336,68 @@ class FlowCache:
         :return: The cached value
         :rtype: Optional[CachingValue]
         """
-        with self.__lock:
-            return self._index.get(key, None)
-
-    def set(self, key: str, value: CachingValue):
+        payload = self._tiers.memory.get(key)
+        if payload is not None:
+            self._count("_memory_hits")
+            return pickle.loads(payload)
+
+        value, expire_time = self._tiers.disk.get(key, None, expire_time=True)
+        if value is None:
+            self._count("_misses")
+            return None
+
+        self._count("_disk_hits")
+        if not isinstance(value, bytes):
+            # entry written by a previous version of the cache (not pickled by us)
+            return value
+        # the promoted entry expires from the memory tier when it expires from the disk tier
+        ttl = None if expire_time is None else expire_time - time.time()
+        if ttl is None or ttl > 0:
+            self._tiers.memory.set(key, value, ttl)
+        return pickle.loads(value)
+
+    def set(self, key: str, value: CachingValue, ttl: Optional[float] = None):
         """Sets the cached value for the given key.
 
         :param key: The key
         :type key: str
         :param value: The cached value
         :type value: CachingValue
+        :param ttl: The time to live of the entry in seconds (defaults to CACHING_PARAMETERS.ttl)
+        :type ttl: float, optional
+        """
+        ttl = CACHING_PARAMETERS.ttl if ttl is None else ttl
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._tiers.memory.set(key, payload, ttl)
+
+        if self._tiers.write_behind is not None:
+            self._tiers.write_behind.put(key, payload, ttl)
+        else:
+            self._tiers.write(key, payload, ttl)
+
+    @contextmanager
+    def single_flight(self, key: str):
+        """Context manager to hold while computing the value of key after a miss, so that concurrent callers missing
+        the same key wait for it. Callers should get the key again once inside the context, as the value may have been
+        computed while they were waiting. The value set inside the context is written to the disk tier before the
+        context exits (so that callers in other processes find it).
+
+        :param key: The key
+        :type key: str
         """
-        with self.__lock:
-            self._index[key] = value
+        if not CACHING_PARAMETERS.single_flight:
+            yield
+            return
+
+        with self._tiers.single_flight.hold(key, CACHING_PARAMETERS.single_flight_timeout) as acquired:
+            if not acquired:
+                log.warning(
+                    f"Timed out waiting for another caller to compute the cache key {key}, computing it again."
+                )
+            try:
+                yield
+            finally:
+                self._tiers.flush()
 
     def pop(self, key: str):
         """Pops the cached value for the given key.
@@ -136,17 +405,52 @@ class FlowCache:
         :param key: The key
         :type key: str
         """
-        with self.__lock:
-            return self._index.pop(key)
+        self._tiers.flush()
+        self._tiers.memory.pop(key)
+        value = self._tiers.disk.pop(key)
+        return pickle.loads(value) if isinstance(value, bytes) else value
+
+    def flush(self):
+        """Blocks until all the pending writes are written to the disk tier."""
+        self._tiers.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the statistics of the cache: hits (per tier) and misses of this cache object, and the entries,
+        bytes and evictions of the shared memory and disk tiers. The disk evictions are the entries this process removed
+        to stay within CACHING_PARAMETERS.max_cached_entries (expired entries included); the entries diskcache culls
+        itself to stay within CACHING_PARAMETERS.max_cached_bytes are not counted.
+
+        :return: The statistics of the cache
+        :rtype: Dict[str, int]
+        """
+        memory_stats = self._tiers.memory.stats()
+        with self._stats_lock:
+            return {
+                "hits": self._memory_hits + self._disk_hits,
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._tiers.disk_evictions,
+                "entries": len(self._tiers.disk),
+                "bytes": self._tiers.disk.volume(),
+                "memory_entries": memory_stats["entries"],
+                "memory_bytes": memory_stats["bytes"],
+                "memory_evictions": memory_stats["evictions"],
+            }
 
     def __len__(self):
         """Returns the number of cached entries."""
-        with self.__lock:
-            return len(self._index)
+        self._tiers.flush()
+        return len(self._tiers.disk)
 
 
 def clear_cache():
     """Clears the cache."""
     cache_dir = get_cache_dir()
-    cache = Index(cache_dir)
+    with _cache_tiers_lock:
+        tiers = _cache_tiers.get(cache_dir, None)
+    if tiers is not None:
+        tiers.flush()
+        tiers.memory.clear()
+    cache = Cache(cache_dir)
     cache.clear()
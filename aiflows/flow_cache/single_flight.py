@@ -0,0 +1,151 @@
+import os
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+class _KeyLock:
+    """The lock of one key: an in-process lock, with the number of threads using it (it is dropped when nobody does),
+    and the lock file of the key, held by the thread holding the in-process lock (the lock is reentrant, the file is
+    locked at the outermost hold).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = 0
+        self.fd: Optional[int] = None
+        self.depth = 0
+
+
+def _lock_file(path: str, deadline: Optional[float]) -> Optional[int]:
+    """Locks the lock file at path (creating it if needed) and returns its file descriptor, or None if the deadline
+    expired. Lock files are deleted by their holder on release, so a file locked after it was deleted (the inode no
+    longer at path) is opened again.
+    """
+    delay = 0.01
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if _expired(deadline):
+                        os.close(fd)
+                        return None
+                    time.sleep(min(delay, _remaining(deadline) or delay))
+                    delay = min(delay * 2, 0.5)
+
+            try:
+                is_current = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                is_current = False
+            if is_current:
+                return fd
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+
+
+def _unlock_file(path: str, fd: int):
+    # the file is deleted before it is unlocked, so the processes waiting for it open it again (see _lock_file)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def _expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class SingleFlight:
+    """Makes sure that only one caller at a time computes the value of a key, so that concurrent callers missing the
+    cache for the same key wait for the first one (and then find its result in the cache) instead of computing it again.
+
+    Within a process, every key has its own lock. Across processes, every key has its own lock file in lock_dir (named
+    after the hash of the key and deleted when the lock is released), locked with flock (lock files are released by the
+    OS if a process dies). Keys never share a lock, so callers holding the locks of different keys can't deadlock. Without
+    flock (on Windows) only the callers of the same process are deduplicated.
+
+    :param lock_dir: The directory of the lock files
+    :type lock_dir: str
+    """
+
+    def __init__(self, lock_dir: str):
+        self.lock_dir = lock_dir
+        self._key_locks: Dict[str, _KeyLock] = {}
+        self._lock = threading.Lock()
+
+        if fcntl is None:
+            log.debug("fcntl is not available, the cache misses are only deduplicated within the process.")
+        else:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def _get_lock_path(self, key: str) -> str:
+        return os.path.join(self.lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ".lock")
+
+    @contextmanager
+    def hold(self, key: str, timeout: Optional[float] = None):
+        """Holds the lock of key (in the process and across processes) for the duration of the context.
+        The lock is reentrant within a thread.
+
+        :param key: The key
+        :type key: str
+        :param timeout: The maximum time to wait for the lock in seconds (None to wait forever)
+        :type timeout: float, optional
+        :return: A context manager yielding whether the lock was acquired (False if the timeout expired)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            key_lock = self._key_locks.get(key, None)
+            if key_lock is None:
+                key_lock = self._key_locks[key] = _KeyLock()
+            key_lock.users += 1
+
+        lock_path = self._get_lock_path(key) if fcntl is not None else None
+        acquired = False
+        try:
+            acquired = key_lock.lock.acquire(timeout=-1 if deadline is None else _remaining(deadline))
+            if acquired and lock_path is not None and key_lock.depth == 0:
+                key_lock.fd = _lock_file(lock_path, deadline)
+                if key_lock.fd is None:
+                    key_lock.lock.release()
+                    acquired = False
+            if acquired:
+                key_lock.depth += 1
+
+            yield acquired
+        finally:
+            if acquired:
+                key_lock.depth -= 1
+                if key_lock.depth == 0 and key_lock.fd is not None:
+                    fd, key_lock.fd = key_lock.fd, None
+                    _unlock_file(lock_path, fd)
+                key_lock.lock.release()
+
+            with self._lock:
+                key_lock.users -= 1
+                if key_lock.users == 0:
+                    del self._key_locks[key]
@@ -0,0 +1,145 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+
+class _MemoryShard:
+    """One shard of the memory tier: an LRU dictionary (key -> (payload, expire_time)) with its own lock."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self.num_bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+
+            payload, expire_time = entry
+            if expire_time is not None and expire_time <= time.time():
+                self._remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return payload
+
+    def set(self, key: str, payload: bytes, expire_time: Optional[float]):
+        with self.lock:
+            self._remove(key)
+            if len(payload) > self.max_bytes or self.max_entries <= 0:
+                return
+
+            self.entries[key] = (payload, expire_time)
+            self.num_bytes += len(payload)
+            while len(self.entries) > self.max_entries or self.num_bytes > self.max_bytes:
+                evicted_key = next(iter(self.entries))
+                self._remove(evicted_key)
+                self.evictions += 1
+
+    def pop(self, key: str):
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.num_bytes = 0
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.num_bytes -= len(entry[0])
+
+
+class MemoryCacheTier:
+    """An in-process LRU cache of serialized values, bounded by a number of entries and a number of bytes.
+    Keys are spread over shards (by hash), each with its own lock, so that threads working on different keys don't
+    contend for the same lock. The limits are split evenly between the shards (there are fewer shards than requested
+    if there are fewer entries than shards, so that every shard can hold at least one entry).
+
+    :param max_entries: The maximum number of entries
+    :type max_entries: int
+    :param max_bytes: The maximum total size of the payloads in bytes
+    :type max_bytes: int
+    :param num_shards: The number of shards
+    :type num_shards: int
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, num_shards: int = 16):
+        num_shards = max(1, min(num_shards, max_entries))
+        self._shards = [
+            _MemoryShard(max_entries // num_shards + (i < max_entries % num_shards), max_bytes // num_shards)
+            for i in range(num_shards)
+        ]
+
+    def _get_shard(self, key: str) -> _MemoryShard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the payload stored for key (None if it is missing or expired)."""
+        return self._get_shard(key).get(key)
+
+    def set(self, key: str, payload: bytes, ttl: Optional[float] = None):
+        """Stores the payload for key, evicting the least recently used entries of its shard if needed."""
+        expire_time = None if ttl is None else time.time() + ttl
+        self._get_shard(key).set(key, payload, expire_time)
+
+    def pop(self, key: str):
+        """Removes the entry of key."""
+        self._get_shard(key).pop(key)
+
+    def clear(self):
+        """Removes all entries."""
+        for shard in self._shards:
+            shard.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of entries, bytes and evictions of the memory tier."""
+        return {
+            "entries": sum(len(shard.entries) for shard in self._shards),
+            "bytes": sum(shard.num_bytes for shard in self._shards),
+            "evictions": sum(shard.evictions for shard in self._shards),
+        }
+
+
+class WriteBehindQueue:
+    """Applies writes in a background thread, so that callers don't wait for the disk.
+
+    :param write: The function applying a write (called with the arguments given to put)
+    :type write: Callable
+    """
+
+    def __init__(self, write: Callable[..., Any]):
+        self._write = write
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, *args):
+        """Schedules a write."""
+        self._queue.put(args)
+
+    def flush(self):
+        """Blocks until all the scheduled writes are applied."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            args = self._queue.get()
+            try:
+                self._write(*args)
+            except Exception as e:
+                log.warning(f"Write-behind to the disk cache failed: {e}")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,9 @@
+from .flow_history import FlowHistory
+from .message_sinks import (
+    MessageSink,
+    LoggingMessageSink,
+    add_message_sink,
+    remove_message_sink,
+    get_message_sinks,
+    any_message_sink_enabled,
+)
@@ -0,0 +1,51 @@
+from collections import deque
+from typing import List, Optional
+
+from aiflows.messages import Message
+
+
+class FlowHistory:
+    """A bounded, in-memory ring buffer of the most recent messages logged by a flow.
+
+    :param max_messages: The maximum number of messages kept in the buffer (None for an unbounded buffer)
+    :type max_messages: Optional[int]
+    """
+
+    def __init__(self, max_messages: Optional[int] = None):
+        self.max_messages = max_messages
+        self.messages = deque(maxlen=max_messages)
+        # number of messages ever added (including the ones that were dropped from the buffer)
+        self.num_logged_messages = 0
+
+    def add_message(self, message: Message):
+        """Adds a message to the history (the oldest message is dropped if the buffer is full).
+
+        :param message: The message to add
+        :type message: Message
+        """
+        self.messages.append(message)
+        self.num_logged_messages += 1
+
+    def get_last_n_messages(self, n: int) -> List[Message]:
+        """Returns the last n messages of the history (or fewer if they are not in the buffer anymore).
+
+        :param n: The number of messages to return
+        :type n: int
+        :return: The last n messages, from the oldest to the most recent
+        :rtype: List[Message]
+        """
+        if n <= 0:
+            return []
+        n = min(n, len(self.messages))
+        return [self.messages[i] for i in range(len(self.messages) - n, len(self.messages))]
+
+    def clear(self):
+        """Removes all messages from the history."""
+        self.messages.clear()
+
+    def __len__(self):
+        """Returns the number of messages in the buffer."""
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
@@ -0,0 +1,99 @@
+import threading
+from typing import List
+
+from aiflows.messages import Message
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+
+class MessageSink:
+    """Receives the messages logged by flows. The `is_enabled` check is done before the message is formatted
+    (or even created), so a disabled sink costs close to nothing.
+    """
+
+    def is_enabled(self) -> bool:
+        """Returns whether the sink currently accepts messages.
+
+        :return: True if the sink accepts messages
+        :rtype: bool
+        """
+        raise NotImplementedError()
+
+    def emit(self, flow_name: str, message: Message):
+        """Handles a message logged by a flow.
+
+        :param flow_name: The name of the flow that logged the message
+        :type flow_name: str
+        :param message: The logged message
+        :type message: Message
+        """
+        raise NotImplementedError()
+
+
+class LoggingMessageSink(MessageSink):
+    """Writes the formatted messages to a python logger, if the logger is enabled for the given level.
+
+    :param logger: The logger to write to (defaults to the logger of this module)
+    :type logger: logging.Logger, optional
+    :param level: The level at which the messages are logged, defaults to DEBUG
+    :type level: int, optional
+    """
+
+    def __init__(self, logger=None, level: int = logging.DEBUG):
+        self.logger = log if logger is None else logger
+        self.level = level
+
+    def is_enabled(self) -> bool:
+        return self.logger.isEnabledFor(self.level)
+
+    def emit(self, flow_name: str, message: Message):
+        self.logger.log(self.level, message.to_string())
+
+
+_message_sinks_lock = threading.Lock()
+_message_sinks: List[MessageSink] = [LoggingMessageSink()]
+
+
+def add_message_sink(sink: MessageSink):
+    """Registers a message sink that will receive the messages logged by all flows.
+
+    :param sink: The sink to register
+    :type sink: MessageSink
+    """
+    global _message_sinks
+    with _message_sinks_lock:
+        # copy on write, so that readers can iterate over the list without locking
+        _message_sinks = _message_sinks + [sink]
+
+
+def remove_message_sink(sink: MessageSink):
+    """Unregisters a message sink.
+
+    :param sink: The sink to unregister
+    :type sink: MessageSink
+    """
+    global _message_sinks
+    with _message_sinks_lock:
+        _message_sinks = [s for s in _message_sinks if s is not sink]
+
+
+def get_message_sinks() -> List[MessageSink]:
+    """Returns the registered message sinks.
+
+    :return: The registered message sinks
+    :rtype: List[MessageSink]
+    """
+    return _message_sinks
+
+
+def any_message_sink_enabled() -> bool:
+    """Returns whether at least one registered message sink currently accepts messages.
+
+    :return: True if a message sink is enabled
+    :rtype: bool
+    """
+    for sink in _message_sinks:
+        if sink.is_enabled():
+            return True
+    return False
@@ -1,18 +1,34 @@
-import copy
 import json
+import time
+import functools
 from dataclasses import dataclass
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Optional, Tuple, Union
 import colorama
 
-from aiflows.utils.general_helpers import create_unique_id, get_current_datetime_ns
+from aiflows.utils.general_helpers import create_sequential_id, format_datetime_ns, parse_datetime_ns
 from aiflows.utils.io_utils import coflows_deserialize, coflows_serialize
+from aiflows.utils.blob_store import BlobStore, attach_blobs, externalize_blobs
 colorama.init()
 
 
+@functools.lru_cache(maxsize=None)
+def _get_slots(cls: type) -> Tuple[str, ...]:
+    """Returns the names of the slots of a class and of its base classes (from the base classes to the class)."""
+    slots = []
+    for klass in reversed(cls.__mro__):
+        klass_slots = klass.__dict__.get("__slots__", ())
+        slots.extend((klass_slots,) if isinstance(klass_slots, str) else klass_slots)
+    return tuple(slot for slot in slots if slot not in ("__dict__", "__weakref__"))
+
+
 @dataclass
 class Message:
     """This class represents a message that is passed between nodes in a flow.
 
+    Messages are slotted (subclasses should declare the __slots__ of their attributes too) and their creation time is
+    stored as an integer number of nanoseconds (created_at_ns), which is only formatted into the created_at datetime
+    string when the message is serialized or displayed.
+
     :param data: The data content of the message
     :type data: Dict[str, Any]
     :param created_by: The name of the flow that created the message
@@ -21,9 +37,11 @@ class Message:
     :type private_keys: List[str], optional
     """
 
+    __slots__ = ("message_id", "created_at_ns", "created_by", "message_type", "data", "private_keys")
+
     # ~~~ Message unique identification ~~~
     message_id: str
-    created_at: str
+    created_at_ns: int
 
     # ~~~ Contextual information about the message ~~~
     created_by: str
@@ -38,8 +56,8 @@ class Message:
     def __init__(self, data: Dict[str, Any], created_by: str, private_keys: List[str] = None):
 
         # ~~~ Initialize message identifiers ~~~
-        self.message_id = create_unique_id()
-        self.created_at = get_current_datetime_ns()
+        self.message_id = create_sequential_id()
+        self.created_at_ns = time.time_ns()
 
         # ~~~ Initialize contextual information ~~~
         self.message_type = self.__class__.__name__
@@ -51,30 +69,57 @@ class Message:
         # ~~~ Initialize private keys ~~~
         self.private_keys = [] if private_keys is None else private_keys
 
+    @property
+    def created_at(self) -> str:
+        """Returns the creation datetime of the message (e.g. "2024-01-31 12:00:00.123456789", UTC)."""
+        return format_datetime_ns(self.created_at_ns)
+
+    @created_at.setter
+    def created_at(self, created_at: Union[str, int]):
+        self.created_at_ns = created_at if isinstance(created_at, int) else parse_datetime_ns(created_at)
+
     def _reset_message_id(self):
         """Resets the message's unique identification (message_id,created_at)"""
-        self.message_id = create_unique_id()
-        self.created_at = get_current_datetime_ns()
+        self.message_id = create_sequential_id()
+        self.created_at_ns = time.time_ns()
 
     def __sanitized__dict__(self):
-        """Removes any private_keys potentially present in the __dict__ object or the data dictionary"""
-        __sanitized__dict__ = copy.deepcopy(self.__dict__)
-
-        for private_key in self.private_keys:
-            if private_key in __sanitized__dict__:
-                del __sanitized__dict__[private_key]
+        """Returns a view of the attributes of the message without the private_keys (in the attributes and in the data
+        dictionary), with the creation time formatted into created_at. Only the two dictionaries are new: their values
+        are shared with the message (not copied), so that serializing or logging a message with a large payload (e.g. a
+        long chat history or an image) doesn't copy it.
 
-        for private_key in self.private_keys:
-            if private_key in __sanitized__dict__["data"]:
-                del __sanitized__dict__["data"][private_key]
+        :return: The sanitized view of the message
+        :rtype: Dict[str, Any]
+        """
+        private_keys = self.private_keys
+        __sanitized__dict__ = {}
+        for key in _get_slots(type(self)):
+            if key == "created_at_ns":
+                key = "created_at"
+            if key == "private_keys" or key in private_keys:
+                continue
+            try:
+                __sanitized__dict__[key] = getattr(self, key)
+            except AttributeError:  # unset attribute
+                continue
+
+        # subclasses without __slots__ store their attributes in a __dict__
+        for key, value in getattr(self, "__dict__", {}).items():
+            if key not in private_keys:
+                __sanitized__dict__[key] = value
+
+        data = __sanitized__dict__.get("data", None)
+        if isinstance(data, dict):
+            # dict.items doesn't read the values of a LazyBlobDict from the blob store
+            __sanitized__dict__["data"] = {key: value for key, value in dict.items(data) if key not in private_keys}
 
-        del __sanitized__dict__["private_keys"]
         return __sanitized__dict__
 
     def to_dict(self):
-        """Returns a dictionary representation of the message that can be serialized to JSON"""
-        d = self.__sanitized__dict__()
-        return d
+        """Returns a dictionary representation of the message that can be serialized to JSON. The nested values are
+        shared with the message, copy them (e.g. with copy.deepcopy) before modifying them."""
+        return self.__sanitized__dict__()
 
     def to_string(self):
         """Returns a formatted string representation of the message that will be logged to the console"""
@@ -85,24 +130,36 @@ class Message:
         d = self.__sanitized__dict__()
         return json.dumps(d, indent=4, default=str)
     
-    def serialize(self):
+    def serialize(self, blob_store: Optional[BlobStore] = None):
         """ Returns the serialized message
         
+        :param blob_store: The blob store the large values of the data are written to (see aiflows.utils.blob_store),
+            None to serialize them inline
+        :type blob_store: Optional[BlobStore]
         :return: The serialized message
         :rtype: bytes
         """
-        return coflows_serialize(self.to_dict())
+        d = self.to_dict()
+        if isinstance(d.get("data", None), dict):
+            d["data"] = externalize_blobs(d["data"], blob_store)
+        return coflows_serialize(d)
 
     @classmethod
-    def deserialize(cls, encoded_data: bytes):
+    def deserialize(cls, encoded_data: bytes, blob_store: Optional[BlobStore] = None):
         """ Deserializes the encoded data into a message
         
         :param encoded_data: The encoded message 
         :type encoded_data: bytes
-        :return: The deserialized message
-        :rtype: Message
+        :param blob_store: The blob store the values referenced by the data are read from (lazily, when accessed)
+        :type blob_store: Optional[BlobStore]
+        :return: The deserialized message (None if encoded_data is None, e.g. for an entry that doesn't exist)
+        :rtype: Optional[Message]
         """
         d = coflows_deserialize(encoded_data)
+        if d is None:
+            return None
+        if "data" in d:
+            d["data"] = attach_blobs(d["data"], blob_store)
             
         message_id = d.pop("message_id")
         created_at = d.pop("created_at")
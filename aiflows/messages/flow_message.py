@@ -10,7 +10,9 @@ colorama.init()
 
 @dataclass
 class FlowMessage(Message):
-    
+
+    __slots__ = ("src_flow_id", "reply_data", "src_flow", "dst_flow", "input_message_id", "is_reply", "user_id")
+
     def __init__(
         self,
         data: Dict[str, Any],
@@ -54,6 +56,8 @@ class UpdateMessage_Generic(Message):
     :param \**kwargs: arguments that are passed to the Message constructor
     """
 
+    __slots__ = ("updated_flow",)
+
     def __init__(self, updated_flow: str, **kwargs):
         super().__init__(**kwargs)
         self.updated_flow = updated_flow
@@ -87,6 +91,8 @@ class UpdateMessage_ChatMessage(UpdateMessage_Generic):
     :param \**kwargs: arguments that are passed to the UpdateMessage_Generic constructor
     """
 
+    __slots__ = ()
+
     def __init__(self, content: str, role: str, updated_flow: str, **kwargs):
         super().__init__(data={}, updated_flow=updated_flow, **kwargs)
         self.data["role"] = role
@@ -115,6 +121,8 @@ class UpdateMessage_ChatMessage(UpdateMessage_Generic):
 class UpdateMessage_NamespaceReset(Message):
     """Resets the namespace of a flow's message."""
 
+    __slots__ = ("updated_flow",)
+
     def __init__(self, updated_flow: str, created_by: str, keys_deleted_from_namespace: List[str]):
         super().__init__(created_by=created_by, data={})
         self.updated_flow = updated_flow
@@ -144,6 +152,8 @@ class UpdateMessage_FullReset(Message):
 
     """
 
+    __slots__ = ("updated_flow",)
+
     def __init__(self, updated_flow: str, created_by: str, keys_deleted_from_namespace: List[str]):
         super().__init__(created_by=created_by, data={})
         self.updated_flow = updated_flow
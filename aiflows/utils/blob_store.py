@@ -0,0 +1,418 @@
+"""A content-addressed store for the large values of the data of messages (e.g. base64-encoded images).
+
+When a message is serialized with a blob store, the values of its data that are larger than a threshold are written
+once to the CoLink storage under their sha256 digest and replaced by references in the serialized message. When the
+message is deserialized with a blob store, its data is a LazyBlobDict: the referenced values are only read from the
+storage when the flow accesses them, and a message forwarded to other flows is serialized with the same references
+(identical values sent to several flows are stored once).
+
+Blobs live in the storage of the user writing them, so they are only used for messages read by the same user (the
+messages pushed to other users carry their values inline). Blobs expire: the time a blob was last written (or
+referenced by a message) is kept next to it, and blobs unused for BLOB_STORE_PARAMETERS.ttl seconds are deleted by
+BlobStore.sweep (which writers run periodically), so messages must be read within the TTL of their blobs.
+"""
+import os
+import copy
+import time
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Union
+
+from aiflows.utils import logging
+from aiflows.utils.io_utils import coflows_deserialize, coflows_serialize
+
+log = logging.get_logger(__name__)
+
+BLOB_STORE_PATH = "blobs"
+# the time each blob was last written or referenced (small entries, listed by the sweeps)
+BLOB_TIMES_PATH = "blob_times"
+BLOB_REFERENCE_KEY = "__aiflows_blob__"
+
+
+@dataclass
+class BLOB_STORE_PARAMETERS:
+    """This class contains the global parameters of the blob store.
+
+    :param enabled: Whether the large values of messages are moved to the blob store. It can be set with the environment
+        variable AIFLOWS_BLOB_STORE
+    :type enabled: bool
+    :param threshold: The size (in characters for strings, in bytes for bytes) from which a value is moved to the blob
+        store. It can be set with the environment variable AIFLOWS_BLOB_THRESHOLD
+    :type threshold: int
+    :param ttl: The time (in seconds) after which a blob that wasn't written or referenced by a message is deleted. It
+        can be set with the environment variable AIFLOWS_BLOB_TTL
+    :type ttl: float
+    :param sweep_interval: The minimum time (in seconds) between two sweeps of the expired blobs by a blob store (None
+        to only sweep when BlobStore.sweep is called)
+    :type sweep_interval: Optional[float]
+    :param max_known_digests: The maximum number of digests of recently written blobs a blob store remembers (to
+        avoid writing them again)
+    :type max_known_digests: int
+    """
+
+    enabled: bool = True
+    threshold: int = 64 * 1024
+    ttl: float = 24 * 3600
+    sweep_interval: Optional[float] = 3600
+    max_known_digests: int = 4096
+
+
+BLOB_STORE_PARAMETERS.enabled = os.getenv("AIFLOWS_BLOB_STORE", "true").lower() == "true"
+BLOB_STORE_PARAMETERS.threshold = int(os.getenv("AIFLOWS_BLOB_THRESHOLD", BLOB_STORE_PARAMETERS.threshold))
+BLOB_STORE_PARAMETERS.ttl = float(os.getenv("AIFLOWS_BLOB_TTL", BLOB_STORE_PARAMETERS.ttl))
+
+
+class BlobStore:
+    """A content-addressed store of blobs in the CoLink storage of a user.
+
+    :param cl: The colink object (any object with the read_entry, update_entry, delete_entry and read_keys methods of
+        CoLink)
+    :type cl: CL.CoLink
+    """
+
+    def __init__(self, cl):
+        self.cl = cl
+        self.user_id = cl.get_user_id()
+        # the digests of the blobs recently written (or referenced) by this process with the time they were, which are
+        # not written again before half their TTL
+        self._known_digests: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def _is_fresh(self, digest: str, now: float) -> bool:
+        with self._lock:
+            written_at = self._known_digests.get(digest, None)
+            if written_at is None or now - written_at > BLOB_STORE_PARAMETERS.ttl / 2:
+                return False
+            self._known_digests.move_to_end(digest)
+            return True
+
+    def _record_write(self, digest: str, now: float):
+        self.cl.update_entry(f"{BLOB_TIMES_PATH}:{digest}", coflows_serialize(now))
+        with self._lock:
+            self._known_digests[digest] = now
+            self._known_digests.move_to_end(digest)
+            while len(self._known_digests) > BLOB_STORE_PARAMETERS.max_known_digests:
+                self._known_digests.popitem(last=False)
+
+    def put(self, data: Union[bytes, memoryview]) -> str:
+        """Writes a blob to the storage (unless it was recently written) and returns its digest.
+
+        :param data: The content of the blob
+        :type data: Union[bytes, memoryview]
+        :return: The sha256 digest of the blob
+        :rtype: str
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        if not self._is_fresh(digest, now):
+            self.cl.update_entry(f"{BLOB_STORE_PATH}:{digest}", bytes(data))
+            self._record_write(digest, now)
+            self._maybe_sweep(now)
+        return digest
+
+    def touch(self, digest: str):
+        """Records that a blob is referenced by a new message (so that it doesn't expire before the message is read).
+
+        :param digest: The digest of the blob
+        :type digest: str
+        """
+        now = time.time()
+        if not self._is_fresh(digest, now):
+            self._record_write(digest, now)
+
+    def get(self, digest: str) -> memoryview:
+        """Reads a blob from the storage.
+
+        :param digest: The digest of the blob
+        :type digest: str
+        :return: A view of the content of the blob (no copy is made)
+        :rtype: memoryview
+        """
+        data = self.cl.read_entry(f"{BLOB_STORE_PATH}:{digest}")
+        if data is None:
+            raise KeyError(f"Blob {digest} not found in the storage (it may have expired)")
+        return memoryview(data)
+
+    def sweep(self, ttl: Optional[float] = None) -> int:
+        """Deletes the blobs of the user that weren't written or referenced for ttl seconds.
+
+        :param ttl: The time in seconds (BLOB_STORE_PARAMETERS.ttl if None)
+        :type ttl: Optional[float]
+        :return: The number of blobs deleted
+        :rtype: int
+        """
+        ttl = BLOB_STORE_PARAMETERS.ttl if ttl is None else ttl
+        now = time.time()
+        num_deleted = 0
+        for storage_entry in self.cl.read_keys(prefix=f"{self.user_id}::{BLOB_TIMES_PATH}:", include_history=False):
+            key_name = storage_entry.key_path.split("::", 1)[1].split("@")[0]
+            written_at = coflows_deserialize(self.cl.read_entry(key_name))
+            if written_at is None or now - written_at <= ttl:
+                continue
+
+            digest = key_name.rpartition(":")[2]
+            self.cl.delete_entry(f"{BLOB_STORE_PATH}:{digest}")
+            self.cl.delete_entry(key_name)
+            with self._lock:
+                self._known_digests.pop(digest, None)
+            num_deleted += 1
+
+        if num_deleted > 0:
+            log.debug(f"Deleted {num_deleted} expired blobs")
+        return num_deleted
+
+    def _maybe_sweep(self, now: float):
+        sweep_interval = BLOB_STORE_PARAMETERS.sweep_interval
+        with self._lock:
+            if sweep_interval is None or now - self._last_sweep < sweep_interval:
+                return
+            self._last_sweep = now
+        threading.Thread(target=self._sweep_in_background, daemon=True).start()
+
+    def _sweep_in_background(self):
+        try:
+            self.sweep()
+        except Exception as e:
+            log.warning(f"Could not sweep the expired blobs ({e})")
+
+
+# the blob store of each colink object (a reconnected or different client gets its own store)
+__blob_stores: "weakref.WeakKeyDictionary[Any, BlobStore]" = weakref.WeakKeyDictionary()
+__blob_stores_lock = threading.Lock()
+
+
+def get_blob_store(cl) -> Optional[BlobStore]:
+    """Returns the blob store of cl (None if the blob store is disabled).
+
+    :param cl: The colink object
+    :type cl: CL.CoLink
+    :return: The blob store
+    :rtype: Optional[BlobStore]
+    """
+    if not BLOB_STORE_PARAMETERS.enabled:
+        return None
+
+    with __blob_stores_lock:
+        blob_store = __blob_stores.get(cl, None)
+        if blob_store is None:
+            blob_store = __blob_stores[cl] = BlobStore(cl)
+        return blob_store
+
+
+class BlobReference:
+    """A reference to a value of a message stored in a blob store. The value is read from the store on first access.
+
+    :param blob_store: The blob store containing the value
+    :type blob_store: BlobStore
+    :param digest: The digest of the blob
+    :type digest: str
+    :param size: The size of the blob in bytes
+    :type size: int
+    :param is_text: Whether the value is a string (stored UTF-8 encoded) or bytes
+    :type is_text: bool
+    """
+
+    __slots__ = ("blob_store", "digest", "size", "is_text", "_data")
+
+    def __init__(self, blob_store: BlobStore, digest: str, size: int, is_text: bool):
+        self.blob_store = blob_store
+        self.digest = digest
+        self.size = size
+        self.is_text = is_text
+        self._data: Optional[memoryview] = None
+
+    def memoryview(self) -> memoryview:
+        """Returns a view of the content of the blob (the UTF-8 encoding of strings), without copying it. It can e.g. be
+        passed to base64.b64decode without decoding the string.
+
+        :return: The view of the content of the blob
+        :rtype: memoryview
+        """
+        if self._data is None:
+            self._data = self.blob_store.get(self.digest)
+        return self._data
+
+    def resolve(self) -> Union[str, bytes]:
+        """Returns the value referenced.
+
+        :return: The value
+        :rtype: Union[str, bytes]
+        """
+        data = self.memoryview()
+        return str(data, "utf-8") if self.is_text else bytes(data)
+
+    def to_reference_dict(self) -> Dict[str, Any]:
+        """Returns the serializable reference to the blob.
+
+        :return: The reference
+        :rtype: Dict[str, Any]
+        """
+        return {BLOB_REFERENCE_KEY: self.digest, "size": self.size, "type": "str" if self.is_text else "bytes"}
+
+    def __deepcopy__(self, memo):
+        # the content of a blob never changes
+        return self
+
+    def __reduce__(self):
+        return (_identity, (self.resolve(),))
+
+    def __repr__(self):
+        return f"BlobReference(digest='{self.digest}', size={self.size}, type='{'str' if self.is_text else 'bytes'}')"
+
+
+def _identity(value):
+    return value
+
+
+def _is_reference_dict(value: Any) -> bool:
+    return type(value) is dict and BLOB_REFERENCE_KEY in value
+
+
+class LazyBlobDict(dict):
+    """The data of a message deserialized with a blob store: a dictionary whose values stored in the blob store are read
+    when they are accessed (e.g. with data[key], data.get(key), data.items(), or a copy of the dictionary). Copying the
+    dictionary with copy.deepcopy keeps the values not accessed yet in the store.
+    """
+
+    def _resolve(self, key, value):
+        if type(value) is BlobReference:
+            value = value.resolve()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __getitem__(self, key):
+        return self._resolve(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        return value.resolve() if type(value) is BlobReference else value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        return key, (value.resolve() if type(value) is BlobReference else value)
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+
+    def __iter__(self):
+        # overridden so that dict(data), {**data} and other.update(data) go through __getitem__
+        return dict.__iter__(self)
+
+    def items(self):
+        return [(key, self[key]) for key in dict.keys(self)]
+
+    def values(self):
+        return [self[key] for key in dict.keys(self)]
+
+    def memoryview(self, key) -> memoryview:
+        """Returns a view of the content of a value of the dictionary without copying it (see BlobReference.memoryview).
+
+        :param key: The key of the value
+        :type key: Any
+        :return: The view of the content of the value (its UTF-8 encoding for strings)
+        :rtype: memoryview
+        """
+        value = dict.__getitem__(self, key)
+        if type(value) is BlobReference:
+            return value.memoryview()
+        return memoryview(value.encode("utf-8") if isinstance(value, str) else value)
+
+    def copy(self):
+        return LazyBlobDict(dict.items(self))
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        result = LazyBlobDict()
+        memo[id(self)] = result
+        for key, value in dict.items(self):
+            dict.__setitem__(result, copy.deepcopy(key, memo), copy.deepcopy(value, memo))
+        return result
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+def externalize_blobs(data: Dict[str, Any], blob_store: Optional[BlobStore]) -> Dict[str, Any]:
+    """Returns data with the values larger than BLOB_STORE_PARAMETERS.threshold written to the blob store and replaced
+    by references (data itself if no value is replaced). References that were not resolved are kept as references, or
+    replaced by their values if blob_store is None or the store of another user.
+
+    :param data: The data of a message
+    :type data: Dict[str, Any]
+    :param blob_store: The blob store (None to keep all the values inline)
+    :type blob_store: Optional[BlobStore]
+    :return: The serializable data
+    :rtype: Dict[str, Any]
+    """
+    threshold = BLOB_STORE_PARAMETERS.threshold
+    externalized = None
+    for key, value in dict.items(data):
+        t = type(value)
+        if t is BlobReference:
+            # references are valid in the whole storage of their user
+            if blob_store is not None and value.blob_store.user_id == blob_store.user_id:
+                blob_store.touch(value.digest)
+                value = value.to_reference_dict()
+            else:
+                value = value.resolve()
+        elif blob_store is not None and (t is str or t is bytes) and len(value) >= threshold:
+            encoded = value.encode("utf-8") if t is str else value
+            value = {BLOB_REFERENCE_KEY: blob_store.put(encoded), "size": len(encoded), "type": t.__name__}
+        else:
+            continue
+
+        if externalized is None:
+            externalized = dict(dict.items(data))
+        externalized[key] = value
+
+    return data if externalized is None else externalized
+
+
+def attach_blobs(data: Dict[str, Any], blob_store: Optional[BlobStore]) -> Dict[str, Any]:
+    """Returns the deserialized data of a message with its blob references bound to the blob store (as a LazyBlobDict),
+    or data itself if it has no references.
+
+    :param data: The deserialized data of a message
+    :type data: Dict[str, Any]
+    :param blob_store: The blob store the references point to
+    :type blob_store: Optional[BlobStore]
+    :return: The data
+    :rtype: Dict[str, Any]
+    """
+    if not isinstance(data, dict) or not any(_is_reference_dict(value) for value in data.values()):
+        return data
+    if blob_store is None:
+        log.warning("The message references values of a blob store, but was deserialized without a blob store")
+        return data
+
+    return LazyBlobDict(
+        (
+            key,
+            BlobReference(blob_store, value[BLOB_REFERENCE_KEY], value["size"], value["type"] == "str")
+            if _is_reference_dict(value)
+            else value,
+        )
+        for key, value in data.items()
+    )
@@ -1,9 +1,11 @@
+import time
 import uuid
 
 import colink as CL
 from colink import CoLink, InstantServer, InstantRegistry
 from aiflows.messages import Message, FlowMessage
 from aiflows.utils.io_utils import coflows_deserialize, coflows_serialize
+from aiflows.utils.blob_store import get_blob_store
 from aiflows.utils.constants import (
     PUSH_ARGS_TRANSFER_PATH,
     COFLOWS_PATH,
@@ -21,6 +23,7 @@ class FlowFuture:
     def __init__(self, cl, message_path):
         self.cl = cl
         self.colink_storage_key = f"{message_path.rpartition(':')[0]}:response"
+        self.partial_colink_storage_key = f"{message_path.rpartition(':')[0]}:partial_response"
         self.output_interface = lambda data_dict, **kwargs: data_dict
 
     def __str__(self):
@@ -30,23 +33,50 @@ class FlowFuture:
         """
         Non-blocking read, returns None if there is no response yet.
         """
-        return FlowMessage.deserialize(self.cl.read_entry(self.colink_storage_key))
+        return FlowMessage.deserialize(self.cl.read_entry(self.colink_storage_key), get_blob_store(self.cl))
 
     def try_get_data(self):
-        message = FlowMessage.deserialize(self.cl.read_entry(self.colink_storage_key))
+        message = FlowMessage.deserialize(self.cl.read_entry(self.colink_storage_key), get_blob_store(self.cl))
         return message.data
 
     def get_message(self):
         """Blocking read of the future returns a message."""
-        message = FlowMessage.deserialize(self.cl.read_or_wait(self.colink_storage_key))
+        message = FlowMessage.deserialize(self.cl.read_or_wait(self.colink_storage_key), get_blob_store(self.cl))
         message.data = self.output_interface(message.data)
         return message
 
     def get_data(self):
         """Blocking read of the future returns a dictionary of the data."""
-        message = FlowMessage.deserialize(self.cl.read_or_wait(self.colink_storage_key))
+        message = FlowMessage.deserialize(self.cl.read_or_wait(self.colink_storage_key), get_blob_store(self.cl))
         return self.output_interface(message.data)
 
+    def try_get_partial_message(self):
+        """
+        Non-blocking read of the latest partial response (see Flow.send_partial_message), returns None if there is none.
+        """
+        return FlowMessage.deserialize(self.cl.read_entry(self.partial_colink_storage_key), get_blob_store(self.cl))
+
+    def iter_partial_data(self, poll_interval: float = 0.05):
+        """Yields the data of the partial responses of the flow as they arrive, until the (full) response is available.
+        Partial responses overwrite each other, so a slow reader may skip some of them (flows send the accumulated
+        output in every partial response, e.g. the message generated so far).
+
+        :param poll_interval: The time between two reads of the partial response in seconds
+        :type poll_interval: float, optional
+        :return: An iterator over the data of the partial responses
+        :rtype: Iterator[Dict[str, Any]]
+        """
+        last_partial_id = None
+        while True:
+            done = self.cl.read_entry(self.colink_storage_key) is not None
+            partial_message = self.try_get_partial_message()
+            if partial_message is not None and partial_message.message_id != last_partial_id:
+                last_partial_id = partial_message.message_id
+                yield self.output_interface(partial_message.data)
+            if done:
+                return
+            time.sleep(poll_interval)
+
     def set_output_interface(self, ouput_interface: Callable):
         """Set the output interface for the future."""
         self.output_interface = ouput_interface
@@ -66,7 +96,9 @@ def push_to_flow(
     :param message: The message to push
     :type message: FlowMessage
     """
-    if target_user_id == "local" or target_user_id == cl.get_user_id():
+    # the large values of the data are only moved to the blob store of the user when the receiver is the same user
+    is_local = target_user_id == "local" or target_user_id == cl.get_user_id()
+    if is_local:
         participants = [
             CL.Participant(
                 user_id=cl.get_user_id(),
@@ -89,14 +121,14 @@ def push_to_flow(
     push_msg_path = f"{PUSH_ARGS_TRANSFER_PATH}:{push_msg_id}:msg"
     cl.create_entry(
         push_msg_path,
-        message.serialize(),
+        message.serialize(get_blob_store(cl) if is_local else None),
     )
 
     push_param = {  # NOTE scheduler reads this
         "flow_id": target_flow_id,
         "message_id": push_msg_path,  # TODO return back to just id, need to change push worker
     }
-    cl.run_task("coflows_push", coflows_serialize(push_param), participants, True)
+    cl.run_task("coflows_push", coflows_serialize(push_param, use_json=True), participants, True)
     return push_msg_path
 
 
@@ -135,7 +167,7 @@ def dispatch_response(cl, output_message, reply_data):
 
         if user_id == cl.get_user_id():
             # local
-            cl.update_entry(colink_storage_key, output_message.serialize())
+            cl.update_entry(colink_storage_key, output_message.serialize(get_blob_store(cl)))
         else:
             participants = [
                 CL.Participant(
@@ -156,7 +188,28 @@ def dispatch_response(cl, output_message, reply_data):
                 "message_id": colink_storage_key,
             }
             cl.run_task(
-                "coflows_push", coflows_serialize(push_param), participants, True
+                "coflows_push", coflows_serialize(push_param, use_json=True), participants, True
             )
     else:
         log.warn("WARNING: dispatch response mode unknown.")
+
+
+def dispatch_partial_response(cl, output_message, reply_data):
+    """Dispatches a partial response message (e.g. the output generated so far by a streaming flow).
+    Partial responses are only delivered to local futures (storage mode): they overwrite each other in the storage next
+    to the response, where FlowFuture.iter_partial_data reads them. In other modes they are dropped, as the receivers
+    would take them for the response.
+
+    :param cl: The colink object
+    :type cl: CL.Colink
+    :param output_message: The partial response message
+    :type output_message: FlowMessage
+    :param reply_data: The meta data describing how to reply
+    """
+    if reply_data.get("mode", None) != "storage" or reply_data["user_id"] != cl.get_user_id():
+        return
+
+    message_path = reply_data["input_msg_path"]
+    cl.update_entry(
+        f"{message_path.rpartition(':')[0]}:partial_response", output_message.serialize(get_blob_store(cl))
+    )
@@ -0,0 +1,229 @@
+"""Framed compression of the entries written to CoLink storage (see coflows_serialize).
+
+A compressed entry is a header (a magic prefix, the version of the format, the compression algorithm, the id of the
+dictionary it was compressed with and the size of the uncompressed entry) followed by the compressed entry. Like the
+entries of the wire codec (aiflows.utils.wire_codec), compressed entries start with the byte 0xc1, which can't start a
+JSON entry, a MessagePack payload or a pickle, so they are told apart from uncompressed entries by their first bytes.
+
+Entries are compressed with zlib, or with zstd if the zstandard library is installed. Small repetitive entries (e.g.
+messages of the same flows) compress much better with a dictionary trained on samples of such entries (see
+train_dictionary and set_dictionary); the processes reading them must have the same dictionary registered.
+"""
+import hashlib
+import struct
+import threading
+import zlib
+from typing import Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zlib is used
+    zstandard = None
+
+MAGIC = b"\xc1AZ"
+VERSION = 1
+# compression algorithms
+ALGORITHM_ZLIB = 1
+ALGORITHM_ZSTD = 2
+ALGORITHMS = {"zlib": ALGORITHM_ZLIB, "zstd": ALGORITHM_ZSTD}
+_DEFAULT_LEVELS = {ALGORITHM_ZLIB: 1, ALGORITHM_ZSTD: 3}
+
+# magic, version, algorithm, dictionary id, uncompressed size
+_HEADER = struct.Struct(">3sBBIQ")
+
+# the dictionaries that can be used to decompress entries, by id
+__dictionaries: Dict[int, bytes] = {}
+# the dictionary entries are compressed with
+__dictionary: Optional[bytes] = None
+__dictionary_id = 0
+
+_local = threading.local()
+
+
+def is_compressed(data: bytes) -> bool:
+    """Returns whether data is a compressed entry.
+
+    :param data: The data
+    :type data: bytes
+    :return: Whether data is a compressed entry
+    :rtype: bool
+    """
+    return data[: len(MAGIC)] == MAGIC
+
+
+def get_dictionary_id(dictionary: bytes) -> int:
+    """Returns the id of a dictionary (derived from its content, never 0).
+
+    :param dictionary: The dictionary
+    :type dictionary: bytes
+    :return: The id of the dictionary
+    :rtype: int
+    """
+    return int.from_bytes(hashlib.sha256(dictionary).digest()[:4], "big") or 1
+
+
+def register_dictionary(dictionary: bytes) -> int:
+    """Registers a dictionary so that the entries compressed with it can be decompressed.
+
+    :param dictionary: The dictionary
+    :type dictionary: bytes
+    :return: The id of the dictionary
+    :rtype: int
+    """
+    dictionary_id = get_dictionary_id(dictionary)
+    __dictionaries[dictionary_id] = bytes(dictionary)
+    return dictionary_id
+
+
+def set_dictionary(dictionary: Optional[bytes]):
+    """Sets (and registers) the dictionary entries are compressed with, or stops compressing with a dictionary if None.
+
+    :param dictionary: The dictionary (e.g. returned by train_dictionary)
+    :type dictionary: Optional[bytes]
+    """
+    global __dictionary, __dictionary_id
+    if dictionary is None:
+        __dictionary, __dictionary_id = None, 0
+    else:
+        __dictionary_id = register_dictionary(dictionary)
+        __dictionary = __dictionaries[__dictionary_id]
+
+
+def get_dictionary() -> Optional[bytes]:
+    """Returns the dictionary entries are compressed with (None if there is none).
+
+    :return: The dictionary
+    :rtype: Optional[bytes]
+    """
+    return __dictionary
+
+
+def train_dictionary(samples: List[bytes], size: int = 16 * 1024) -> bytes:
+    """Trains a dictionary on samples of entries (e.g. serialized messages). With zstd, the dictionary is trained by the
+    zstd trainer (given enough samples), otherwise it is made of the most frequent samples, the most frequent last (zlib
+    looks back at most 32 KiB into the dictionary, and the end of the dictionary is the cheapest to refer to).
+
+    :param samples: The samples
+    :type samples: List[bytes]
+    :param size: The maximum size of the dictionary in bytes
+    :type size: int, optional
+    :return: The dictionary
+    :rtype: bytes
+    """
+    if zstandard is not None:
+        try:
+            return zstandard.train_dictionary(size, list(samples)).as_bytes()
+        except zstandard.ZstdError:  # e.g. too few samples
+            pass
+
+    counts: Dict[bytes, int] = {}
+    for sample in samples:
+        sample = bytes(sample)
+        counts[sample] = counts.get(sample, 0) + 1
+
+    parts, total = [], 0
+    for sample in sorted(counts, key=counts.get, reverse=True):
+        if total + len(sample) > size:
+            continue
+        parts.append(sample)
+        total += len(sample)
+    return b"".join(reversed(parts))
+
+
+def _get_zstd_compressor(level: int, dictionary_id: int):
+    compressors = getattr(_local, "zstd_compressors", None)
+    if compressors is None:
+        compressors = _local.zstd_compressors = {}
+    compressor = compressors.get((level, dictionary_id), None)
+    if compressor is None:
+        dict_data = zstandard.ZstdCompressionDict(__dictionaries[dictionary_id]) if dictionary_id else None
+        compressor = compressors[(level, dictionary_id)] = zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+    return compressor
+
+
+def _get_zlib_compressor(level: int, dictionary_id: int):
+    # compressors primed with the dictionary are copied instead of processing the dictionary for every entry
+    compressors = getattr(_local, "zlib_compressors", None)
+    if compressors is None:
+        compressors = _local.zlib_compressors = {}
+    compressor = compressors.get((level, dictionary_id), None)
+    if compressor is None:
+        if dictionary_id:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=__dictionaries[dictionary_id])
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressors[(level, dictionary_id)] = compressor
+    return compressor.copy()
+
+
+def compress(data: bytes, algorithm: str = "auto", level: Optional[int] = None, use_dictionary: bool = True) -> bytes:
+    """Compresses data into a compressed entry.
+
+    :param data: The data to compress
+    :type data: bytes
+    :param algorithm: The compression algorithm: "zlib", "zstd", or "auto" for "zstd" if the zstandard library is
+        installed and "zlib" otherwise
+    :type algorithm: str, optional
+    :param level: The compression level (the default level of the algorithm if None)
+    :type level: Optional[int], optional
+    :param use_dictionary: Whether to compress with the dictionary set with set_dictionary (if any)
+    :type use_dictionary: bool, optional
+    :return: The compressed entry
+    :rtype: bytes
+    """
+    if algorithm == "auto":
+        algorithm = "zstd" if zstandard is not None else "zlib"
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown compression algorithm {algorithm} (expected one of {list(ALGORITHMS)} or auto)")
+    if algorithm == "zstd" and zstandard is None:
+        raise ImportError("The zstd compression requires the zstandard library (pip install zstandard)")
+
+    algorithm_id = ALGORITHMS[algorithm]
+    level = _DEFAULT_LEVELS[algorithm_id] if level is None else level
+    dictionary_id = __dictionary_id if use_dictionary else 0
+
+    if algorithm_id == ALGORITHM_ZSTD:
+        compressed = _get_zstd_compressor(level, dictionary_id).compress(data)
+    else:
+        compressor = _get_zlib_compressor(level, dictionary_id)
+        compressed = compressor.compress(data) + compressor.flush()
+
+    return _HEADER.pack(MAGIC, VERSION, algorithm_id, dictionary_id, len(data)) + compressed
+
+
+def decompress(compressed_data: bytes) -> bytes:
+    """Decompresses a compressed entry.
+
+    :param compressed_data: The compressed entry
+    :type compressed_data: bytes
+    :return: The decompressed data
+    :rtype: bytes
+    """
+    if not is_compressed(compressed_data):
+        raise ValueError("The data is not a compressed entry")
+    _, version, algorithm_id, dictionary_id, size = _HEADER.unpack_from(compressed_data)
+    if version > VERSION or algorithm_id not in _DEFAULT_LEVELS:
+        raise ValueError(f"Unsupported compression version {version} or algorithm {algorithm_id}")
+    if dictionary_id and dictionary_id not in __dictionaries:
+        raise ValueError(
+            f"The entry was compressed with the dictionary {dictionary_id}, which is not registered "
+            "(see aiflows.utils.compression.register_dictionary)"
+        )
+
+    payload = memoryview(compressed_data)[_HEADER.size :]
+    if algorithm_id == ALGORITHM_ZSTD:
+        if zstandard is None:
+            raise ImportError("The entry was compressed with zstd, which requires the zstandard library")
+        dict_data = zstandard.ZstdCompressionDict(__dictionaries[dictionary_id]) if dictionary_id else None
+        data = zstandard.ZstdDecompressor(dict_data=dict_data).decompress(payload, max_output_size=size)
+    else:
+        if dictionary_id:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=__dictionaries[dictionary_id])
+        else:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        # the size in the header bounds the memory used by a corrupted entry
+        data = decompressor.decompress(payload, size)
+
+    if len(data) != size:
+        raise ValueError(f"Corrupted compressed entry ({len(data)} bytes instead of {size})")
+    return data
@@ -4,6 +4,7 @@ INSTANCE_METADATA_PATH = "instance_metadata"  # maybe remove after extending eng
 PUSH_ARGS_TRANSFER_PATH = "push_tasks"
 FLOW_MODULES_BASE_PATH = ""
 DEFAULT_DISPATCH_POINT = "coflows_dispatch"
+DEFAULT_FLOW_INSTANCE_POOL_SIZE = 64
 INSTANTIATION_METHODS = [
     "instantiate_with_overrides",
     "instantiate_from_config",
@@ -3,6 +3,8 @@ from pathlib import Path
 from typing import List, Any, Tuple, Dict, Callable, Union
 import uuid
 import time
+import calendar
+import itertools
 import os
 import ast
 import json
@@ -254,24 +256,67 @@ def create_unique_id(existing_ids: List[str] = None):
             return unique_id
 
 
-def get_current_datetime_ns():
-    """Returns the current datetime in nanoseconds.
+def create_sequential_id() -> str:
+    """Creates a unique id that is cheaper to create than create_unique_id: a random prefix drawn once per process
+    followed by a counter. The id has the format of a UUID (8-4-4-4-12 hexadecimal digits), with 80 random bits shared
+    by the ids of the process and 48 bits of counter.
 
-    :return: The current datetime in nanoseconds
-    :rtype: int
+    :return: A unique id
+    :rtype: str
     """
-    time_of_creation_ns = time.time_ns()
+    return f"{_sequential_id_prefix}{next(_sequential_id_counter) & 0xFFFFFFFFFFFF:012x}"
+
 
+def _reset_sequential_ids():
+    global _sequential_id_prefix, _sequential_id_counter
+    # the hyphen of the last group is part of the prefix
+    _sequential_id_prefix = str(uuid.uuid4())[:24]
+    _sequential_id_counter = itertools.count()
+
+
+_reset_sequential_ids()
+# a forked process must not create the ids of its parent
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_sequential_ids)
+
+
+def format_datetime_ns(time_ns: int) -> str:
+    """Formats a time in nanoseconds since the epoch (e.g. returned by time.time_ns) into a human-readable UTC datetime
+    (e.g. "2024-01-31 12:00:00.123456789").
+
+    :param time_ns: The time in nanoseconds since the epoch
+    :type time_ns: int
+    :return: The formatted datetime
+    :rtype: str
+    """
     # Convert nanoseconds to seconds and store as a time.struct_time object
-    time_of_creation_struct = time.gmtime(time_of_creation_ns // 1000000000)
+    time_struct = time.gmtime(time_ns // 1000000000)
+
+    # Format the time.struct_time object into a human-readable string and append the nanoseconds
+    return time.strftime("%Y-%m-%d %H:%M:%S", time_struct) + f".{time_ns % 1000000000:09d}"
 
-    # Format the time.struct_time object into a human-readable string
-    formatted_time_of_creation = time.strftime("%Y-%m-%d %H:%M:%S", time_of_creation_struct)
 
-    # Append the nanoseconds to the human-readable string
-    formatted_time_of_creation += f".{time_of_creation_ns % 1000000000:09d}"
+def parse_datetime_ns(formatted_datetime: str) -> int:
+    """Parses a datetime formatted by format_datetime_ns (or returned by get_current_datetime_ns) into a time in
+    nanoseconds since the epoch.
 
-    return formatted_time_of_creation
+    :param formatted_datetime: The formatted datetime
+    :type formatted_datetime: str
+    :return: The time in nanoseconds since the epoch
+    :rtype: int
+    """
+    seconds, _, nanoseconds = formatted_datetime.partition(".")
+    time_struct = time.strptime(seconds, "%Y-%m-%d %H:%M:%S")
+    return calendar.timegm(time_struct) * 1000000000 + int(nanoseconds.ljust(9, "0")[:9] or 0)
+
+
+def get_current_datetime_ns():
+    """Returns the current datetime in nanoseconds.
+
+    :return: The current datetime in nanoseconds
+    :rtype: str
+    """
+    return format_datetime_ns(time.time_ns())
 
 
 def get_predictions_dir_path(output_dir, create_if_not_exists=True):
@@ -376,6 +421,91 @@ def recursive_dictionary_update(d, u):
     return d
 
 
+def copy_config_tree(config):
+    """Copies the containers (dictionaries and lists) of a config tree, sharing its leaves.
+    Config leaves (strings, numbers, booleans, None) are immutable, so this is equivalent to a deepcopy of a config
+    loaded from yaml but avoids the bookkeeping of copy.deepcopy.
+
+    :param config: The config to copy
+    :type config: Any
+    :return: The copied config
+    :rtype: Any
+    """
+    if isinstance(config, dict):
+        return {k: copy_config_tree(v) for k, v in config.items()}
+    if isinstance(config, list):
+        return [copy_config_tree(v) for v in config]
+    return config
+
+
+def _raise_frozen_config_error(self, *args, **kwargs):
+    raise TypeError(
+        "This part of the config is shared with the cached default config of the flow class and can't be modified in "
+        "place: pass the change as an override to get_config, or modify a copy (see copy_config_tree)."
+    )
+
+
+class FrozenConfigDict(dict):
+    """A dictionary of a config tree shared between several configs, which can't be modified in place.
+    Copies (with copy.copy, copy.deepcopy or pickle) are regular dictionaries.
+    """
+
+    __setitem__ = __delitem__ = __ior__ = _raise_frozen_config_error
+    clear = pop = popitem = setdefault = update = _raise_frozen_config_error
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+
+class FrozenConfigList(list):
+    """A list of a config tree shared between several configs, which can't be modified in place.
+    Copies (with copy.copy, copy.deepcopy or pickle) are regular lists.
+    """
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _raise_frozen_config_error
+    append = extend = insert = pop = remove = clear = sort = reverse = _raise_frozen_config_error
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+def freeze_config_tree(config):
+    """Returns a copy of a config tree whose containers can't be modified in place (see FrozenConfigDict), so that
+    parts of it can be shared between configs.
+
+    :param config: The config to freeze
+    :type config: Any
+    :return: The frozen config
+    :rtype: Any
+    """
+    if isinstance(config, dict):
+        return FrozenConfigDict((k, freeze_config_tree(v)) for k, v in config.items())
+    if isinstance(config, list):
+        return FrozenConfigList(freeze_config_tree(v) for v in config)
+    return config
+
+
+def apply_config_overrides(config: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns config with the overrides applied like recursive_dictionary_update, without modifying config: only the
+    dictionaries on the paths of the overrides are copied, the other parts of the returned config are shared with
+    config.
+
+    :param config: The config
+    :type config: Dict[str, Any]
+    :param overrides: The overrides
+    :type overrides: Dict[str, Any]
+    :return: The config with the overrides applied
+    :rtype: Dict[str, Any]
+    """
+    updated_config = dict(config)
+    for k, v in overrides.items():
+        if isinstance(v, collections.abc.Mapping) and isinstance(updated_config.get(k, {}), collections.abc.Mapping):
+            updated_config[k] = apply_config_overrides(updated_config.get(k, {}), v)
+        else:
+            updated_config[k] = v
+    return updated_config
+
+
 def log_suggest_help():
     """Logs a message suggesting to get help or provide feedback on github."""
     red = "\033[31m"
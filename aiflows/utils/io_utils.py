@@ -1,7 +1,58 @@
 import os
 import pickle
 import json
-from typing import Any
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from aiflows.utils import compression, wire_codec
+
+
+@dataclass
+class SERIALIZATION_PARAMETERS:
+    """This class contains the global parameters of the serialization of the entries written to CoLink storage.
+
+    :param codec: The codec of the entries: "binary" (see aiflows.utils.wire_codec), "json", or "auto" (the same as
+        "binary"). Both codecs accept the same data. Entries are always decoded according to the codec they were encoded
+        with, so processes with different codecs can exchange entries. It can be set with the environment variable
+        AIFLOWS_SERIALIZATION_CODEC
+    :type codec: str
+    :param compression: The compression of the entries (see aiflows.utils.compression): "zlib", "zstd", "none", or
+        "auto" for "zstd" if the zstandard library is installed and "zlib" otherwise. Compressed entries are always
+        decompressed, whatever the compression. It can be set with the environment variable
+        AIFLOWS_SERIALIZATION_COMPRESSION
+    :type compression: str
+    :param compression_threshold: The size (in bytes) from which entries are compressed. It can be set with the
+        environment variable AIFLOWS_COMPRESSION_THRESHOLD
+    :type compression_threshold: int
+    :param compression_level: The compression level (the default level of the algorithm if None)
+    :type compression_level: Optional[int]
+    :param dictionary_min_size: The size (in bytes) from which entries smaller than compression_threshold are
+        compressed when a compression dictionary is set (see aiflows.utils.compression.set_dictionary). The dictionary
+        can be loaded from the file given by the environment variable AIFLOWS_COMPRESSION_DICTIONARY
+    :type dictionary_min_size: int
+    :param max_compression_ratio: Entries whose first 16 KiB don't compress below this ratio (e.g. base64-encoded
+        images, which compress to about 75% at a high cost) are not compressed
+    :type max_compression_ratio: float
+    """
+
+    codec: str = "auto"
+    compression: str = "auto"
+    compression_threshold: int = 4096
+    compression_level: Optional[int] = None
+    dictionary_min_size: int = 128
+    max_compression_ratio: float = 0.5
+
+
+SERIALIZATION_PARAMETERS.codec = os.getenv("AIFLOWS_SERIALIZATION_CODEC", SERIALIZATION_PARAMETERS.codec)
+SERIALIZATION_PARAMETERS.compression = os.getenv(
+    "AIFLOWS_SERIALIZATION_COMPRESSION", SERIALIZATION_PARAMETERS.compression
+)
+SERIALIZATION_PARAMETERS.compression_threshold = int(
+    os.getenv("AIFLOWS_COMPRESSION_THRESHOLD", SERIALIZATION_PARAMETERS.compression_threshold)
+)
+if os.getenv("AIFLOWS_COMPRESSION_DICTIONARY"):
+    with open(os.environ["AIFLOWS_COMPRESSION_DICTIONARY"], "rb") as f:
+        compression.set_dictionary(f.read())
 
 
 def load_pickle(pickle_path: str):
@@ -41,19 +92,57 @@ def recursive_json_serialize(obj):
         return obj
 
 
-def coflows_serialize(data: Any, use_pickle=False) -> bytes:
+def coflows_serialize(data: Any, use_pickle=False, use_json=False, compress=True) -> bytes:
     """ Serializes the given data.
     
     :param data: data to serialize
     :type data: Any
     :param use_pickle: whether to use pickle for serialization (default is False)
     :type use_pickle: bool
+    :param use_json: whether to serialize to JSON whatever the codec, for the entries read by the CoLink scheduler
+        (default is False)
+    :type use_json: bool
+    :param compress: whether to compress the data according to SERIALIZATION_PARAMETERS (default is True, False for
+        data kept in memory, which doesn't benefit from being smaller)
+    :type compress: bool
     """
     if use_pickle:
-        return pickle.dumps(data)
+        data = pickle.dumps(data)
+    else:
+        codec = SERIALIZATION_PARAMETERS.codec
+        if not use_json and codec in ("binary", "auto"):
+            data = wire_codec.encode(data)
+        else:
+            data = json.dumps(data, separators=(",", ":")).encode("utf-8")
+            if use_json:
+                return data
+    return _compress(data) if compress else data
+
+
+_COMPRESSION_PROBE_SIZE = 16 * 1024
+
+
+def _compress(data: bytes) -> bytes:
+    """Compresses the serialized data according to SERIALIZATION_PARAMETERS (if it is worth it)."""
+    if SERIALIZATION_PARAMETERS.compression == "none":
+        return data
+    if len(data) < SERIALIZATION_PARAMETERS.compression_threshold and (
+        len(data) < SERIALIZATION_PARAMETERS.dictionary_min_size or compression.get_dictionary() is None
+    ):
+        return data
+
+    if len(data) > 2 * _COMPRESSION_PROBE_SIZE:
+        probe = compression.compress(
+            data[:_COMPRESSION_PROBE_SIZE], algorithm=SERIALIZATION_PARAMETERS.compression, level=1
+        )
+        if len(probe) > SERIALIZATION_PARAMETERS.max_compression_ratio * _COMPRESSION_PROBE_SIZE:
+            return data
 
-    json_str = json.dumps(data)
-    return json_str.encode("utf-8")
+    compressed_data = compression.compress(
+        data, algorithm=SERIALIZATION_PARAMETERS.compression, level=SERIALIZATION_PARAMETERS.compression_level
+    )
+    # incompressible data (e.g. random bytes) is kept as is
+    return compressed_data if len(compressed_data) < len(data) else data
 
 
 def coflows_deserialize(encoded_data: bytes, use_pickle=False) -> Any:
@@ -66,8 +155,12 @@ def coflows_deserialize(encoded_data: bytes, use_pickle=False) -> Any:
     """
     if encoded_data is None:
         return None
+    if compression.is_compressed(encoded_data):
+        encoded_data = compression.decompress(encoded_data)
     if use_pickle:
         return pickle.loads(encoded_data)
+    if wire_codec.is_encoded(encoded_data):
+        return wire_codec.decode(encoded_data)
     try:
         json_str = encoded_data.decode("utf-8")
         return json.loads(json_str)
@@ -11,6 +11,7 @@ import os
 from aiflows.utils.general_helpers import (
     recursive_dictionary_update,
     quick_load_api_keys,
+    copy_config_tree,
 )
 from aiflows.backends.api_info import ApiInfo
 from copy import deepcopy
@@ -297,7 +298,7 @@ def mount(
         # NOTE scheduler uses this metadata
         instance_metadata = {"flow_endpoint": flow_endpoint, "user_id": client_id}
         cl.create_entry(
-            f"{INSTANCE_METADATA_PATH}:{flow_id}", coflows_serialize(instance_metadata)
+            f"{INSTANCE_METADATA_PATH}:{flow_id}", coflows_serialize(instance_metadata, use_json=True)
         )  # This can be added to engine queues data structure along with dispatch_point
 
         cl.create_entry(
@@ -320,6 +321,11 @@ def mount(
                 coflows_serialize(initial_state, use_pickle=True),
             )
 
+        cl.create_entry(
+            f"{mount_path}:state_version",
+            coflows_serialize(str(uuid.uuid4())),
+        )
+
         if dispatch_point_override is not None:
             cl.create_entry(
                 f"{mount_path}:dispatch_point_override",
@@ -555,7 +561,8 @@ def _get_local_flow_instance(
         )
 
     flow_class = hydra.utils.get_class(flow_class_name)
-    config = flow_class.get_config(**deepcopy(config_overrides))
+    # the subflow configs are modified below
+    config = copy_config_tree(flow_class.get_config(**deepcopy(config_overrides)))
 
     # TODO create flow object and store its pickle
     # flow_obj = flow_class.instantiate_from_default_config(cl, config_overrides)
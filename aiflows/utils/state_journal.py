@@ -0,0 +1,211 @@
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from colink import CoLink
+
+from aiflows.utils.io_utils import coflows_deserialize, coflows_serialize
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+
+@dataclass
+class STATE_JOURNAL_PARAMETERS:
+    """This class contains the global parameters of the state journal of mounted flow instances.
+    When enabled, the changes of a flow instance's state are appended as deltas to a journal under its mount path,
+    instead of rewriting the whole state after every task. The journal is compacted into a full snapshot
+    (the `{mount_path}:state` entry) after max_deltas deltas or max_bytes bytes.
+
+    :param enabled: Whether to persist state changes incrementally
+    :type enabled: bool, optional
+    :param max_deltas: The number of deltas after which the journal is compacted
+    :type max_deltas: int, optional
+    :param max_bytes: The total size of the deltas (in bytes) after which the journal is compacted
+    :type max_bytes: int, optional
+    """
+
+    enabled: bool = False
+    max_deltas: int = 32
+    max_bytes: int = 1 << 20
+
+
+STATE_JOURNAL_PARAMETERS.enabled = os.getenv("FLOW_STATE_JOURNAL", "false").lower() == "true"
+
+
+def _journal_info_path(mount_path: str) -> str:
+    return f"{mount_path}:state_journal"
+
+
+def _journal_delta_path(mount_path: str, seq: int) -> str:
+    return f"{mount_path}:state_journal:{seq}"
+
+
+def _read_journal_info(cl: CoLink, mount_path: str) -> Dict[str, int]:
+    info = coflows_deserialize(cl.read_entry(_journal_info_path(mount_path)))
+    if info is None:
+        return {"snapshot_seq": 0, "head_seq": 0, "num_bytes": 0}
+    return info
+
+
+def _bump_state_version(cl: CoLink, mount_path: str) -> str:
+    state_version = str(uuid.uuid4())
+    cl.update_entry(f"{mount_path}:state_version", coflows_serialize(state_version))
+    return state_version
+
+
+def get_state_version(cl: CoLink, mount_path: str) -> Optional[str]:
+    """Returns the version of the state of the flow instance mounted at mount_path.
+    The version changes every time the state (or its journal) is written.
+
+    :param cl: colink object
+    :type cl: CoLink
+    :param mount_path: mount path of the flow instance
+    :type mount_path: str
+    :return: version of the state (None if unknown)
+    :rtype: Optional[str]
+    """
+    return coflows_deserialize(cl.read_entry(f"{mount_path}:state_version"))
+
+
+def _write_snapshot_entry(cl: CoLink, mount_path: str, state: Dict[str, Any], seq: int):
+    # the snapshot records the last delta it contains, so that readers never apply older deltas to it
+    cl.update_entry(f"{mount_path}:state", coflows_serialize((seq, state), use_pickle=True))
+
+
+def _read_snapshot_entry(cl: CoLink, mount_path: str) -> Tuple[int, Optional[Dict[str, Any]]]:
+    snapshot = coflows_deserialize(cl.read_entry(f"{mount_path}:state"), use_pickle=True)
+    if isinstance(snapshot, tuple):
+        return snapshot
+    # a state written without a journal sequence number (e.g. the initial state of the mount)
+    return 0, snapshot
+
+
+def _compact_journal(cl: CoLink, mount_path: str, info: Dict[str, int], state: Dict[str, Any], seq: int) -> str:
+    _write_snapshot_entry(cl, mount_path, state, seq)
+    info_after = {"snapshot_seq": seq, "head_seq": seq, "num_bytes": 0}
+    cl.update_entry(_journal_info_path(mount_path), coflows_serialize(info_after))
+    for old_seq in range(info["snapshot_seq"] + 1, info["head_seq"] + 1):
+        cl.delete_entry(_journal_delta_path(mount_path, old_seq))
+    return _bump_state_version(cl, mount_path)
+
+
+def write_state_snapshot(cl: CoLink, mount_path: str, state: Dict[str, Any]) -> str:
+    """Writes the full state of the flow instance mounted at mount_path, discarding its journal.
+
+    :param cl: colink object
+    :type cl: CoLink
+    :param mount_path: mount path of the flow instance
+    :type mount_path: str
+    :param state: full state of the flow instance
+    :type state: Dict[str, Any]
+    :return: new version of the state
+    :rtype: str
+    """
+    info = _read_journal_info(cl, mount_path)
+    # the state replaces everything journaled so far
+    return _compact_journal(cl, mount_path, info, state, info["head_seq"])
+
+
+def _apply_delta(state: Dict[str, Any], delta: Dict[str, Any]):
+    state.update(delta["changes"])
+    for key in delta["deleted_keys"]:
+        state.pop(key, None)
+
+
+def append_state_delta(
+    cl: CoLink,
+    mount_path: str,
+    changes: Dict[str, Any],
+    deleted_keys: Iterable[str],
+) -> str:
+    """Appends the changes of the state of the flow instance mounted at mount_path to its journal.
+    If the journal grows beyond STATE_JOURNAL_PARAMETERS.max_deltas deltas or STATE_JOURNAL_PARAMETERS.max_bytes bytes,
+    it is compacted instead: the journaled state (read from the storage) with the changes applied is written as a new
+    snapshot.
+
+    :param cl: colink object
+    :type cl: CoLink
+    :param mount_path: mount path of the flow instance
+    :type mount_path: str
+    :param changes: the changed keys of the state with their new values
+    :type changes: Dict[str, Any]
+    :param deleted_keys: the keys deleted from the state
+    :type deleted_keys: Iterable[str]
+    :return: new version of the state
+    :rtype: str
+    """
+    info = _read_journal_info(cl, mount_path)
+    delta = {"changes": changes, "deleted_keys": list(deleted_keys)}
+    serialized_delta = coflows_serialize(delta, use_pickle=True)
+
+    seq = info["head_seq"] + 1
+    num_deltas = seq - info["snapshot_seq"]
+    num_bytes = info["num_bytes"] + len(serialized_delta)
+    if num_deltas > STATE_JOURNAL_PARAMETERS.max_deltas or num_bytes > STATE_JOURNAL_PARAMETERS.max_bytes:
+        log.debug(f"Compacting the state journal of {mount_path} ({num_deltas} deltas, {num_bytes} bytes).")
+        state = read_state(cl, mount_path) or {}
+        _apply_delta(state, delta)
+        return _compact_journal(cl, mount_path, info, state, seq)
+
+    # the delta is written before the journal info, so readers never see an incomplete journal
+    cl.update_entry(_journal_delta_path(mount_path, seq), serialized_delta)
+    info = {"snapshot_seq": info["snapshot_seq"], "head_seq": seq, "num_bytes": num_bytes}
+    cl.update_entry(_journal_info_path(mount_path), coflows_serialize(info))
+
+    return _bump_state_version(cl, mount_path)
+
+
+def read_state(cl: CoLink, mount_path: str, max_attempts: int = 8) -> Optional[Dict[str, Any]]:
+    """Reads the state of the flow instance mounted at mount_path (its snapshot with the journal applied on top).
+
+    :param cl: colink object
+    :type cl: CoLink
+    :param mount_path: mount path of the flow instance
+    :type mount_path: str
+    :param max_attempts: the number of times the state is read again if the journal is compacted while it is read
+    :type max_attempts: int, optional
+    :return: state of the flow instance (None if it has no state)
+    :rtype: Optional[Dict[str, Any]]
+    """
+    for _ in range(max_attempts):
+        # the journal info is read before the snapshot: compaction writes the snapshot before the info, so the snapshot
+        # read is at least as recent as the info (its sequence number tells which deltas it already contains)
+        info = coflows_deserialize(cl.read_entry(_journal_info_path(mount_path)))
+        snapshot_seq, state = _read_snapshot_entry(cl, mount_path)
+        if info is None or info["head_seq"] <= snapshot_seq:
+            return state
+
+        state = {} if state is None else state
+        for seq in range(snapshot_seq + 1, info["head_seq"] + 1):
+            delta = coflows_deserialize(cl.read_entry(_journal_delta_path(mount_path, seq)), use_pickle=True)
+            if delta is None:
+                # compacted after the snapshot was read, the newer snapshot contains this delta
+                break
+            _apply_delta(state, delta)
+        else:
+            return state
+
+    raise RuntimeError(f"The state journal of {mount_path} kept being compacted while its state was read")
+
+
+def persist_flow_state(cl: CoLink, mount_path: str, flow) -> str:
+    """Persists the state of a flow instance that was loaded from (or last persisted to) mount_path.
+    Only the changes since the last checkpoint are written if the journal is enabled, the full state otherwise.
+
+    :param cl: colink object
+    :type cl: CoLink
+    :param mount_path: mount path of the flow instance
+    :type mount_path: str
+    :param flow: the flow instance
+    :type flow: aiflows.base_flows.Flow
+    :return: new version of the state
+    :rtype: str
+    """
+    changes, deleted_keys = flow.checkpoint_flow_state()
+
+    if STATE_JOURNAL_PARAMETERS.enabled:
+        return append_state_delta(cl, mount_path, changes, deleted_keys)
+
+    return write_state_snapshot(cl, mount_path, flow.__getstate__()["flow_state"])
@@ -0,0 +1,97 @@
+"""A compact binary codec for the entries written to CoLink storage (messages, serving metadata, ...).
+
+An encoded entry is a header (a magic prefix, the version of the codec and the format of the payload) followed by the
+payload in the MessagePack format. The first byte of the magic prefix (0xc1) is never used by MessagePack, can't start
+a UTF-8 (hence JSON) text and doesn't start a pickle, so encoded entries are told apart from legacy JSON entries by
+their first bytes.
+
+The codec accepts the same data as the JSON codec of aiflows.utils.io_utils, so that the data read back doesn't depend
+on the codec it was written with: the keys of dictionaries are converted to strings like json does, and bytes are
+rejected.
+"""
+import json
+from typing import Any
+
+import msgpack
+
+MAGIC = b"\xc1AF"
+VERSION = 1
+# formats of the payload
+FORMAT_MSGPACK = 1
+HEADER = MAGIC + bytes((VERSION, FORMAT_MSGPACK))
+
+
+def is_encoded(data: bytes) -> bool:
+    """Returns whether data was encoded by this codec (as opposed to e.g. a legacy JSON entry).
+
+    :param data: The data
+    :type data: bytes
+    :return: Whether data is an encoded entry
+    :rtype: bool
+    """
+    return data[: len(MAGIC)] == MAGIC
+
+
+def _to_json_key(key: Any) -> str:
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (int, float)):
+        # e.g. 1 -> "1", True -> "true", None -> "null"
+        return json.dumps(key)
+    raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+
+
+def _to_json_types(obj: Any) -> Any:
+    """Returns obj with the keys of its dictionaries converted to strings (obj itself if they all are strings), and
+    raises a TypeError if it contains bytes.
+    """
+    if isinstance(obj, dict):
+        converted = None
+        for i, (key, value) in enumerate(obj.items()):
+            converted_value = _to_json_types(value)
+            if converted is None and (type(key) is not str or converted_value is not value):
+                converted = dict(list(obj.items())[:i])
+            if converted is not None:
+                converted[_to_json_key(key)] = converted_value
+        return obj if converted is None else converted
+    if isinstance(obj, (list, tuple)):
+        converted = None
+        for i, value in enumerate(obj):
+            converted_value = _to_json_types(value)
+            if converted is None and converted_value is not value:
+                converted = list(obj[:i])
+            if converted is not None:
+                converted.append(converted_value)
+        return obj if converted is None else converted
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return obj
+
+
+def encode(data: Any) -> bytes:
+    """Encodes data (made of None, booleans, numbers, strings, lists, tuples and dictionaries) into an entry.
+
+    :param data: The data to encode
+    :type data: Any
+    :return: The encoded entry
+    :rtype: bytes
+    """
+    return HEADER + msgpack.packb(_to_json_types(data), use_bin_type=True)
+
+
+def decode(encoded_data: bytes) -> Any:
+    """Decodes an entry encoded by encode (lists and tuples are decoded as lists, like with JSON).
+
+    :param encoded_data: The encoded entry
+    :type encoded_data: bytes
+    :return: The decoded data
+    :rtype: Any
+    """
+    if not is_encoded(encoded_data):
+        raise ValueError("The data was not encoded by the wire codec")
+    version, payload_format = encoded_data[len(MAGIC)], encoded_data[len(MAGIC) + 1]
+    if version > VERSION or payload_format != FORMAT_MSGPACK:
+        raise ValueError(f"Unsupported wire codec version {version} or format {payload_format}")
+
+    # entries written by previous versions of the codec may have non-string keys
+    return msgpack.unpackb(memoryview(encoded_data)[len(HEADER) :], raw=False, strict_map_key=False)
@@ -1,6 +1,7 @@
 from .dispatch_worker import (
     run_dispatch_worker_threads,
     run_dispatch_worker_thread,
+    flow_instance_pool,
 )
 
 from .get_instance_worker import run_get_instance_worker_thread
@@ -21,19 +21,30 @@ from aiflows.utils.serving import (
     start_colink_component,
     _get_local_flow_instance_metadata,
 )
+from aiflows.utils.state_journal import (
+    get_state_version,
+    read_state,
+    persist_flow_state,
+)
 from aiflows.utils.io_utils import coflows_deserialize, coflows_serialize
+from aiflows.utils.blob_store import get_blob_store
 from aiflows.utils.constants import (
     DEFAULT_DISPATCH_POINT,
     FLOW_MODULES_BASE_PATH,
     COFLOWS_PATH,
+    DEFAULT_FLOW_INSTANCE_POOL_SIZE,
 )
 from aiflows.backends.api_info import ApiInfo
+from aiflows.workers.flow_instance_pool import FlowInstancePool
 from aiflows.utils import logging
 
 log = logging.get_logger(__name__)
 
 worker_api_infos = None
 
+# live flow instances shared by all the dispatch worker threads of the process
+flow_instance_pool = FlowInstancePool(max_size=DEFAULT_FLOW_INSTANCE_POOL_SIZE)
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Dispatch flow worker")
@@ -67,6 +78,12 @@ def parse_args():
         default=DEFAULT_DISPATCH_POINT,
         help="Dispatch point to which the workers will subscribe to.",
     )
+    parser.add_argument(
+        "--flow_instance_pool_size",
+        type=int,
+        default=DEFAULT_FLOW_INSTANCE_POOL_SIZE,
+        help="Maximum number of live flow instances kept by the worker (0 disables the pool).",
+    )
     parser.add_argument(
         "--keep_alive",
         type=bool,
@@ -101,10 +118,33 @@ def create_flow(
     flow = hydra.utils.instantiate(config, _recursive_=False, _convert_="partial")
     if state is not None:
         flow.__setflowstate__({"flow_state": state}, safe_mode=True)
+        # the state matches the one in storage, only the changes made from now on need to be persisted
+        flow.flow_state.mark_clean()
 
     return flow
 
 
+def write_back_flow_state(cl: CoLink, mount_path: str, flow, state_version: str = None) -> str:
+    """Writes the state of a flow instance back to the storage after it ran, if the flow changed it (or if its version
+    in the storage is unknown). Skipping the write relies on FlowState.has_changes, which is exact: the state owns
+    copies of its values, and every way of modifying them in place goes through a tracked read.
+
+    :param cl: colink object
+    :type cl: CoLink
+    :param mount_path: mount path of the flow instance
+    :type mount_path: str
+    :param flow: the flow instance
+    :type flow: aiflows.base_flows.Flow
+    :param state_version: version of the state the flow instance was loaded with (None if unknown)
+    :type state_version: str, optional
+    :return: version of the state in the storage
+    :rtype: str
+    """
+    if state_version is None or flow.flow_state.has_changes():
+        return persist_flow_state(cl, mount_path, flow)
+    return state_version
+
+
 def dispatch_task_handler(cl: CoLink, param: bytes, participants: List[CL.Participant]):
     """Dispatches a task to and runs the appropriate flow on a message.
 
@@ -130,7 +170,7 @@ def dispatch_task_handler(cl: CoLink, param: bytes, participants: List[CL.Partic
 
         # send empty responses
         for message_path in dispatch_task["message_ids"]:
-            input_msg = FlowMessage.deserialize(cl.read_entry(message_path))
+            input_msg = FlowMessage.deserialize(cl.read_entry(message_path), get_blob_store(cl))
             output_msg = FlowMessage(
                 data={"error": "Unknown flow instance!"},
                 src_flow=f"{cl.get_user_id()}:dispatch_worker",
@@ -164,27 +204,38 @@ def dispatch_task_handler(cl: CoLink, param: bytes, participants: List[CL.Partic
     log.info(f"message_paths: {message_paths}")
     log.info(f"parallel_dispatch: {parallel_dispatch}\n")
 
-    config_overrides = None
-    state = None
-
     # get instance data
     mount_path = f"{serve_entry_path}:mounts:{client_id}:{flow_id}"
-    config_overrides = coflows_deserialize(
-        cl.read_entry(f"{mount_path}:config_overrides")
-    )
-    state = coflows_deserialize(cl.read_entry(f"{mount_path}:state"), use_pickle=True)
-
-    if config_overrides is None:
-        log.error("ERROR: no config to load flow.")
-        return
+    state_version = get_state_version(cl, mount_path)
+    flow, state_snapshot = flow_instance_pool.checkout(flow_id, state_version)
 
     try:
-        # TODO would be better to have pickled flow in colink storage
-        flow = create_flow(None, config_overrides, state)
+        if flow is None:
+            config_overrides = coflows_deserialize(
+                cl.read_entry(f"{mount_path}:config_overrides")
+            )
+            state = read_state(cl, mount_path)
+
+            if config_overrides is None:
+                log.error("ERROR: no config to load flow.")
+                return
+
+            # TODO would be better to have pickled flow in colink storage
+            flow = create_flow(None, config_overrides, state)
+            if parallel_dispatch:
+                # kept in memory by the instance pool, so not compressed
+                state_snapshot = coflows_serialize(state, use_pickle=True, compress=False)
+        elif parallel_dispatch and state_snapshot is not None:
+            # the state of parallel dispatch flows is never persisted, every run starts from the mounted state
+            flow.__setflowstate__(
+                {"flow_state": coflows_deserialize(state_snapshot, use_pickle=True)},
+                safe_mode=True,
+            )
+
         flow.set_colink(cl)
 
         for message_path in dispatch_task["message_ids"]:
-            input_msg = FlowMessage.deserialize(cl.read_entry(message_path))
+            input_msg = FlowMessage.deserialize(cl.read_entry(message_path), get_blob_store(cl))
             log.info(f"Input message source: {input_msg.src_flow}")
 
             input_msg.reply_data["input_msg_path"] = message_path
@@ -195,10 +246,10 @@ def dispatch_task_handler(cl: CoLink, param: bytes, participants: List[CL.Partic
         return
 
     if not parallel_dispatch:
-        new_state = flow.__getstate__()["flow_state"]
-        cl.update_entry(
-            f"{mount_path}:state", coflows_serialize(new_state, use_pickle=True)
-        )
+        state_version = write_back_flow_state(cl, mount_path, flow, state_version)
+        state_snapshot = None
+
+    flow_instance_pool.checkin(flow_id, state_version, flow, state_snapshot)
 
 
 def run_dispatch_worker_thread(
@@ -206,6 +257,7 @@ def run_dispatch_worker_thread(
     dispatch_point=DEFAULT_DISPATCH_POINT,
     flow_modules_base_path=FLOW_MODULES_BASE_PATH,
     api_infos: List[ApiInfo] = None,
+    flow_instance_pool_size: int = None,
 ):
     """Runs a dispatch worker in a separate thread.
 
@@ -218,6 +270,8 @@ def run_dispatch_worker_thread(
     :param api_infos: Api Info that the worker should inject into flows when loading them from colink storage.
      Api Info remains local on the worker and doesn't get stored in colink storage.
     :type api_infos: List[ApiInfo]
+    :param flow_instance_pool_size: maximum number of live flow instances kept by the worker (shared by all the threads of the process, 0 disables the pool)
+    :type flow_instance_pool_size: int
     """
     # sys.path.append(flow_modules_base_path)
 
@@ -226,6 +280,8 @@ def run_dispatch_worker_thread(
     global worker_api_infos
     if api_infos is not None:
         worker_api_infos = api_infos
+    if flow_instance_pool_size is not None:
+        flow_instance_pool.max_size = flow_instance_pool_size
     pop = ProtocolOperator(__name__)
 
     proto_role = f"{dispatch_point}:local"
@@ -243,6 +299,7 @@ def run_dispatch_worker_threads(
     dispatch_point=DEFAULT_DISPATCH_POINT,
     flow_modules_base_path=FLOW_MODULES_BASE_PATH,
     api_infos: List[ApiInfo] = None,
+    flow_instance_pool_size: int = None,
 ):
     """Runs multiple dispatch workers in separate threads.
 
@@ -257,10 +314,12 @@ def run_dispatch_worker_threads(
     :param api_infos: Api Info that the worker should inject into flows when loading them from colink storage.
      Api Info remains local on the worker and doesn't get stored in colink storage.
     :type api_infos: List[ApiInfo]
+    :param flow_instance_pool_size: maximum number of live flow instances kept by the workers (0 disables the pool)
+    :type flow_instance_pool_size: int
     """
     for i in range(num_workers):
         run_dispatch_worker_thread(
-            cl, dispatch_point, flow_modules_base_path, api_infos
+            cl, dispatch_point, flow_modules_base_path, api_infos, flow_instance_pool_size
         )
 
 
@@ -270,6 +329,7 @@ if __name__ == "__main__":
     cl = start_colink_component("Dispatch worker", args)
 
     sys.path.append(args["flow_modules_base_path"])
+    flow_instance_pool.max_size = args["flow_instance_pool_size"]
     pop = ProtocolOperator(__name__)
 
     proto_role = args["dispatch_point"] + ":local"
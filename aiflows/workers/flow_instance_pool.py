@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiflows.utils import logging
+
+log = logging.get_logger(__name__)
+
+
+class FlowInstancePool:
+    """A bounded LRU pool of live flow instances, keyed by flow_id.
+    Every pooled instance is stored together with the version of the state it was built from (or last persisted).
+    An instance is only handed out if the version currently in CoLink storage matches the version it was stored with,
+    otherwise it is dropped and the caller has to rebuild it from storage.
+
+    Instances are checked out of the pool while they are in use, so that two threads never run the same object.
+    For instances whose state is never persisted (parallel dispatch), the serialized state they were built from can be
+    stored along with them, so that the caller can restore it before each run.
+
+    :param max_size: The maximum number of instances kept in the pool (0 disables pooling)
+    :type max_size: int
+    """
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self._instances: "OrderedDict[str, Tuple[Optional[str], Any, Optional[bytes]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def checkout(self, flow_id: str, state_version: Optional[str]):
+        """Takes the instance of flow_id out of the pool if it matches the given state version.
+
+        :param flow_id: The id of the flow instance
+        :type flow_id: str
+        :param state_version: The version of the state currently in CoLink storage
+        :type state_version: Optional[str]
+        :return: The pooled flow instance and the state snapshot stored with it, or (None, None) if there is no
+            up-to-date instance in the pool
+        :rtype: Tuple[Optional[aiflows.base_flows.Flow], Optional[bytes]]
+        """
+        with self._lock:
+            cached = self._instances.pop(flow_id, None)
+            if cached is not None and state_version is not None and cached[0] == state_version:
+                self.hits += 1
+                return cached[1], cached[2]
+
+            self.misses += 1
+            return None, None
+
+    def checkin(self, flow_id: str, state_version: Optional[str], flow, state_snapshot: Optional[bytes] = None):
+        """Puts a flow instance (back) into the pool, evicting the least recently used instances if needed.
+        Instances with an unknown state version are not pooled, as they could never be validated.
+
+        :param flow_id: The id of the flow instance
+        :type flow_id: str
+        :param state_version: The version of the state the instance corresponds to
+        :type state_version: Optional[str]
+        :param flow: The flow instance
+        :type flow: aiflows.base_flows.Flow
+        :param state_snapshot: The serialized state to restore before each run (for instances that don't persist state)
+        :type state_snapshot: Optional[bytes]
+        """
+        if self.max_size <= 0 or state_version is None:
+            return
+
+        with self._lock:
+            self._instances[flow_id] = (state_version, flow, state_snapshot)
+            self._instances.move_to_end(flow_id)
+            while len(self._instances) > self.max_size:
+                evicted_flow_id, _ = self._instances.popitem(last=False)
+                self.evictions += 1
+                log.debug(f"Evicted flow instance {evicted_flow_id} from the pool.")
+
+    def invalidate(self, flow_id: str):
+        """Removes the instance of flow_id from the pool (e.g. when the instance is deleted).
+
+        :param flow_id: The id of the flow instance
+        :type flow_id: str
+        """
+        with self._lock:
+            self._instances.pop(flow_id, None)
+
+    def clear(self):
+        """Removes all instances from the pool."""
+        with self._lock:
+            self._instances.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit, miss and eviction counters of the pool.
+
+        :return: The statistics of the pool
+        :rtype: Dict[str, int]
+        """
+        with self._lock:
+            return {
+                "size": len(self._instances),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        """Returns the number of pooled instances."""
+        with self._lock:
+            return len(self._instances)
@@ -0,0 +1,65 @@
+"""Measures the per-message encoding and decoding time and the size of FlowMessages with the serialization codecs of
+aiflows.utils.io_utils (legacy JSON, compact JSON and the binary codec).
+
+Usage: python benchmarks/message_codec.py [--repeats 2000]
+"""
+import json
+import argparse
+import time
+import base64
+import os
+
+from aiflows.messages import FlowMessage
+from aiflows.utils.io_utils import SERIALIZATION_PARAMETERS
+
+
+def make_messages():
+    chat_history = [
+        {"role": "user" if i % 2 else "assistant", "content": f"Turn {i}: what does the flow return? " * 8}
+        for i in range(20)
+    ]
+    return {
+        "small": FlowMessage(data={"query": "What is the capital of France?"}, src_flow="Proxy", dst_flow="QA"),
+        "chat history": FlowMessage(data={"chat_history": chat_history, "temperature": 0.7}, src_flow="A", dst_flow="B"),
+        "non-ascii": FlowMessage(data={"text": "Données représentées en entrée: 数据流 " * 100}, src_flow="A", dst_flow="B"),
+        "image (base64)": FlowMessage(
+            data={"image": base64.b64encode(os.urandom(200_000)).decode("ascii")}, src_flow="A", dst_flow="B"
+        ),
+    }
+
+
+def legacy_json_serialize(data):
+    return json.dumps(data).encode("utf-8")
+
+
+def time_per_call(fn, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=2000)
+    args = parser.parse_args()
+
+    codecs = {"legacy json": None, "compact json": "json", "binary": "binary"}
+
+    print(f"{'message':<16}{'codec':<22}{'size (B)':>10}{'encode (us)':>13}{'decode (us)':>13}")
+    for message_name, message in make_messages().items():
+        repeats = max(10, args.repeats // 100) if message_name.startswith("image") else args.repeats
+        for codec_name, codec in codecs.items():
+            SERIALIZATION_PARAMETERS.codec = codec
+            if codec is None:
+                encoded = legacy_json_serialize(message.to_dict())
+                encode_time = time_per_call(lambda: legacy_json_serialize(message.to_dict()), repeats)
+            else:
+                encoded = message.serialize()
+                encode_time = time_per_call(message.serialize, repeats)
+            decode_time = time_per_call(lambda: FlowMessage.deserialize(encoded), repeats)
+            print(f"{message_name:<16}{codec_name:<22}{len(encoded):>10}{encode_time:>13.1f}{decode_time:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
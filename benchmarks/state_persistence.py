@@ -0,0 +1,92 @@
+"""Measures what is written to the storage when the state of a mounted flow instance is persisted (with an in-memory
+stand-in for CoLink storage).
+
+Usage: python benchmarks/state_persistence.py
+"""
+from aiflows.base_flows import AtomicFlow
+from aiflows.messages import FlowMessage
+from aiflows.utils.state_journal import (
+    STATE_JOURNAL_PARAMETERS,
+    persist_flow_state,
+    write_state_snapshot,
+)
+
+MOUNT_PATH = "flows:ChatFlow:mounts:local:0"
+
+
+class InMemoryCoLink:
+    """Stands in for the storage of a CoLink client, counting the entries written."""
+
+    def __init__(self):
+        self.entries = {}
+        self.num_writes = 0
+        self.num_bytes_written = 0
+
+    def get_user_id(self):
+        return "user"
+
+    def read_entry(self, key):
+        return self.entries.get(key, None)
+
+    def update_entry(self, key, value):
+        self.entries[key] = value
+        self.num_writes += 1
+        self.num_bytes_written += len(value)
+
+    create_entry = update_entry
+
+    def delete_entry(self, key):
+        self.entries.pop(key, None)
+
+
+class ChatFlow(AtomicFlow):
+    """Appends the content of the input messages to its chat history (messages without content leave it unchanged)."""
+
+    def set_up_flow_state(self):
+        super().set_up_flow_state()
+        self.flow_state["chat_history"] = []
+        self.flow_state["documents"] = [f"Document {i}: " + "lorem ipsum " * 50 for i in range(200)]
+        self.flow_state["settings"] = {"temperature": 0.7}
+
+    def run(self, input_message):
+        if input_message.data.get("content") is not None:
+            self.flow_state["chat_history"].append(input_message.data["content"])
+
+
+def run(flow: ChatFlow, content=None):
+    flow(FlowMessage(data={"content": content}, src_flow="User", dst_flow="ChatFlow"))
+
+
+def make_flow() -> ChatFlow:
+    flow = ChatFlow(flow_config=AtomicFlow.get_config(name="ChatFlow", description="Chat flow"))
+    flow.checkpoint_flow_state()
+    return flow
+
+
+def measure_bytes_written(use_journal: bool, num_runs: int = 10) -> float:
+    """Returns the number of bytes written to the storage per run of a flow whose runs change a small part of its
+    state."""
+    enabled = STATE_JOURNAL_PARAMETERS.enabled
+    STATE_JOURNAL_PARAMETERS.enabled = use_journal
+    try:
+        cl = InMemoryCoLink()
+        flow = make_flow()
+        write_state_snapshot(cl, MOUNT_PATH, flow.flow_state.snapshot())
+
+        num_bytes_written = cl.num_bytes_written
+        for i in range(num_runs):
+            run(flow, f"message {i}")
+            persist_flow_state(cl, MOUNT_PATH, flow)
+    finally:
+        STATE_JOURNAL_PARAMETERS.enabled = enabled
+
+    return (cl.num_bytes_written - num_bytes_written) / num_runs
+
+
+def main():
+    print(f"full snapshots: {measure_bytes_written(use_journal=False):.0f} B written per run")
+    print(f"state journal: {measure_bytes_written(use_journal=True):.0f} B written per run")
+
+
+if __name__ == "__main__":
+    main()
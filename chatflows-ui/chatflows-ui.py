@@ -9,6 +9,7 @@ import threading
 from aiflows.messages import FlowMessage
 from aiflows.utils.io_utils import coflows_deserialize, coflows_serialize
 from aiflows.utils import serving
+from aiflows.utils.state_journal import read_state, persist_flow_state
 from aiflows.utils.general_helpers import read_yaml_file
 from aiflows.utils.constants import (
     COFLOWS_PATH,
@@ -65,7 +66,7 @@ def setup_human_flow(cl, flow_endpoint):
     config_overrides = coflows_deserialize(
         cl.read_entry(f"{mount_path}:config_overrides")
     )
-    state = coflows_deserialize(cl.read_entry(f"{mount_path}:state"), use_pickle=True)
+    state = read_state(cl, mount_path)
     st.session_state["human_flow"] = create_flow(None, config_overrides, state)
     st.session_state["human_flow"].set_colink(cl)
 
@@ -78,10 +79,8 @@ def setup_human_flow(cl, flow_endpoint):
 
 def save_state_to_colink():
     st.session_state["human_flow"].flow_state["chats"] = st.session_state["chats"]
-    new_state = st.session_state["human_flow"].__getstate__()["flow_state"]
-    st.session_state["cl"].update_entry(
-        f"{st.session_state.mount_path}:state",
-        coflows_serialize(new_state, use_pickle=True),
+    persist_flow_state(
+        st.session_state["cl"], st.session_state.mount_path, st.session_state["human_flow"]
     )
 
 
@@ -0,0 +1,55 @@
+import asyncio
+import gc
+
+from aiflows.backends.api_info import ApiInfo
+from aiflows.backends.llm_lite import LiteLLMBackend
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def make_backend():
+    return LiteLLMBackend(
+        api_infos=[ApiInfo(backend_used="openai", api_key="fakek1")],
+        model_name="fake/echo",
+        fake_llm={"latency_distribution": "constant", "latency_mean": 0.0, "time_per_token": 0.0},
+        max_concurrent_requests=1,
+        wait_time_per_key=0,
+    )
+
+
+async def is_blocked(task: asyncio.Task) -> bool:
+    await asyncio.sleep(0.05)
+    return not task.done()
+
+
+def test_streams_hold_their_permit_until_exhausted():
+    async def main():
+        backend = make_backend()
+        stream = await backend.astream(messages=MESSAGES)
+        next_stream = asyncio.ensure_future(backend.astream(messages=MESSAGES))
+        assert await is_blocked(next_stream)
+
+        assert len(await stream.get_messages()) == 1
+        assert len(await (await next_stream).get_messages()) == 1
+        await asyncio.wait_for(backend.acall(messages=MESSAGES), timeout=1)
+
+    asyncio.run(main())
+
+
+def test_closed_and_dropped_streams_release_their_permit():
+    async def main():
+        backend = make_backend()
+        stream = await backend.astream(messages=MESSAGES)
+        next_stream = asyncio.ensure_future(backend.astream(messages=MESSAGES))
+        assert await is_blocked(next_stream)
+        await stream.aclose()
+
+        stream = await asyncio.wait_for(next_stream, timeout=1)
+        del next_stream
+        next_call = asyncio.ensure_future(backend.acall(messages=MESSAGES))
+        assert await is_blocked(next_call)
+        del stream
+        gc.collect()
+        assert len(await asyncio.wait_for(next_call, timeout=1)) == 1
+
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+
+from aiflows.backends import rate_limiter
+from aiflows.backends.rate_limiter import RATE_LIMIT_PARAMETERS, SharedRateLimiter, get_rate_limiter
+
+
+@pytest.fixture
+def fresh_rate_limiter():
+    shared_state_path = RATE_LIMIT_PARAMETERS.shared_state_path
+    previous_rate_limiter = rate_limiter._rate_limiter
+    RATE_LIMIT_PARAMETERS.shared_state_path = None
+    rate_limiter._rate_limiter = None
+    yield
+    RATE_LIMIT_PARAMETERS.shared_state_path = shared_state_path
+    rate_limiter._rate_limiter = previous_rate_limiter
+
+
+def test_keys_survive_a_change_of_the_shared_state_path(fresh_rate_limiter, tmp_path):
+    get_rate_limiter().register_key("key", requests_per_minute=60)
+
+    RATE_LIMIT_PARAMETERS.shared_state_path = str(tmp_path / "rate_limits.sqlite")
+    assert isinstance(get_rate_limiter(), SharedRateLimiter)
+    assert get_rate_limiter().reserve(["key"]) == ("key", 0)
+
+    RATE_LIMIT_PARAMETERS.shared_state_path = None
+    assert not isinstance(get_rate_limiter(), SharedRateLimiter)
+    assert get_rate_limiter().reserve(["key"])[0] == "key"
+    assert get_rate_limiter().get_registered_limits() == {"key": {"requests_per_minute": 60}}
+
+
+def test_backend_keys_survive_a_change_of_the_shared_state_path(fresh_rate_limiter, tmp_path):
+    from aiflows.backends.api_info import ApiInfo
+    from aiflows.backends.llm_lite import LiteLLMBackend
+
+    backend = LiteLLMBackend(api_infos=[ApiInfo(backend_used="openai", api_key="fakek1")], model_name="fake/echo")
+    RATE_LIMIT_PARAMETERS.shared_state_path = str(tmp_path / "rate_limits.sqlite")
+    assert len(backend(messages=[{"role": "user", "content": "hi"}])) == 1
+    RATE_LIMIT_PARAMETERS.shared_state_path = None
+    assert len(backend(messages=[{"role": "user", "content": "hi"}])) == 1
+
+
+def test_missing_rows_are_registered_again(tmp_path):
+    limiter = SharedRateLimiter(str(tmp_path / "rate_limits.sqlite"))
+    limiter.register_key("key", requests_per_minute=60, max_burst_requests=1)
+    limiter._get_connection().execute("DELETE FROM rate_limits")
+
+    assert limiter.reserve(["key"]) == ("key", 0)
+    assert limiter.reserve(["key"])[1] > 0
+    assert limiter.stats(["key"])["key"]["requests"] == 2
+
+
+def test_errors_fall_back_to_the_local_limiter(tmp_path):
+    limiter = SharedRateLimiter(str(tmp_path / "rate_limits.sqlite"))
+    limiter.register_key("key", requests_per_minute=60)
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    limiter._transaction = fail
+    assert limiter.reserve(["key"]) == ("key", 0)
+    limiter.adjust_tokens("key", 10)
+    assert limiter.stats(["key"])["key"]["requests"] == 1
@@ -0,0 +1,67 @@
+import threading
+
+from aiflows.backends.api_info import ApiInfo
+from aiflows.backends.llm_lite import LiteLLMBackend
+from aiflows.backends.request_batcher import RequestBatcherRegistry
+
+
+def make_backend(**params):
+    backend = LiteLLMBackend(
+        api_infos=[ApiInfo(backend_used="openai", api_key="fakek1")], model_name="fake/echo", **params
+    )
+    calls = []
+
+    def call_with_next_key(**kwargs):
+        calls.append(kwargs)
+        return [kwargs["messages"][-1]["content"]] * kwargs.get("n", 1)
+
+    backend._call_with_next_key = call_with_next_key
+    return backend, calls
+
+
+def get_registry() -> RequestBatcherRegistry:
+    return LiteLLMBackend._LiteLLMBackend__request_batchers
+
+
+def test_batchers_are_removed_once_idle():
+    backend, calls = make_backend(sampling_coalesce_wait_ms=1)
+
+    for i in range(200):
+        prompt = f"prompt {i}"
+        assert backend._sample(messages=[{"role": "user", "content": prompt}], n=2) == [prompt, prompt]
+
+    assert len(calls) == 200
+    assert len(get_registry()) == 0
+
+
+def test_concurrent_identical_calls_are_coalesced():
+    backend, calls = make_backend(sampling_coalesce_wait_ms=200)
+    results = []
+
+    def sample():
+        results.append(backend._sample(messages=[{"role": "user", "content": "same"}], n=2))
+
+    threads = [threading.Thread(target=sample) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [["same", "same"]] * 4
+    assert [call["n"] for call in calls] == [8]
+    assert len(get_registry()) == 0
+
+
+def test_stats_are_aggregated_per_backend():
+    backend, _ = make_backend(sampling_coalesce_wait_ms=1, sampling_coalesce_max_n=100)
+    other_backend, _ = make_backend(sampling_coalesce_wait_ms=1, sampling_coalesce_max_n=101)
+
+    backend._sample(messages=[{"role": "user", "content": "a"}], n=1)
+    backend._sample(messages=[{"role": "user", "content": "b"}], n=3)
+    other_backend._sample(messages=[{"role": "user", "content": "c"}], n=2)
+
+    stats = backend.sampling_coalesce_stats()
+    assert stats["batches"] == 2
+    assert stats["inputs"] == 4
+    assert other_backend.sampling_coalesce_stats()["batches"] == 1
+    assert make_backend()[0].sampling_coalesce_stats() is None
@@ -0,0 +1,70 @@
+import pytest
+
+from aiflows.base_flows import AtomicFlow, abstract
+from aiflows.flow_cache import CACHING_PARAMETERS
+from aiflows.messages import FlowMessage
+
+
+class FakeCoLink:
+    def get_user_id(self):
+        return "local"
+
+
+class CountingFlow(AtomicFlow):
+    """Replies with the number of times it ran (and pushes a request to another flow if asked to)."""
+
+    SUPPORTS_CACHING = True
+
+    def set_up_flow_state(self):
+        super().set_up_flow_state()
+        self.flow_state["num_runs"] = 0
+
+    def run(self, input_message):
+        self.flow_state["num_runs"] += 1
+        if input_message.data.get("push", False):
+            self.send_message(FlowMessage(data={"query": "hi"}, src_flow=self.name, dst_flow="Other"))
+        self.send_message(self.package_output_message(input_message, {"num_runs": self.flow_state["num_runs"]}))
+
+
+@pytest.fixture
+def sent_messages(monkeypatch, tmp_path):
+    cache_dir, do_caching = CACHING_PARAMETERS.cache_dir, CACHING_PARAMETERS.do_caching
+    CACHING_PARAMETERS.cache_dir, CACHING_PARAMETERS.do_caching = str(tmp_path), True
+
+    messages = {"replies": [], "requests": []}
+    monkeypatch.setattr(abstract, "dispatch_response", lambda cl, message, reply_data: messages["replies"].append(message))
+    monkeypatch.setattr(abstract, "push_to_flow", lambda cl, user_id, flow_id, message: messages["requests"].append(message))
+    yield messages
+    CACHING_PARAMETERS.cache_dir, CACHING_PARAMETERS.do_caching = cache_dir, do_caching
+
+
+def make_flow() -> CountingFlow:
+    config = AtomicFlow.get_config(
+        name="CountingFlow", description="Counts its runs", enable_cache=True, flow_id="0", user_id="local"
+    )
+    flow = CountingFlow(flow_config=config)
+    flow.set_colink(FakeCoLink())
+    return flow
+
+
+def call(flow, **data):
+    flow(FlowMessage(data=data, src_flow="User", dst_flow="CountingFlow"))
+
+
+def test_replies_are_replayed_from_the_cache(sent_messages):
+    call(make_flow(), x=1)
+    flow = make_flow()
+    call(flow, x=1)
+
+    assert [reply.data for reply in sent_messages["replies"]] == [{"num_runs": 1}, {"num_runs": 1}]
+    assert flow.flow_state.peek("num_runs") == 1
+    assert flow.flow_config["flow_id"] == "0"
+
+
+def test_runs_sending_requests_are_not_cached(sent_messages):
+    call(make_flow(), x=1, push=True)
+    call(make_flow(), x=1, push=True)
+
+    # both runs ran (and sent their request to the other flow)
+    assert len(sent_messages["requests"]) == 2
+    assert [reply.data for reply in sent_messages["replies"]] == [{"num_runs": 1}, {"num_runs": 1}]
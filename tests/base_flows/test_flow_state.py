@@ -0,0 +1,95 @@
+import pickle
+
+from aiflows.base_flows.flow_state import FlowState
+from aiflows.flow_cache.flow_cache import CachingKey
+
+
+def test_written_values_are_copied():
+    history = ["hi"]
+    state = FlowState()
+    state["history"] = history
+    state.checkpoint()
+
+    history.append("lost")
+    assert state.peek("history") == ["hi"]
+    assert not state.has_changes()
+
+
+def test_state_update_dict_does_not_alias_the_caller(chat_flow):
+    history = ["hi"]
+    chat_flow._state_update_dict({"chat_history": history})
+    snapshot = chat_flow.flow_state.snapshot()
+    chat_flow.checkpoint_flow_state()
+
+    history.append("lost")
+    assert chat_flow.flow_state.peek("chat_history") == ["hi"]
+    assert snapshot["chat_history"] == ["hi"]
+    assert not chat_flow.flow_state.has_changes()
+
+
+def test_snapshot_is_independent_of_later_modifications():
+    state = FlowState(history=["a"])
+    snapshot = state.snapshot()
+    state["history"].append("b")
+    assert snapshot["history"] == ["a"]
+    assert state.peek("history") == ["a", "b"]
+
+    # a value read before the snapshot is copied into the snapshot
+    history = state["history"]
+    snapshot = state.snapshot()
+    history.append("c")
+    assert snapshot["history"] == ["a", "b"]
+    assert state.peek("history") == ["a", "b", "c"]
+
+
+def test_checkpoint_detaches_lent_values():
+    state = FlowState(history=[])
+    history = state["history"]
+    history.append("a")
+    changes, _ = state.checkpoint()
+    assert changes == {"history": ["a"]}
+
+    history.append("b")
+    assert changes["history"] == ["a"]
+    assert state.peek("history") == ["a"]
+    assert not state.has_changes()
+
+
+def test_reads_through_mutable_paths_are_tracked():
+    state = FlowState(history=[], name="flow")
+    state.checkpoint()
+
+    assert state["name"] == "flow"
+    assert not state.has_changes()
+    state.get("history").append("a")
+    assert state.changed_keys() == {"history"}
+
+
+def test_read_only_copies_do_not_mark_keys(chat_flow):
+    state = chat_flow.flow_state
+
+    state.snapshot()
+    chat_flow.__getstate__()
+    CachingKey(chat_flow, {"content": "hi"}, []).hash_string()
+    pickle.dumps(state)
+    assert not state.has_changes(), state.changed_keys()
+
+    state["chat_history"].append("hi")
+    assert state.changed_keys() == {"chat_history"}
+    chat_flow.checkpoint_flow_state()
+    assert not state.has_changes()
+
+
+def test_getstate_copies_the_config(chat_flow):
+    flow_config = chat_flow.__getstate__()["flow_config"]
+    flow_config["name"] = "Other"
+    assert chat_flow.flow_config["name"] == "ChatFlow"
+
+
+def test_deleted_keys():
+    state = FlowState(a=1, b=2)
+    state.checkpoint()
+    del state["a"]
+    state.pop("b")
+    assert state.deleted_keys() == {"a", "b"}
+    assert state.checkpoint() == ({}, {"a", "b"})
@@ -0,0 +1,72 @@
+import copy
+import importlib
+import pickle
+import sys
+
+import pytest
+
+from aiflows.base_flows.abstract import CONFIG_PARAMETERS, Flow
+
+FLOW_MODULE = """
+from aiflows.base_flows import AtomicFlow
+
+
+class YamlFlow(AtomicFlow):
+    pass
+"""
+
+
+@pytest.fixture
+def yaml_flow(tmp_path, monkeypatch):
+    (tmp_path / "yaml_flow_module.py").write_text(FLOW_MODULE)
+    (tmp_path / "YamlFlow.yaml").write_text("name: YamlFlow\ndescription: A flow\nbackend:\n  model_name: a\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield importlib.import_module("yaml_flow_module").YamlFlow, tmp_path / "YamlFlow.yaml"
+    del sys.modules["yaml_flow_module"]
+    Flow.clear_default_config_cache()
+
+
+def test_overrides_are_copied_and_the_rest_is_frozen(yaml_flow):
+    flow_class, _ = yaml_flow
+    config = flow_class.get_config(backend={"temperature": 0.5}, name="Renamed")
+
+    assert config["backend"] == {"model_name": "a", "temperature": 0.5}
+    config["backend"]["model_name"] = "b"
+    config["description"] = "Changed"
+    with pytest.raises(TypeError):
+        config["private_keys"].append("key")
+
+    default_config = flow_class.get_config()
+    assert default_config["backend"] == {"model_name": "a"}
+    assert default_config["name"] == "YamlFlow"
+    assert default_config["description"] == "A flow"
+    assert default_config["private_keys"] == []
+
+
+def test_copies_are_modifiable(yaml_flow):
+    flow_class, _ = yaml_flow
+    config = flow_class.get_config()
+
+    for copied_config in [copy.deepcopy(config), pickle.loads(pickle.dumps(config))]:
+        copied_config["backend"]["model_name"] = "b"
+        copied_config["private_keys"].append("key")
+    flow = flow_class.instantiate_from_default_config()
+    flow.flow_config["backend"]["model_name"] = "b"
+
+    assert flow_class.get_config()["backend"] == {"model_name": "a"}
+
+
+def test_yaml_files_are_only_checked_in_reload_mode(yaml_flow, monkeypatch):
+    flow_class, path_to_config = yaml_flow
+    assert flow_class.get_config()["backend"]["model_name"] == "a"
+    path_to_config.write_text("name: YamlFlow\ndescription: A flow\nbackend:\n  model_name: changed\n")
+
+    def fail():
+        raise AssertionError("The yaml files were checked")
+
+    with monkeypatch.context() as m:
+        m.setattr(flow_class, "_get_default_config_signature", classmethod(lambda cls: fail()))
+        assert flow_class.get_config()["backend"]["model_name"] == "a"
+
+    monkeypatch.setattr(CONFIG_PARAMETERS, "reload_default_configs", True)
+    assert flow_class.get_config()["backend"]["model_name"] == "changed"
@@ -0,0 +1,17 @@
+import pytest
+
+from aiflows.base_flows import AtomicFlow
+
+from tests.helpers import ChatFlow, InMemoryCoLink
+
+
+@pytest.fixture
+def cl() -> InMemoryCoLink:
+    return InMemoryCoLink()
+
+
+@pytest.fixture
+def chat_flow() -> ChatFlow:
+    flow = ChatFlow(flow_config=AtomicFlow.get_config(name="ChatFlow", description="Chat flow"))
+    flow.checkpoint_flow_state()
+    return flow
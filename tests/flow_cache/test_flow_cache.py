@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from aiflows.flow_cache import CACHING_PARAMETERS, FlowCache
+from aiflows.flow_cache.tiers import MemoryCacheTier
+
+
+@pytest.fixture
+def caching_parameters(monkeypatch, tmp_path):
+    monkeypatch.setattr(CACHING_PARAMETERS, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(CACHING_PARAMETERS, "write_behind", False)
+    # disk reads are only counted as accesses when the memory tier misses
+    monkeypatch.setattr(CACHING_PARAMETERS, "memory_max_entries", 0)
+    return CACHING_PARAMETERS
+
+
+@pytest.mark.parametrize("eviction_policy", ["least-recently-used", "least-frequently-used"])
+def test_entry_limit_keeps_hot_entries(caching_parameters, monkeypatch, eviction_policy):
+    monkeypatch.setattr(caching_parameters, "eviction_policy", eviction_policy)
+    monkeypatch.setattr(caching_parameters, "max_cached_entries", 3)
+    cache = FlowCache()
+
+    for key in ["hot", "cold1", "cold2"]:
+        cache.set(key, key)
+    for _ in range(3):
+        assert cache.get("hot") == "hot"
+    cache.get("cold2")
+    cache.set("new", "new")
+
+    assert len(cache) == 3
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("hot") == "hot"
+
+
+def test_entry_limit_evicts_least_recently_stored(caching_parameters, monkeypatch):
+    monkeypatch.setattr(caching_parameters, "eviction_policy", "least-recently-stored")
+    monkeypatch.setattr(caching_parameters, "max_cached_entries", 2)
+    cache = FlowCache()
+
+    for key in ["first", "second"]:
+        cache.set(key, key)
+    cache.get("first")
+    cache.set("third", "third")
+
+    assert cache.get("first") is None
+    assert cache.get("second") == "second"
+
+
+def test_disk_hits_keep_their_ttl_in_memory(caching_parameters, monkeypatch):
+    monkeypatch.setattr(caching_parameters, "memory_max_entries", 16)
+    cache = FlowCache()
+    cache.set("key", "value", ttl=0.2)
+    cache._tiers.memory.clear()
+
+    assert cache.get("key") == "value"
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.get("key") == "value"
+    assert cache.stats()["memory_hits"] == 1
+
+    time.sleep(0.3)
+    assert cache.get("key") is None
+
+
+def test_memory_tier_smaller_than_its_shards():
+    tier = MemoryCacheTier(max_entries=10, max_bytes=2**20, num_shards=16)
+    tier.set("key", b"payload")
+
+    assert tier.get("key") == b"payload"
+    assert sum(shard.max_entries for shard in tier._shards) == 10
+    assert sum(shard.max_entries for shard in MemoryCacheTier(10, 2**20, num_shards=3)._shards) == 10
@@ -0,0 +1,43 @@
+from aiflows.base_flows import AtomicFlow
+from aiflows.messages import FlowMessage
+
+
+class ChatFlow(AtomicFlow):
+    """Appends the content of the input messages to its chat history (messages without content leave it unchanged)."""
+
+    def set_up_flow_state(self):
+        super().set_up_flow_state()
+        self.flow_state["chat_history"] = []
+        self.flow_state["documents"] = [f"Document {i}" for i in range(10)]
+        self.flow_state["settings"] = {"temperature": 0.7}
+
+    def run(self, input_message):
+        if input_message.data.get("content") is not None:
+            self.flow_state["chat_history"].append(input_message.data["content"])
+
+
+class InMemoryCoLink:
+    """Stands in for the storage of a CoLink client, counting the entries written."""
+
+    def __init__(self):
+        self.entries = {}
+        self.num_writes = 0
+
+    def get_user_id(self):
+        return "user"
+
+    def read_entry(self, key):
+        return self.entries.get(key, None)
+
+    def update_entry(self, key, value):
+        self.entries[key] = value
+        self.num_writes += 1
+
+    create_entry = update_entry
+
+    def delete_entry(self, key):
+        self.entries.pop(key, None)
+
+
+def run_chat_flow(flow: ChatFlow, content=None):
+    flow(FlowMessage(data={"content": content}, src_flow="User", dst_flow="ChatFlow"))
@@ -0,0 +1,73 @@
+import pytest
+
+from aiflows.base_flows import AtomicFlow
+from aiflows.history import LoggingMessageSink, MessageSink, add_message_sink, get_message_sinks, remove_message_sink
+from aiflows.messages import Message
+from aiflows.utils import logging
+
+from tests.helpers import ChatFlow, run_chat_flow
+
+
+class RecordingSink(MessageSink):
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.messages = []
+
+    def is_enabled(self) -> bool:
+        return self.enabled
+
+    def emit(self, flow_name, message):
+        self.messages.append((flow_name, message))
+
+
+@pytest.fixture
+def sinks():
+    added_sinks = []
+
+    def add(sink):
+        add_message_sink(sink)
+        added_sinks.append(sink)
+        return sink
+
+    yield add
+    for sink in added_sinks:
+        remove_message_sink(sink)
+
+
+@pytest.fixture
+def unformattable_messages(monkeypatch):
+    def fail(self):
+        raise AssertionError("A message was formatted")
+
+    monkeypatch.setattr(Message, "to_string", fail)
+
+
+def test_enabled_sinks_receive_the_messages(chat_flow, sinks):
+    enabled_sink, disabled_sink = sinks(RecordingSink(enabled=True)), sinks(RecordingSink(enabled=False))
+    run_chat_flow(chat_flow, "hi")
+
+    assert len(enabled_sink.messages) > 0
+    assert {flow_name for flow_name, _ in enabled_sink.messages} == {"ChatFlow"}
+    assert disabled_sink.messages == []
+
+    remove_message_sink(enabled_sink)
+    assert enabled_sink not in get_message_sinks()
+
+
+def test_disabled_logging_doesnt_format_messages(chat_flow, sinks, unformattable_messages):
+    logger = logging.get_logger("tests.history")
+    logger.setLevel(logging.INFO)
+    sinks(LoggingMessageSink(logger=logger))
+
+    run_chat_flow(chat_flow, "hi")
+    assert chat_flow.flow_state["chat_history"] == ["hi"]
+
+
+def test_history_keeps_the_last_messages(unformattable_messages):
+    flow_config = AtomicFlow.get_config(name="ChatFlow", description="Chat flow", max_history_messages=2)
+    flow = ChatFlow(flow_config=flow_config)
+    for content in ["a", "b", "c"]:
+        run_chat_flow(flow, content)
+
+    assert len(flow.history) == 2
+    assert [message.data.get("content", None) for message in flow.history] == ["c", None]
@@ -0,0 +1,111 @@
+import pytest
+
+from aiflows.utils.io_utils import coflows_deserialize, coflows_serialize
+from aiflows.utils.state_journal import (
+    STATE_JOURNAL_PARAMETERS,
+    append_state_delta,
+    persist_flow_state,
+    read_state,
+    write_state_snapshot,
+)
+
+from tests.helpers import InMemoryCoLink, run_chat_flow
+
+MOUNT_PATH = "flows:ChatFlow:mounts:local:0"
+
+
+@pytest.fixture
+def journal():
+    enabled, max_deltas = STATE_JOURNAL_PARAMETERS.enabled, STATE_JOURNAL_PARAMETERS.max_deltas
+    STATE_JOURNAL_PARAMETERS.enabled = True
+    yield STATE_JOURNAL_PARAMETERS
+    STATE_JOURNAL_PARAMETERS.enabled, STATE_JOURNAL_PARAMETERS.max_deltas = enabled, max_deltas
+
+
+class CompactingCoLink(InMemoryCoLink):
+    """Runs a callback (once) right after a given entry is read, and can defer the deletions."""
+
+    def __init__(self):
+        super().__init__()
+        self.on_read = None
+        self.defer_deletes = False
+        self.deferred_deletes = []
+
+    def read_entry(self, key):
+        value = super().read_entry(key)
+        if self.on_read is not None and self.on_read[0] == key:
+            callback, self.on_read = self.on_read[1], None
+            callback()
+        return value
+
+    def delete_entry(self, key):
+        if self.defer_deletes:
+            self.deferred_deletes.append(key)
+        else:
+            super().delete_entry(key)
+
+
+def make_journal(cl, num_deltas: int):
+    write_state_snapshot(cl, MOUNT_PATH, {"counter": 0})
+    for i in range(1, num_deltas + 1):
+        append_state_delta(cl, MOUNT_PATH, {"counter": i}, [])
+
+
+def test_deltas_contain_the_changed_keys(cl, chat_flow, journal):
+    write_state_snapshot(cl, MOUNT_PATH, chat_flow.flow_state.snapshot())
+    for i in range(3):
+        run_chat_flow(chat_flow, f"message {i}")
+        persist_flow_state(cl, MOUNT_PATH, chat_flow)
+        delta = coflows_deserialize(cl.read_entry(f"{MOUNT_PATH}:state_journal:{i + 1}"), use_pickle=True)
+        assert set(delta["changes"]) == {"chat_history"}
+
+    assert read_state(cl, MOUNT_PATH) == chat_flow.flow_state.snapshot()
+
+
+def test_compaction(cl, journal):
+    journal.max_deltas = 3
+    write_state_snapshot(cl, MOUNT_PATH, {"counter": 0, "kept": True})
+    for i in range(1, 8):
+        append_state_delta(cl, MOUNT_PATH, {"counter": i}, [])
+        assert read_state(cl, MOUNT_PATH) == {"counter": i, "kept": True}
+
+    # compacted twice, the remaining deltas are the ones after the last snapshot
+    assert sorted(k for k in cl.entries if k.startswith(f"{MOUNT_PATH}:state_journal:")) == [
+        f"{MOUNT_PATH}:state_journal:{seq}" for seq in (5, 6, 7)
+    ]
+
+
+def test_compaction_snapshots_the_journaled_state(cl, journal):
+    journal.max_deltas = 1
+    write_state_snapshot(cl, MOUNT_PATH, {"a": 1})
+    append_state_delta(cl, MOUNT_PATH, {"b": 2}, [])
+    append_state_delta(cl, MOUNT_PATH, {"c": 3}, ["a"])
+    assert read_state(cl, MOUNT_PATH) == {"b": 2, "c": 3}
+
+
+def test_read_skips_the_deltas_of_a_newer_snapshot(journal):
+    cl = CompactingCoLink()
+    journal.max_deltas = 3
+    make_journal(cl, 3)
+
+    # a compaction between the reads of the journal info and of the snapshot, whose old deltas are not deleted yet
+    cl.defer_deletes = True
+    cl.on_read = (f"{MOUNT_PATH}:state_journal", lambda: append_state_delta(cl, MOUNT_PATH, {"counter": 4}, []))
+    assert read_state(cl, MOUNT_PATH) == {"counter": 4}
+    assert len(cl.deferred_deletes) == 3
+
+
+def test_read_retries_when_deltas_are_compacted_away(journal):
+    cl = CompactingCoLink()
+    journal.max_deltas = 3
+    make_journal(cl, 3)
+
+    # a compaction between the reads of the snapshot and of the deltas
+    cl.on_read = (f"{MOUNT_PATH}:state", lambda: append_state_delta(cl, MOUNT_PATH, {"counter": 4}, []))
+    assert read_state(cl, MOUNT_PATH) == {"counter": 4}
+
+
+def test_state_without_sequence_number(cl):
+    # e.g. the initial state written when the flow is mounted
+    cl.update_entry(f"{MOUNT_PATH}:state", coflows_serialize({"a": 1}, use_pickle=True))
+    assert read_state(cl, MOUNT_PATH) == {"a": 1}
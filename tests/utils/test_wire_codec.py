@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from aiflows.utils import wire_codec
+from aiflows.utils.io_utils import SERIALIZATION_PARAMETERS, coflows_deserialize, coflows_serialize
+
+DATA = {
+    "query": "Données 数据",
+    "history": [{"role": "user", "content": "hi"}, ("a", 1, -2**40, 0.5, None, True)],
+    "empty": {},
+    "big": 2**63,
+}
+
+
+@pytest.fixture(params=["binary", "json"])
+def codec(request, monkeypatch):
+    monkeypatch.setattr(SERIALIZATION_PARAMETERS, "codec", request.param)
+    return request.param
+
+
+def test_round_trip():
+    encoded = wire_codec.encode(DATA)
+
+    assert wire_codec.is_encoded(encoded)
+    assert wire_codec.decode(encoded) == json.loads(json.dumps(DATA))
+
+
+def test_codecs_accept_the_same_data(codec):
+    data = {"scores": {1: 0.5, 2.5: 1, None: 3}, "flags": {False: "off"}, "nested": [{0: "a"}]}
+
+    assert coflows_deserialize(coflows_serialize(data)) == json.loads(json.dumps(data))
+    assert list(data["scores"]) == [1, 2.5, None]
+    with pytest.raises(TypeError):
+        coflows_serialize({"image": b"\x89PNG"})
+    with pytest.raises(TypeError):
+        coflows_serialize({(1, 2): "tuple key"})
+
+
+def test_string_keys_are_not_copied():
+    data = {"a": [{"b": 1}]}
+
+    assert wire_codec._to_json_types(data) is data
+
+
+def test_decode_rejects_other_data():
+    with pytest.raises(ValueError):
+        wire_codec.decode(json.dumps(DATA).encode("utf-8"))
+    with pytest.raises(ValueError):
+        wire_codec.decode(wire_codec.MAGIC + bytes((wire_codec.VERSION + 1, wire_codec.FORMAT_MSGPACK)))
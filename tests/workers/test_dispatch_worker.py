@@ -0,0 +1,38 @@
+from aiflows.utils.state_journal import get_state_version, read_state, write_state_snapshot
+from aiflows.workers.dispatch_worker import write_back_flow_state
+
+from tests.helpers import run_chat_flow
+
+MOUNT_PATH = "flows:ChatFlow:mounts:local:0"
+
+
+def test_unchanged_run_keeps_the_state_version(cl, chat_flow):
+    state_version = write_state_snapshot(cl, MOUNT_PATH, chat_flow.flow_state.snapshot())
+    num_writes = cl.num_writes
+
+    run_chat_flow(chat_flow)
+    assert write_back_flow_state(cl, MOUNT_PATH, chat_flow, state_version) == state_version
+    assert get_state_version(cl, MOUNT_PATH) == state_version
+    assert cl.num_writes == num_writes
+
+
+def test_changed_run_writes_the_state_back(cl, chat_flow):
+    state_version = write_state_snapshot(cl, MOUNT_PATH, chat_flow.flow_state.snapshot())
+
+    run_chat_flow(chat_flow, "hi")
+    new_state_version = write_back_flow_state(cl, MOUNT_PATH, chat_flow, state_version)
+    assert new_state_version != state_version
+    assert get_state_version(cl, MOUNT_PATH) == new_state_version
+    assert read_state(cl, MOUNT_PATH)["chat_history"] == ["hi"]
+
+
+def test_skipped_write_back_matches_the_live_state(cl, chat_flow):
+    # the caller keeps modifying a value it passed to the state: the state doesn't change, so skipping the write is safe
+    history = ["hi"]
+    chat_flow._state_update_dict({"chat_history": history})
+    state_version = write_back_flow_state(cl, MOUNT_PATH, chat_flow)
+
+    history.append("not in the state")
+    run_chat_flow(chat_flow)
+    assert write_back_flow_state(cl, MOUNT_PATH, chat_flow, state_version) == state_version
+    assert read_state(cl, MOUNT_PATH) == chat_flow.flow_state.snapshot()